@@ -0,0 +1,38 @@
+"""Run several benchmarks with their default parameters.
+
+Usage::
+
+    python -m benchmarks [--output results.jsonl] [benchmark ...]
+
+Without names, this runs the suite covering the request hot paths. Any
+``bench_<name>`` module can be named, e.g. ``python -m benchmarks login``.
+With ``--output``, results are appended to a file as JSON lines, tagged with
+the current commit (see `benchmarks.common.report`), so that runs on
+different commits can be compared.
+"""
+
+import os
+import sys
+import argparse
+import importlib
+
+SUITE = ("upload", "merge", "download", "listing", "auth")
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks")
+    parser.add_argument("--output", help="file to append JSON results to")
+    parser.add_argument("benchmarks", nargs="*", default=SUITE)
+    args = parser.parse_args(argv)
+
+    if args.output:
+        # read by benchmarks.common when results are reported
+        os.environ["SACHET_BENCH_OUTPUT"] = args.output
+
+    for name in args.benchmarks:
+        importlib.import_module(f"benchmarks.bench_{name}").main()
+        print()
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
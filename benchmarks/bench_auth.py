@@ -0,0 +1,71 @@
+"""Overhead of `auth_required`, for anonymous and token-authenticated requests.
+
+Requests fetch a share's metadata, which needs the read permission. Requests
+to an unknown URL, which skip authentication entirely, give the baseline cost
+of handling a request.
+
+Usage::
+
+    python -m benchmarks.bench_auth [requests]
+"""
+
+import sys
+import statistics
+from benchmarks.common import (
+    app,
+    db,
+    reset,
+    allow_anonymous,
+    Timer,
+    percentile,
+    report,
+)
+from sachet.server.models import Permissions, Share, User
+from sachet.server.users import manage
+from bitmask import Bitmask
+
+
+def main(requests=2000):
+    results = []
+
+    with app.test_client() as client, app.app_context():
+        reset()
+        allow_anonymous(Permissions.READ)
+        manage.create_user(Bitmask(Permissions.READ), "bench", "password")
+        share = Share(file_name="bench.bin")
+        db.session.add(share)
+        db.session.commit()
+        token = db.session.get(User, "bench").encode_token()
+        path = f"/files/{share.share_id}"
+
+        cases = dict(
+            baseline=("/nonexistent", {}, 404),
+            anonymous=(path, {}, 200),
+            token=(path, {"Authorization": f"bearer {token}"}, 200),
+        )
+        medians = {}
+
+        for name, (url, headers, status) in cases.items():
+            latencies = []
+            for _ in range(requests):
+                with Timer() as t:
+                    resp = client.get(url, headers=headers)
+                assert resp.status_code == status
+                latencies.append(t.elapsed)
+
+            medians[name] = statistics.median(latencies)
+            results.append(
+                dict(
+                    auth=name,
+                    p50_us=medians[name] * 1e6,
+                    p95_us=percentile(latencies, 95) * 1e6,
+                    overhead_us=(medians[name] - medians["baseline"]) * 1e6,
+                )
+            )
+        reset()
+
+    report("auth", results)
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:]))
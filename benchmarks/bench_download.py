@@ -0,0 +1,78 @@
+"""Download throughput for whole files and for byte ranges.
+
+Downloads go through a real WSGI server. Whole downloads are also counted
+against the share's download limit, while ranged downloads (resuming) are not.
+
+Usage::
+
+    python -m benchmarks.bench_download [size in MB] [requests] [range size in KB]
+"""
+
+import sys
+import random
+import statistics
+from benchmarks.common import (
+    app,
+    db,
+    reset,
+    allow_anonymous,
+    serve,
+    HTTPClient,
+    Timer,
+    percentile,
+    report,
+)
+from sachet.server.models import Permissions
+
+
+def main(size_mb=16, requests=50, range_kb=1024):
+    rand = random.Random(0)
+    data = rand.randbytes(size_mb * 2**20)
+    range_size = range_kb * 2**10
+    results = []
+
+    with app.app_context():
+        reset()
+        allow_anonymous(Permissions.CREATE, Permissions.READ)
+        db.session.commit()
+
+    with serve() as port:
+        client = HTTPClient(port)
+        path = client.create_share()
+        client.upload(path, data)
+
+        for mode in ("whole", "range"):
+            latencies = []
+            transferred = 0
+            with Timer() as t:
+                for _ in range(requests):
+                    headers = {}
+                    if mode == "range":
+                        start = rand.randrange(1, len(data) - range_size)
+                        headers["Range"] = f"bytes={start}-{start + range_size - 1}"
+                    with Timer() as request_time:
+                        status, body = client.request(
+                            "GET", path + "/content", headers=headers
+                        )
+                    assert status == (206 if mode == "range" else 200), body
+                    latencies.append(request_time.elapsed)
+                    transferred += len(body)
+
+            results.append(
+                dict(
+                    mode=mode,
+                    requests=requests,
+                    mb_per_s=transferred / 2**20 / t.elapsed,
+                    p50_ms=statistics.median(latencies) * 1000,
+                    p95_ms=percentile(latencies, 95) * 1000,
+                )
+            )
+
+    with app.app_context():
+        reset()
+
+    report("download", results)
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:]))
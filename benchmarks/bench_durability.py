@@ -0,0 +1,51 @@
+"""Upload throughput for each storage durability level.
+
+Usage::
+
+    python -m benchmarks.bench_durability [size in MB] [chunk size in KB]
+"""
+
+import sys
+import random
+from benchmarks.common import (
+    app,
+    storage,
+    reset,
+    allow_anonymous,
+    create_share,
+    upload,
+    Timer,
+    report,
+)
+from sachet.server.models import Permissions
+
+
+def main(size_mb=32, chunk_kb=512):
+    data = random.Random(0).randbytes(size_mb * 2**20)
+    results = []
+
+    with app.test_client() as client, app.app_context():
+        for level in storage.durability_levels:
+            reset()
+            allow_anonymous(Permissions.CREATE, Permissions.MODIFY)
+            storage.durability = level
+
+            url = create_share(client)
+            with Timer() as t:
+                upload(client, url, data, chunk_size=chunk_kb * 2**10)
+
+            results.append(
+                dict(
+                    durability=level,
+                    chunks=-(-len(data) // (chunk_kb * 2**10)),
+                    seconds=t.elapsed,
+                    mb_per_s=size_mb / t.elapsed,
+                )
+            )
+        reset()
+
+    report("durability", results)
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:]))
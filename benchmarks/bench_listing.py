@@ -0,0 +1,89 @@
+"""Latency of listing shares (``GET /files``), by amount of shares.
+
+Shares are owned by a user, and the amount of SQL queries per request is
+reported too, which should not grow with the page size.
+
+Usage::
+
+    python -m benchmarks.bench_listing [requests per measurement]
+"""
+
+import sys
+import statistics
+from bitmask import Bitmask
+from sqlalchemy import event
+from benchmarks.common import (
+    app,
+    db,
+    reset,
+    allow_anonymous,
+    Timer,
+    percentile,
+    report,
+)
+from sachet.server.models import Permissions, Share
+from sachet.server.users import manage
+
+TABLE_SIZES = (100, 1000, 10000, 50000)
+PAGE_SIZES = (15, 100)
+
+
+def main(requests=50):
+    results = []
+
+    with app.test_client() as client, app.app_context():
+        reset()
+        allow_anonymous(Permissions.LIST)
+        manage.create_user(Bitmask(Permissions.LIST), "bench", "password")
+        db.session.commit()
+        shares = 0
+
+        statements = []
+
+        def count_query(*args):
+            statements.append(args[2])
+
+        event.listen(db.engine, "before_cursor_execute", count_query)
+
+        for size in TABLE_SIZES:
+            db.session.add_all(
+                Share(owner_name="bench", file_name=f"bench{i}.bin")
+                for i in range(shares, size)
+            )
+            db.session.commit()
+            shares = size
+
+            for per_page in PAGE_SIZES:
+                # the first and the last page
+                for page in (1, -(-size // per_page)):
+                    latencies = []
+                    for _ in range(requests):
+                        # like a new request in production
+                        db.session.remove()
+                        statements.clear()
+                        with Timer() as t:
+                            resp = client.get(
+                                "/files",
+                                query_string=dict(page=page, per_page=per_page),
+                            )
+                        assert resp.status_code == 200, resp.get_json()
+                        latencies.append(t.elapsed)
+
+                    results.append(
+                        dict(
+                            shares=size,
+                            per_page=per_page,
+                            page=page,
+                            p50_ms=statistics.median(latencies) * 1000,
+                            p95_ms=percentile(latencies, 95) * 1000,
+                            queries=len(statements),
+                        )
+                    )
+        event.remove(db.engine, "before_cursor_execute", count_query)
+        reset()
+
+    report("listing", results)
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:]))
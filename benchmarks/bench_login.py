@@ -0,0 +1,88 @@
+"""Login throughput, and latency of other requests during a login storm.
+
+Threads log in as fast as they can, while another thread measures how long a
+cheap request takes. This compares hashing passwords in the request thread
+with hashing them in the process pool.
+
+Usage::
+
+    python -m benchmarks.bench_login [threads] [seconds] [rounds]
+"""
+
+import sys
+import time
+import threading
+import statistics
+from benchmarks.common import app, db, reset, Timer, report
+from sachet.server.models import Permissions
+from sachet.server.users import manage
+from bitmask import Bitmask
+
+CONFIGS = {
+    "inline": dict(SACHET_HASHING_WORKERS=0),
+    "pool": dict(SACHET_HASHING_WORKERS=2),
+}
+
+
+def main(threads=8, seconds=5, rounds=12):
+    results = []
+
+    for name, config in CONFIGS.items():
+        app.config.update(config, BCRYPT_LOG_ROUNDS=rounds)
+        with app.app_context():
+            app.extensions.pop("sachet_hashing", None)
+            reset()
+            manage.create_user(Bitmask(Permissions.READ), "bench", "password")
+            db.session.remove()
+
+        stop = threading.Event()
+        logins = [0] * threads
+        workers = [
+            threading.Thread(target=_login_loop, args=(stop, logins, i))
+            for i in range(threads)
+        ]
+        latencies = []
+
+        with Timer() as t:
+            for w in workers:
+                w.start()
+            with app.test_client() as client:
+                while time.perf_counter() < t.start + seconds:
+                    with Timer() as request_time:
+                        client.get("/whoami")
+                    latencies.append(request_time.elapsed)
+            stop.set()
+            for w in workers:
+                w.join()
+
+        with app.app_context():
+            app.extensions.pop("sachet_hashing").shutdown()
+
+        results.append(
+            dict(
+                config=name,
+                threads=threads,
+                logins_per_s=sum(logins) / t.elapsed,
+                other_p50_ms=statistics.median(latencies) * 1000,
+                other_max_ms=max(latencies) * 1000,
+            )
+        )
+
+    with app.app_context():
+        reset()
+
+    report("login", results)
+
+
+def _login_loop(stop, logins, i):
+    with app.test_client() as client:
+        while not stop.is_set():
+            resp = client.post(
+                "/users/login", json={"username": "bench", "password": "password"}
+            )
+            if resp.status_code == 200:
+                logins[i] += 1
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:]))
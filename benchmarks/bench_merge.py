@@ -0,0 +1,58 @@
+"""Time taken by `Upload.complete` to merge chunks, by file size.
+
+Usage::
+
+    python -m benchmarks.bench_merge [chunk size in KB]
+"""
+
+import sys
+import uuid
+import random
+from benchmarks.common import app, db, reset, Timer, report
+from sachet.server.models import Share, Upload, Chunk, get_settings
+
+SIZES_MB = (4, 16, 64)
+
+
+def main(chunk_kb=2048):
+    chunk_size = chunk_kb * 2**10
+    rand = random.Random(0)
+    results = []
+
+    with app.app_context():
+        for size_mb in SIZES_MB:
+            reset()
+            get_settings()
+            data = rand.randbytes(size_mb * 2**20)
+
+            share = Share(file_name="bench.bin")
+            db.session.add(share)
+            db.session.commit()
+
+            upload_id = str(uuid.uuid4())
+            total_chunks = -(-len(data) // chunk_size)
+            for i in range(total_chunks):
+                chunk = data[i * chunk_size : (i + 1) * chunk_size]
+                db.session.add(Chunk(i, upload_id, total_chunks, share, chunk))
+            db.session.commit()
+
+            upload = db.session.get(Upload, upload_id)
+            with Timer() as t:
+                upload.complete()
+                db.session.commit()
+
+            results.append(
+                dict(
+                    size_mb=size_mb,
+                    chunks=total_chunks,
+                    seconds=t.elapsed,
+                    mb_per_s=size_mb / t.elapsed,
+                )
+            )
+        reset()
+
+    report("merge", results)
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:]))
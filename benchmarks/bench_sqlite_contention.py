@@ -0,0 +1,106 @@
+"""Concurrent chunk upload throughput with and without SQLite tuning.
+
+Several worker processes (like gunicorn workers) upload chunks to the same
+SQLite database at once. With SQLite's defaults, writers often fail with
+"database is locked"; the tuned pragmas should avoid this.
+
+Usage::
+
+    python -m benchmarks.bench_sqlite_contention [workers] [uploads per worker]
+"""
+
+import sys
+import random
+import multiprocessing
+from benchmarks.common import (
+    app,
+    db,
+    reset,
+    allow_anonymous,
+    create_share,
+    upload,
+    Timer,
+    report,
+)
+from sachet.server.models import Permissions
+
+CONFIGS = {
+    "defaults": dict(
+        SACHET_SQLITE_JOURNAL_MODE="delete",
+        SACHET_SQLITE_BUSY_TIMEOUT=None,
+        SACHET_SQLITE_SYNCHRONOUS="full",
+        SACHET_SQLITE_CACHE_SIZE=None,
+        SACHET_SQLITE_MMAP_SIZE=None,
+    ),
+    "tuned": dict(
+        SACHET_SQLITE_JOURNAL_MODE="wal",
+        SACHET_SQLITE_BUSY_TIMEOUT=5000,
+        SACHET_SQLITE_SYNCHRONOUS="normal",
+        SACHET_SQLITE_CACHE_SIZE=-20000,
+        SACHET_SQLITE_MMAP_SIZE=2**28,
+    ),
+}
+
+CHUNK_SIZE = 16 * 2**10
+CHUNKS = 16
+
+
+def worker(uploads, errors):
+    data = random.Random(0).randbytes(CHUNK_SIZE * CHUNKS)
+
+    with app.test_client() as client, app.app_context():
+        # don't reuse the parent's connections
+        db.engine.dispose(close=False)
+        for _ in range(uploads):
+            try:
+                url = create_share(client)
+                upload(client, url, data, chunk_size=CHUNK_SIZE)
+            except Exception:
+                with errors.get_lock():
+                    errors.value += 1
+                db.session.rollback()
+
+
+def main(workers=8, uploads=10):
+    results = []
+
+    for name, config in CONFIGS.items():
+        app.config.update(config)
+        with app.app_context():
+            db.engine.dispose()
+            reset()
+            allow_anonymous(Permissions.CREATE)
+            db.session.remove()
+            db.engine.dispose()
+
+        errors = multiprocessing.Value("i", 0)
+        processes = [
+            multiprocessing.Process(target=worker, args=(uploads, errors))
+            for _ in range(workers)
+        ]
+        with Timer() as t:
+            for p in processes:
+                p.start()
+            for p in processes:
+                p.join()
+
+        total = workers * uploads
+        results.append(
+            dict(
+                config=name,
+                uploads=total,
+                failed=errors.value,
+                seconds=t.elapsed,
+                chunks_per_s=(total - errors.value) * CHUNKS / t.elapsed,
+            )
+        )
+
+    with app.app_context():
+        reset()
+
+    report("sqlite_contention", results)
+
+
+if __name__ == "__main__":
+    multiprocessing.set_start_method("fork")
+    main(*(int(arg) for arg in sys.argv[1:]))
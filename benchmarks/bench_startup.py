@@ -0,0 +1,57 @@
+"""Cold-start time of workers and CLI commands.
+
+Each measurement runs in a fresh interpreter, like a new worker or a new
+``flask`` invocation would.
+
+Usage::
+
+    python -m benchmarks.bench_startup [repetitions]
+"""
+
+import os
+import sys
+import subprocess
+import statistics
+from benchmarks.common import Timer, report
+
+COMMANDS = {
+    "create_app": [
+        sys.executable,
+        "-c",
+        "from sachet.server import create_app; create_app()",
+    ],
+    "flask --help": [sys.executable, "-m", "flask", "--app", "sachet.server", "--help"],
+    "flask user --help": [
+        sys.executable,
+        "-m",
+        "flask",
+        "--app",
+        "sachet.server",
+        "user",
+        "--help",
+    ],
+}
+
+
+def main(repetitions=10):
+    results = []
+
+    for name, command in COMMANDS.items():
+        times = []
+        for _ in range(repetitions):
+            with Timer() as t:
+                subprocess.run(command, check=True, capture_output=True, env=os.environ)
+            times.append(t.elapsed)
+        results.append(
+            dict(
+                command=name,
+                median_s=statistics.median(times),
+                min_s=min(times),
+            )
+        )
+
+    report("startup", results)
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:]))
@@ -0,0 +1,71 @@
+"""Chunked upload throughput, by chunk size and amount of parallel uploads.
+
+Uploads go through a real WSGI server, so that HTTP and multipart parsing are
+measured too.
+
+Usage::
+
+    python -m benchmarks.bench_upload [size of each upload in MB]
+"""
+
+import sys
+import random
+from concurrent.futures import ThreadPoolExecutor
+from benchmarks.common import (
+    app,
+    db,
+    reset,
+    allow_anonymous,
+    serve,
+    HTTPClient,
+    Timer,
+    report,
+)
+from sachet.server.models import Permissions
+
+CHUNK_SIZES_KB = (64, 512, 2048)
+PARALLEL_UPLOADS = (1, 4)
+
+
+def main(size_mb=8):
+    data = random.Random(0).randbytes(size_mb * 2**20)
+    results = []
+
+    for chunk_kb in CHUNK_SIZES_KB:
+        for parallel in PARALLEL_UPLOADS:
+            with app.app_context():
+                reset()
+                allow_anonymous(Permissions.CREATE, Permissions.MODIFY)
+                db.session.commit()
+
+            with serve() as port, ThreadPoolExecutor(parallel) as executor:
+                clients = [HTTPClient(port) for _ in range(parallel)]
+                paths = [client.create_share() for client in clients]
+                with Timer() as t:
+                    futures = [
+                        executor.submit(client.upload, path, data, chunk_kb * 2**10)
+                        for client, path in zip(clients, paths)
+                    ]
+                    for future in futures:
+                        future.result()
+
+            results.append(
+                dict(
+                    chunk_kb=chunk_kb,
+                    parallel=parallel,
+                    seconds=t.elapsed,
+                    mb_per_s=parallel * size_mb / t.elapsed,
+                    chunks_per_s=parallel
+                    * -(-len(data) // (chunk_kb * 2**10))
+                    / t.elapsed,
+                )
+            )
+
+    with app.app_context():
+        reset()
+
+    report("upload", results)
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:]))
@@ -0,0 +1,259 @@
+"""Helpers shared by the benchmarks.
+
+Benchmarks use the testing configuration, like the test suite, so they share
+its database and storage directory. Run them from the repository root, e.g.::
+
+    python -m benchmarks.bench_durability
+
+or run the whole suite with ``python -m benchmarks``.
+
+When ``SACHET_BENCH_OUTPUT`` is set, results are also appended to that file as
+JSON lines, along with the commit they were measured on, so that runs can be
+compared across commits.
+"""
+
+import os
+
+# this has to be set before sachet.server is imported
+os.environ.setdefault("RUN_ENV", "test")
+
+import datetime
+import http.client
+import json
+import platform
+import subprocess
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from io import BytesIO
+from math import ceil
+from pathlib import Path
+from werkzeug.datastructures import FileStorage
+from werkzeug.serving import make_server
+from bitmask import Bitmask
+from sachet.server import create_app, db, storage
+from sachet.server.models import Permissions, get_settings
+
+app = create_app()
+
+
+def reset():
+    """Empty the database and the storage."""
+    db.session.remove()
+    db.drop_all()
+    db.create_all()
+    for file in storage._files_directory.rglob("*"):
+        if file.is_file() and file.is_relative_to(Path(app.instance_path)):
+            file.unlink()
+
+
+def allow_anonymous(*permissions):
+    """Give anonymous users some permissions, so requests don't need tokens."""
+    get_settings().default_permissions = Bitmask(*permissions, AllFlags=Permissions)
+
+
+def create_share(client, file_name="bench.bin"):
+    """Create a share, and return its URL."""
+    resp = client.post("/files", json={"file_name": file_name})
+    assert resp.status_code == 201, resp.get_json()
+    return resp.get_json()["url"]
+
+
+def upload(client, url, data, chunk_size=int(2e6), method=None):
+    """Perform a chunked upload of `data` to a share's URL."""
+    method = method or client.post
+    total_chunks = int(ceil(len(data) / chunk_size))
+    upload_id = str(uuid.uuid4())
+
+    for chunk_idx in range(total_chunks):
+        chunk = data[chunk_size * chunk_idx : chunk_size * (chunk_idx + 1)]
+        resp = method(
+            url + "/content",
+            data={
+                "upload": FileStorage(stream=BytesIO(chunk), filename="upload"),
+                "dzuuid": upload_id,
+                "dzchunkindex": chunk_idx,
+                "dztotalchunks": total_chunks,
+            },
+            content_type="multipart/form-data",
+        )
+        assert resp.status_code in (200, 201), resp.get_json()
+    assert resp.status_code == 201, resp.get_json()
+
+
+@contextmanager
+def serve():
+    """Serve the app with a real, threaded WSGI server.
+
+    Yields
+    ------
+    int
+        Port the server listens on, on localhost.
+    """
+    server = make_server("127.0.0.1", 0, app, threaded=True)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield server.server_port
+    finally:
+        server.shutdown()
+        thread.join()
+        server.server_close()
+
+
+class HTTPClient:
+    """Minimal HTTP client for a server started with `serve()`.
+
+    Each instance holds one connection, so use one per thread.
+    """
+
+    def __init__(self, port, token=None):
+        self.port = port
+        self.token = token
+        self._connection = None
+
+    def request(self, method, path, body=None, headers={}):
+        """Send a request.
+
+        Returns
+        -------
+        status : int
+        body : bytes
+        """
+        # the testing configuration routes requests by SERVER_NAME
+        headers = {"Host": app.config["SERVER_NAME"], **headers}
+        if self.token:
+            headers["Authorization"] = f"bearer {self.token}"
+        if isinstance(body, dict):
+            body = json.dumps(body).encode()
+            headers["Content-Type"] = "application/json"
+
+        # the development server closes connections after every response
+        connection = http.client.HTTPConnection("127.0.0.1", self.port)
+        try:
+            connection.request(method, path, body=body, headers=headers)
+            resp = connection.getresponse()
+            return resp.status, resp.read()
+        finally:
+            connection.close()
+
+    def create_share(self, file_name="bench.bin"):
+        """Create a share, and return its path."""
+        status, body = self.request("POST", "/files", {"file_name": file_name})
+        assert status == 201, body
+        return json.loads(body)["url"]
+
+    def upload(self, path, data, chunk_size=int(2e6)):
+        """Perform a chunked upload of `data` to a share's path."""
+        total_chunks = int(ceil(len(data) / chunk_size))
+        upload_id = str(uuid.uuid4())
+
+        for chunk_idx in range(total_chunks):
+            chunk = data[chunk_size * chunk_idx : chunk_size * (chunk_idx + 1)]
+            body, content_type = multipart(
+                dict(
+                    dzuuid=upload_id,
+                    dzchunkindex=chunk_idx,
+                    dztotalchunks=total_chunks,
+                ),
+                upload=chunk,
+            )
+            status, resp = self.request(
+                "POST",
+                path + "/content",
+                body,
+                {"Content-Type": content_type},
+            )
+            assert status in (200, 201), resp
+        assert status == 201, resp
+
+
+def multipart(fields, **files):
+    """Encode form fields and files as multipart/form-data.
+
+    Returns the body and the matching ``Content-Type`` header.
+    """
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, value in fields.items():
+        parts.append(
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"'
+            f"\r\n\r\n{value}\r\n".encode()
+        )
+    for name, data in files.items():
+        parts.append(
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; '
+            f'filename="{name}"\r\nContent-Type: application/octet-stream'
+            "\r\n\r\n".encode() + data + b"\r\n"
+        )
+    parts.append(f"--{boundary}--\r\n".encode())
+    return b"".join(parts), f"multipart/form-data; boundary={boundary}"
+
+
+def percentile(values, p):
+    """Return the p-th percentile (0-100) of some values, by nearest rank."""
+    values = sorted(values)
+    return values[min(len(values) - 1, max(0, ceil(p / 100 * len(values)) - 1))]
+
+
+class Timer:
+    """Context manager measuring wall-clock time in seconds."""
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.elapsed = time.perf_counter() - self.start
+
+
+def report(name, results):
+    """Print benchmark results as a table, followed by a line of JSON.
+
+    Parameters
+    ----------
+    name : str
+        Name of the benchmark.
+    results : list of dict
+        One dict per measurement, all with the same keys.
+    """
+    keys = list(results[0].keys())
+    widths = [max(len(k), *(len(_fmt(r[k])) for r in results)) for k in keys]
+    print(name)
+    print("  ".join(k.ljust(w) for k, w in zip(keys, widths)))
+    for r in results:
+        print("  ".join(_fmt(r[k]).ljust(w) for k, w in zip(keys, widths)))
+    print(json.dumps(dict(benchmark=name, results=results)))
+
+    output = os.getenv("SACHET_BENCH_OUTPUT")
+    if output:
+        with open(output, "a") as f:
+            record = dict(
+                benchmark=name,
+                commit=_commit(),
+                date=datetime.datetime.now().isoformat(timespec="seconds"),
+                python=platform.python_version(),
+                database=app.config["SQLALCHEMY_DATABASE_URI"].split(":")[0],
+                results=results,
+            )
+            f.write(json.dumps(record) + "\n")
+
+
+def _commit():
+    try:
+        proc = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return proc.stdout.strip()
+
+
+def _fmt(value):
+    if isinstance(value, float):
+        return f"{value:.3f}"
+    return str(value)
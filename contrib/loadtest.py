@@ -0,0 +1,326 @@
+#!/usr/bin/env python
+"""Load generator simulating mixed production traffic.
+
+This starts Sachet with a temporary SQLite database and storage directory,
+serves it with a threaded WSGI server, and has several concurrent clients send
+a weighted mix of requests for a while. Latency percentiles and throughput are
+then reported for each kind of request.
+
+Usage (from the repository root)::
+
+    python contrib/loadtest.py --clients 16 --duration 30
+    python contrib/loadtest.py --mix login=1,create=1,upload=2,download=2,range=4,list=2
+
+Kinds of requests in the mix:
+
+- ``login``: ``POST /users/login``, which hashes a password;
+- ``create``: ``POST /files``, creating an empty share;
+- ``upload``: creates a share, then uploads a file to it in chunks, with
+  ``--chunk-parallel`` chunks in flight at once (reported per chunk);
+- ``download``: downloads a whole file;
+- ``range``: downloads a byte range of a file, like a resumed download;
+- ``list``: ``GET /files``, on a random page.
+"""
+
+import argparse
+import http.client
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from math import ceil
+from pathlib import Path
+
+REPO = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO))
+
+from benchmarks.common import multipart, percentile
+
+DEFAULT_MIX = "login=1,create=1,upload=2,download=2,range=4,list=2"
+
+
+def parse_mix(mix):
+    """Parse weights like ``login=1,list=2`` into a dictionary."""
+    weights = {}
+    for item in mix.split(","):
+        name, _, weight = item.partition("=")
+        if name not in ("login", "create", "upload", "download", "range", "list"):
+            raise argparse.ArgumentTypeError(f"unknown kind of request '{name}'")
+        try:
+            weights[name] = float(weight)
+        except ValueError:
+            raise argparse.ArgumentTypeError(f"invalid weight for '{name}'")
+    return weights
+
+
+class Stats:
+    """Latencies and errors, by kind of request."""
+
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def record(self, kind, seconds, ok):
+        with self._lock:
+            if ok:
+                self.latencies[kind].append(seconds)
+            else:
+                self.errors[kind] += 1
+
+    def results(self, duration):
+        results = []
+        for kind in sorted(set(self.latencies) | set(self.errors)):
+            latencies = self.latencies[kind] or [float("nan")]
+            results.append(
+                dict(
+                    request=kind,
+                    count=len(self.latencies[kind]),
+                    errors=self.errors[kind],
+                    per_s=len(self.latencies[kind]) / duration,
+                    p50_ms=statistics.median(latencies) * 1000,
+                    p95_ms=percentile(latencies, 95) * 1000,
+                    p99_ms=percentile(latencies, 99) * 1000,
+                )
+            )
+        return results
+
+
+class Client:
+    """Simulated user of the server."""
+
+    def __init__(self, port, args, stats, shares, rand):
+        self.port = port
+        self.args = args
+        self.stats = stats
+        self.shares = shares
+        self.rand = rand
+        self.token = None
+
+    def request(self, kind, method, path, body=None, headers={}, expect=(200,)):
+        headers = dict(headers)
+        if self.token:
+            headers["Authorization"] = f"bearer {self.token}"
+        if isinstance(body, dict):
+            body = json.dumps(body).encode()
+            headers["Content-Type"] = "application/json"
+
+        start = time.perf_counter()
+        connection = http.client.HTTPConnection("127.0.0.1", self.port, timeout=60)
+        try:
+            connection.request(method, path, body=body, headers=headers)
+            resp = connection.getresponse()
+            status, data = resp.status, resp.read()
+        except (OSError, http.client.HTTPException):
+            status, data = None, b""
+        finally:
+            connection.close()
+        ok = status in expect
+        if kind:
+            self.stats.record(kind, time.perf_counter() - start, ok)
+        return (json.loads(data) if ok and data.startswith(b"{") else None), ok
+
+    def login(self, kind="login"):
+        self.token = None
+        resp, ok = self.request(
+            kind,
+            "POST",
+            "/users/login",
+            dict(username="load", password=self.args.password),
+        )
+        if ok:
+            self.token = resp["auth_token"]
+
+    def create(self, kind="create"):
+        resp, ok = self.request(
+            kind, "POST", "/files", dict(file_name="load.bin"), expect=(201,)
+        )
+        return resp["url"] if ok else None
+
+    def upload(self):
+        path = self.create(kind=None)
+        if path is None:
+            self.stats.record("upload_chunk", 0, False)
+            return
+
+        size = self.args.file_kb * 2**10
+        chunk_size = self.args.chunk_kb * 2**10
+        data = self.rand.randbytes(size)
+        total_chunks = ceil(size / chunk_size)
+        upload_id = str(uuid.uuid4())
+
+        def send(chunk_idx):
+            body, content_type = multipart(
+                dict(
+                    dzuuid=upload_id,
+                    dzchunkindex=chunk_idx,
+                    dztotalchunks=total_chunks,
+                ),
+                upload=data[chunk_idx * chunk_size : (chunk_idx + 1) * chunk_size],
+            )
+            return self.request(
+                "upload_chunk",
+                "POST",
+                path + "/content",
+                body,
+                {"Content-Type": content_type},
+                expect=(200, 201),
+            )[1]
+
+        with ThreadPoolExecutor(self.args.chunk_parallel) as executor:
+            if all(executor.map(send, range(total_chunks))):
+                # appending is atomic, so clients can share the list
+                self.shares.append(path)
+
+    def download(self, kind="download"):
+        if not self.shares:
+            return self.upload()
+        path = self.rand.choice(self.shares)
+        headers = {}
+        expect = (200,)
+        if kind == "range":
+            size = self.args.file_kb * 2**10
+            length = min(self.args.range_kb * 2**10, size - 1)
+            start = self.rand.randrange(1, size - length + 1)
+            headers["Range"] = f"bytes={start}-{start + length - 1}"
+            expect = (206,)
+        self.request(kind, "GET", path + "/content", headers=headers, expect=expect)
+
+    def list(self):
+        pages = max(1, ceil(len(self.shares) / 15))
+        self.request(
+            "list", "GET", f"/files?page={self.rand.randint(1, pages)}&per_page=15"
+        )
+
+    def run(self, stop, weights):
+        self.login(kind=None)
+        actions = dict(
+            login=self.login,
+            create=self.create,
+            upload=self.upload,
+            download=self.download,
+            range=lambda: self.download(kind="range"),
+            list=self.list,
+        )
+        kinds = list(weights)
+        while not stop.is_set():
+            kind = self.rand.choices(kinds, [weights[k] for k in kinds])[0]
+            actions[kind]()
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--clients", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=20, help="seconds")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix(DEFAULT_MIX))
+    parser.add_argument("--file-kb", type=int, default=1024, help="upload size")
+    parser.add_argument("--chunk-kb", type=int, default=256)
+    parser.add_argument("--chunk-parallel", type=int, default=2)
+    parser.add_argument("--range-kb", type=int, default=64)
+    parser.add_argument("--seed-shares", type=int, default=10)
+    parser.add_argument("--bcrypt-rounds", type=int, default=12)
+    parser.add_argument("--hashing-workers", type=int, default=2)
+    parser.add_argument("--password", default="load-password")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args(argv)
+
+    # the testing configuration does not need a config.yml; the database and
+    # storage are then replaced by temporary ones
+    os.environ["RUN_ENV"] = "test"
+    os.chdir(REPO)
+
+    from bitmask import Bitmask
+    from werkzeug.serving import make_server
+    from sachet.server import create_app, db
+    from sachet.server.models import Permissions, get_settings
+    from sachet.server.users import manage
+
+    with tempfile.TemporaryDirectory(prefix="sachet-loadtest-") as tmp:
+        app = create_app(
+            dict(
+                SQLALCHEMY_DATABASE_URI=f"sqlite:///{tmp}/sachet.db",
+                SACHET_FILE_DIR=f"{tmp}/storage",
+                SERVER_NAME=None,
+                BCRYPT_LOG_ROUNDS=args.bcrypt_rounds,
+                SACHET_HASHING_WORKERS=args.hashing_workers,
+            )
+        )
+        with app.app_context():
+            db.create_all()
+            get_settings()
+            manage.create_user(
+                Bitmask(
+                    Permissions.CREATE,
+                    Permissions.MODIFY,
+                    Permissions.READ,
+                    Permissions.LIST,
+                ),
+                "load",
+                args.password,
+            )
+
+        server = make_server("127.0.0.1", 0, app, threaded=True)
+        server_thread = threading.Thread(target=server.serve_forever, daemon=True)
+        server_thread.start()
+
+        stats = Stats()
+        shares = []
+
+        seeder = Client(server.server_port, args, Stats(), shares, random.Random(0))
+        seeder.login(kind=None)
+        for _ in range(args.seed_shares):
+            seeder.upload()
+
+        stop = threading.Event()
+        clients = [
+            Client(server.server_port, args, stats, shares, random.Random(i + 1))
+            for i in range(args.clients)
+        ]
+        threads = [
+            threading.Thread(target=client.run, args=(stop, args.mix))
+            for client in clients
+        ]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        time.sleep(args.duration)
+        stop.set()
+        for thread in threads:
+            thread.join()
+        duration = time.perf_counter() - start
+
+        server.shutdown()
+        server_thread.join()
+        server.server_close()
+        with app.app_context():
+            hashing = app.extensions.get("sachet_hashing")
+            if hashing is not None:
+                hashing.shutdown()
+            db.engine.dispose()
+
+    results = stats.results(duration)
+    if args.json:
+        print(json.dumps(dict(clients=args.clients, seconds=duration, results=results)))
+        return
+
+    print(f"{args.clients} clients for {duration:.1f} s")
+    keys = list(results[0])
+    rows = [
+        [f"{r[k]:.1f}" if isinstance(r[k], float) else str(r[k]) for k in keys]
+        for r in results
+    ]
+    widths = [max(len(k), *(len(row[i]) for row in rows)) for i, k in enumerate(keys)]
+    print("  ".join(k.ljust(w) for k, w in zip(keys, widths)))
+    for row in rows:
+        print("  ".join(v.ljust(w) for v, w in zip(row, widths)))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -1,31 +1,21 @@
 import os
-from flask import Flask
+from flask import Flask, current_app, jsonify
 from flask_cors import CORS
 from flask_sqlalchemy import SQLAlchemy
-from flask_marshmallow import Marshmallow
-from flask_bcrypt import Bcrypt
-from flask_migrate import Migrate
-from .config import DevelopmentConfig, ProductionConfig, TestingConfig, overlay_config
+from werkzeug.local import LocalProxy
+from .config import (
+    DevelopmentConfig,
+    ProductionConfig,
+    TestingConfig,
+    overlay_config,
+    engine_options,
+    sqlite_pragmas,
+)
+from sachet.storage import FileSystem
+from sachet.server import timing
 from sqlalchemy import event, MetaData
-from sqlalchemy.engine import Engine
 from sqlite3 import Connection as SQLite3Connection
 
-app = Flask(__name__)
-CORS(app)
-
-with app.app_context():
-    if os.getenv("RUN_ENV") == "test":
-        overlay_config(TestingConfig, "./config-testing.yml")
-    elif app.config["DEBUG"]:
-        overlay_config(DevelopmentConfig)
-        app.logger.warning(
-            "Running in DEVELOPMENT MODE; do NOT use this in production!"
-        )
-    else:
-        overlay_config(ProductionConfig)
-
-bcrypt = Bcrypt(app)
-
 # https://stackoverflow.com/questions/62640576/
 convention = {
     "ix": "ix_%(column_0_label)s",
@@ -35,47 +25,133 @@ convention = {
     "pk": "pk_%(table_name)s",
 }
 metadata = MetaData(naming_convention=convention)
-db = SQLAlchemy(app, metadata=metadata)
-migrate = Migrate(app, db, render_as_batch=True)
-ma = Marshmallow()
+# databases with INSERT ... ON CONFLICT and UPDATE ... RETURNING
+SUPPORTED_DATABASES = ("sqlite", "postgresql")
+db = SQLAlchemy(metadata=metadata)
+
+
+def _get_storage():
+    """Return the current app's storage backend, initializing it on first use."""
+    storage = current_app.extensions.get("sachet_storage")
+    if storage is None:
+        storage_method = current_app.config["SACHET_STORAGE"]
+        if storage_method == "filesystem":
+            storage = FileSystem()
+        else:
+            raise ValueError(f"{storage_method} is not a valid storage method.")
+        if timing.enabled(current_app.config):
+            storage = timing.TimedStorage(storage)
+        current_app.extensions["sachet_storage"] = storage
+    return storage
 
-_storage_method = app.config["SACHET_STORAGE"]
 
-storage = None
+storage = LocalProxy(_get_storage)
+
+
+def create_app(config=None):
+    """Create and configure the Sachet application.
+
+    The database schema is not created here; use migrations (``flask db
+    upgrade``) for that. The storage backend is only initialized when it is
+    first used, and modules only needed by some commands or requests (such as
+    migrations and serialization) are imported when they are first needed.
+
+    Parameters
+    ----------
+    config : dict, optional
+        Options that override the configuration file.
 
-from sachet.storage import FileSystem
+    Returns
+    -------
+    flask.Flask
+    """
+    app = Flask(__name__)
+    CORS(app)
+
+    with app.app_context():
+        if os.getenv("RUN_ENV") == "test":
+            overlay_config(TestingConfig, "./config-testing.yml")
+        elif app.config["DEBUG"]:
+            overlay_config(DevelopmentConfig)
+            app.logger.warning(
+                "Running in DEVELOPMENT MODE; do NOT use this in production!"
+            )
+        else:
+            overlay_config(ProductionConfig)
+
+    if config:
+        app.config.update(config)
+
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = engine_options(app.config)
+
+    db.init_app(app)
+
+    with app.app_context():
+        if db.engine.dialect.name not in SUPPORTED_DATABASES:
+            raise RuntimeError(
+                f"Database '{db.engine.dialect.name}' is not supported "
+                f"(use one of {', '.join(SUPPORTED_DATABASES)})."
+            )
+
+        # https://stackoverflow.com/questions/57726047/
+        @event.listens_for(db.engine, "connect")
+        def _set_sqlite_pragma(dbapi_connection, connection_record):
+            if isinstance(dbapi_connection, SQLite3Connection):
+                cursor = dbapi_connection.cursor()
+                cursor.execute("PRAGMA foreign_keys=ON;")
+                for pragma, value in sqlite_pragmas(app.config).items():
+                    cursor.execute(f"PRAGMA {pragma}={value};")
+                cursor.close()
+
+        from sachet.server import metrics
+
+        metrics.init_app(app, db.engine)
+        timing.init_app(app, db.engine)
 
+    from sachet.server.commands import (
+        user_cli,
+        storage_cli,
+        maintenance_cli,
+        archive_cli,
+        cleanup,
+        db_cli,
+    )
 
-# https://stackoverflow.com/questions/57726047/
-@event.listens_for(Engine, "connect")
-def _set_sqlite_pragma(dbapi_connection, connection_record):
-    if isinstance(dbapi_connection, SQLite3Connection):
-        cursor = dbapi_connection.cursor()
-        cursor.execute("PRAGMA foreign_keys=ON;")
-        cursor.close()
+    app.cli.add_command(db_cli)
+    app.cli.add_command(user_cli)
+    app.cli.add_command(storage_cli)
+    app.cli.add_command(maintenance_cli)
+    app.cli.add_command(archive_cli)
+    app.cli.add_command(cleanup)
 
+    from sachet.server.users.views import users_blueprint
 
-with app.app_context():
-    db.create_all()
-    if _storage_method == "filesystem":
-        storage = FileSystem()
-    else:
-        raise ValueError(f"{_storage_method} is not a valid storage method.")
+    app.register_blueprint(users_blueprint)
 
-import sachet.server.commands
+    from sachet.server.admin.views import admin_blueprint
 
-from sachet.server.users.views import users_blueprint
+    app.register_blueprint(admin_blueprint)
+
+    from sachet.server.files.views import files_blueprint
 
-app.register_blueprint(users_blueprint)
+    app.register_blueprint(files_blueprint)
 
-from sachet.server.admin.views import admin_blueprint
+    from sachet.server.whoami.views import whoami_blueprint
 
-app.register_blueprint(admin_blueprint)
+    app.register_blueprint(whoami_blueprint)
 
-from sachet.server.files.views import files_blueprint
+    from sachet.server.hashing import HashingBusyError
 
-app.register_blueprint(files_blueprint)
+    @app.errorhandler(HashingBusyError)
+    def hashing_busy(e):
+        resp = jsonify({"status": "fail", "message": "Server busy, try again later."})
+        resp.status_code = 503
+        resp.headers["Retry-After"] = "1"
+        return resp
 
-from sachet.server.whoami.views import whoami_blueprint
+    if app.config["SACHET_MAINTENANCE_THREAD"]:
+        from sachet.server import scheduler
+
+        scheduler.init_app(app)
 
-app.register_blueprint(whoami_blueprint)
+    return app
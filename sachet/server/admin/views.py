@@ -1,7 +1,11 @@
-from flask import Blueprint, request, jsonify
+import hmac
+import os
+import uuid
+from pathlib import Path
+from flask import Blueprint, Response, request, jsonify, current_app, url_for
 from flask.views import MethodView
-from sachet.server.models import ServerSettings, get_settings, Permissions
-from sachet.server import db
+from sachet.server.models import ServerSettings, get_settings, Permissions, Upload
+from sachet.server import db, metrics, profiler
 from sachet.server.views_common import auth_required, ModelAPI
 
 
@@ -30,3 +34,171 @@ admin_blueprint.add_url_rule(
     view_func=ServerSettingsAPI.as_view("server_settings_api"),
     methods=["PATCH", "GET", "PUT"],
 )
+
+
+class MetricsAPI(MethodView):
+    """Prometheus metrics (see `sachet.server.metrics`.)
+
+    Scrapers may authenticate with ``SACHET_METRICS_TOKEN`` instead of an
+    admin's token, which would expire.
+    """
+
+    def get(self):
+        scrape_token = current_app.config["SACHET_METRICS_TOKEN"]
+        if scrape_token and hmac.compare_digest(
+            request.headers.get("Authorization", "").encode(),
+            f"Bearer {scrape_token}".encode(),
+        ):
+            return self.render()
+        return self.get_as_admin()
+
+    @auth_required(required_permissions=(Permissions.ADMIN,))
+    def get_as_admin(self, auth_user=None):
+        return self.render()
+
+    @staticmethod
+    def render():
+        server_metrics = metrics.get_metrics()
+        if server_metrics is None:
+            return jsonify({"status": "fail", "message": "Metrics are disabled."}), 404
+
+        server_metrics["active_uploads"].set(
+            Upload.query.filter_by(completed=False).count()
+        )
+        return Response(
+            server_metrics.render(),
+            mimetype="text/plain; version=0.0.4",
+        )
+
+
+admin_blueprint.add_url_rule(
+    "/metrics",
+    view_func=MetricsAPI.as_view("metrics_api"),
+    methods=["GET"],
+)
+
+
+def _profile_params():
+    """Read a profile's parameters from the request.
+
+    Returns
+    -------
+    tuple
+        ``seconds`` and ``interval``, and an error response or None.
+    """
+    if not current_app.config["SACHET_PROFILER"]:
+        return (
+            None,
+            None,
+            (jsonify({"status": "fail", "message": "The profiler is disabled."}), 404),
+        )
+
+    try:
+        seconds = float(request.args.get("seconds", 10))
+        interval = float(request.args.get("interval", 0.005))
+    except ValueError as err:
+        return None, None, (jsonify({"status": "fail", "message": f"{err}"}), 400)
+
+    max_seconds = current_app.config["SACHET_PROFILER_MAX_SECONDS"]
+    if not 0 < seconds <= max_seconds:
+        message = f"`seconds` must be between 0 and {max_seconds}."
+    elif not 0.001 <= interval <= seconds:
+        message = "`interval` must be between 0.001 and `seconds`."
+    else:
+        return seconds, interval, None
+    return None, None, (jsonify({"status": "fail", "message": message}), 400)
+
+
+def _profile_directory():
+    path = Path(current_app.config["SACHET_PROFILER_DIR"])
+    if not path.is_absolute():
+        path = Path(current_app.instance_path) / path
+    return path
+
+
+_profiler_busy = {"status": "fail", "message": "A profile is already being recorded."}
+
+
+class ProfileAPI(MethodView):
+    """Sampling profiler (see `sachet.server.profiler`.)"""
+
+    @auth_required(required_permissions=(Permissions.ADMIN,))
+    def get(self, auth_user=None):
+        """Record a profile of the worker's other threads, and return it."""
+        seconds, interval, error = _profile_params()
+        if error:
+            return error
+
+        try:
+            stacks = profiler.sample(seconds, interval)
+        except profiler.ProfilerBusyError:
+            return jsonify(_profiler_busy), 409
+        return Response(profiler.collapse(stacks), mimetype="text/plain")
+
+    @auth_required(required_permissions=(Permissions.ADMIN,))
+    def post(self, auth_user=None):
+        """Start recording a profile of the worker in the background."""
+        seconds, interval, error = _profile_params()
+        if error:
+            return error
+
+        profile_id = uuid.uuid4().hex
+        directory = _profile_directory()
+        directory.mkdir(parents=True, exist_ok=True)
+        try:
+            profiler.start(directory / f"{profile_id}.txt", seconds, interval)
+        except profiler.ProfilerBusyError:
+            return jsonify(_profiler_busy), 409
+        return (
+            jsonify(
+                {
+                    "status": "success",
+                    "profile_id": profile_id,
+                    "pid": os.getpid(),
+                    "url": url_for(
+                        "admin_blueprint.profile_result_api", profile_id=profile_id
+                    ),
+                }
+            ),
+            202,
+        )
+
+
+class ProfileResultAPI(MethodView):
+    """Profiles recorded in the background (see `ProfileAPI.post`.)"""
+
+    @auth_required(required_permissions=(Permissions.ADMIN,))
+    def get(self, profile_id, auth_user=None):
+        if not current_app.config["SACHET_PROFILER"]:
+            return (
+                jsonify({"status": "fail", "message": "The profiler is disabled."}),
+                404,
+            )
+
+        try:
+            path = _profile_directory() / f"{uuid.UUID(profile_id).hex}.txt"
+            stacks = path.read_text()
+        except (ValueError, FileNotFoundError):
+            return (
+                jsonify(
+                    {
+                        "status": "fail",
+                        "message": "This profile does not exist, or is still being recorded.",
+                    }
+                ),
+                404,
+            )
+        return Response(stacks, mimetype="text/plain")
+
+
+admin_blueprint.add_url_rule(
+    "/admin/profile",
+    view_func=ProfileAPI.as_view("profile_api"),
+    methods=["GET", "POST"],
+)
+
+admin_blueprint.add_url_rule(
+    "/admin/profile/<profile_id>",
+    view_func=ProfileResultAPI.as_view("profile_result_api"),
+    methods=["GET"],
+)
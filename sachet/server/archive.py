@@ -0,0 +1,378 @@
+"""Export and import of a whole instance as a streaming tar archive.
+
+Archives hold the server settings, users and shares along with the shares'
+files, so that an instance can be backed up or moved to another node without
+copying the database and the storage by hand. Uploads in progress, revoked
+tokens and the maintenance schedule are not exported.
+
+Members of an archive are, in order::
+
+    manifest.json           format and version of the archive
+    settings.ndjson         rows, one JSON object per line
+    users.ndjson
+    shares/000000.ndjson    a batch of shares,
+    files/<share_id>        followed by the files of its initialized shares
+    shares/000001.ndjson
+    ...
+    summary.json            amount of rows and files exported
+
+Archives are written and read as streams (tarfile's ``w|`` and ``r|*`` modes),
+so they can be piped through a compressor or over the network, and each batch
+of shares is followed by its files so that no member has to be kept around
+while importing. The summary comes last, so that truncated archives are
+detected and not imported.
+"""
+
+import datetime
+import io
+import json
+import queue
+import tarfile
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from sachet.server import db, storage
+from sachet.server.maintenance import batched, delete_files
+from sachet.server.models import ServerSettings, Share, User
+
+FORMAT = "sachet-archive"
+VERSION = 1
+
+# bytes read from the archive at once, and how many of those may wait for a
+# file to be written
+_BLOCK_SIZE = 2**20
+_QUEUED_BLOCKS = 16
+
+
+class ArchiveError(Exception):
+    """Raised when an archive can not be imported."""
+
+
+def _encode(value):
+    if isinstance(value, datetime.datetime):
+        return value.isoformat()
+    if isinstance(value, uuid.UUID):
+        return str(value)
+    raise TypeError(f"Can not export {value!r}.")
+
+
+def _decoders(table):
+    """Functions turning JSON values back into the types of a table's columns."""
+    decoders = {}
+    for column in table.columns:
+        try:
+            python_type = column.type.python_type
+        except NotImplementedError:
+            continue
+        if python_type is datetime.datetime:
+            decoders[column.key] = datetime.datetime.fromisoformat
+        elif python_type is uuid.UUID:
+            decoders[column.key] = uuid.UUID
+    return decoders
+
+
+def _add_file(tar, name, f):
+    """Add a member to an archive from a seekable file object."""
+    info = tarfile.TarInfo(name)
+    # the size of what was opened, even if the file is replaced meanwhile
+    info.size = f.seek(0, io.SEEK_END)
+    info.mtime = int(time.time())
+    f.seek(0)
+    tar.addfile(info, f)
+
+
+def _add_json(tar, name, data):
+    _add_file(tar, name, io.BytesIO(json.dumps(data).encode()))
+
+
+def _add_rows(tar, name, rows):
+    """Add rows to an archive as newline-delimited JSON, and count them."""
+    count = 0
+    # the size of a member must be known before it is written
+    with tempfile.SpooledTemporaryFile(max_size=2**23) as buf:
+        for row in rows:
+            buf.write(json.dumps(dict(row), default=_encode).encode() + b"\n")
+            count += 1
+        _add_file(tar, name, buf)
+    return count
+
+
+def _begin_snapshot():
+    """Start a transaction that sees the database as it is now until it ends.
+
+    pysqlite only begins transactions before writes, so reads are not isolated
+    from each other unless a transaction is started explicitly; in WAL mode, it
+    then reads a snapshot without blocking writers. Other databases are asked
+    for repeatable reads.
+    """
+    # the isolation level can only be set before a transaction starts
+    db.session.commit()
+    if db.engine.dialect.name == "sqlite":
+        db.session.execute(db.text("BEGIN"))
+    else:
+        db.session.connection(execution_options=dict(isolation_level="REPEATABLE READ"))
+
+
+def export_archive(fileobj, batch_size=1000):
+    """Write settings, users and shares with their files to an archive.
+
+    Everything is read in a single snapshot transaction (see
+    `_begin_snapshot`), so that rows are consistent with each other even if
+    the instance is in use. Files replaced during the export may still be
+    newer than their share's row.
+
+    Parameters
+    ----------
+    fileobj : file object
+        Binary stream to write the archive to. It does not need to be seekable.
+    batch_size : int, optional
+        Amount of shares per database fetch and per archive batch.
+
+    Returns
+    -------
+    dict
+        Amount of ``settings``, ``users``, ``shares`` and ``files`` exported,
+        and the IDs of initialized shares whose file is ``missing``.
+    """
+    summary = dict(settings=0, users=0, shares=0, files=0, missing=[])
+    _begin_snapshot()
+
+    with tarfile.open(fileobj=fileobj, mode="w|") as tar:
+        _add_json(
+            tar,
+            "manifest.json",
+            dict(
+                format=FORMAT,
+                version=VERSION,
+                created=datetime.datetime.utcnow().isoformat(),
+            ),
+        )
+
+        for name, model in (("settings", ServerSettings), ("users", User)):
+            table = model.__table__
+            rows = db.session.execute(
+                db.select(table).order_by(*table.primary_key)
+            ).mappings()
+            summary[name] = _add_rows(tar, f"{name}.ndjson", rows)
+
+        table = Share.__table__
+        rows = db.session.execute(
+            db.select(table)
+            .order_by(table.c.share_id)
+            .execution_options(yield_per=batch_size)
+        ).mappings()
+        for i, batch in enumerate(rows.partitions()):
+            summary["shares"] += _add_rows(tar, f"shares/{i:06}.ndjson", batch)
+            for row in batch:
+                if not row["initialized"]:
+                    continue
+                try:
+                    f = storage.get_file(str(row["share_id"])).open(mode="rb")
+                except FileNotFoundError:
+                    summary["missing"].append(str(row["share_id"]))
+                    continue
+                with f:
+                    _add_file(tar, f"files/{row['share_id']}", f)
+                summary["files"] += 1
+
+        _add_json(tar, "summary.json", summary)
+
+    # end the read transaction
+    db.session.commit()
+    return summary
+
+
+class _FileWriter:
+    """Writes share files in a pool of threads while the archive is read.
+
+    Reading an archive is sequential, so each file is handed over to a thread
+    in blocks, and written (then synced, depending on the storage's durability)
+    while the next files are read. At most `workers` files are in flight.
+    """
+
+    def __init__(self, workers):
+        self._pool = ThreadPoolExecutor(max_workers=workers)
+        self._slots = threading.Semaphore(workers)
+        self._futures = []
+        self.files = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self._pool.shutdown(wait=True)
+        if exc[0] is None:
+            self._check()
+
+    def _check(self):
+        """Raise the first error of a finished write, and forget the others."""
+        self._futures = [f for f in self._futures if not f.done() or f.result()]
+
+    @staticmethod
+    def _write(file, name, blocks):
+        block = b""
+        try:
+            with file.open(mode="wb") as f:
+                while (block := blocks.get()) is not None:
+                    f.write(block)
+            file.rename(name, namespace="shares", overwrite=True)
+        except BaseException:
+            # keep consuming, so that the reader is not blocked forever
+            while block is not None:
+                block = blocks.get()
+            raise
+
+    def write(self, name, source):
+        """Write a share's file from a file object, in the background.
+
+        Parameters
+        ----------
+        name : str
+            Name of the file in the shares namespace.
+        source : file object
+            Data of the file. It is read before this returns.
+        """
+        self._check()
+        self._slots.acquire()
+        # written under a temporary name, so that no partial file is visible
+        file = storage.get_file(f"import_{name}", namespace="tmp")
+        self.files.append(file)
+        blocks = queue.Queue(maxsize=_QUEUED_BLOCKS)
+        future = self._pool.submit(self._write, file, name, blocks)
+        future.add_done_callback(lambda _: self._slots.release())
+        self._futures.append(future)
+        try:
+            while block := source.read(_BLOCK_SIZE):
+                blocks.put(block)
+        finally:
+            blocks.put(None)
+
+
+def _read_json(tar, member):
+    return json.load(tar.extractfile(member))
+
+
+def _read_rows(tar, member, table):
+    """Read newline-delimited rows of a table from an archive member."""
+    decoders = _decoders(table)
+    for line in tar.extractfile(member):
+        row = json.loads(line)
+        for key, decode in decoders.items():
+            if row.get(key) is not None:
+                row[key] = decode(row[key])
+        yield row
+
+
+def import_archive(fileobj, batch_size=1000, workers=4):
+    """Read an archive made by `export_archive` into an empty instance.
+
+    Rows are inserted in batches in a single transaction, which is only
+    committed once the whole archive was read. If anything goes wrong, the
+    transaction is rolled back and files written so far are deleted.
+
+    Parameters
+    ----------
+    fileobj : file object
+        Binary stream to read the archive from. It does not need to be
+        seekable, and may be compressed.
+    batch_size : int, optional
+        Amount of rows per ``INSERT``.
+    workers : int, optional
+        Amount of files written at once.
+
+    Returns
+    -------
+    dict
+        Amount of ``settings``, ``users``, ``shares`` and ``files`` imported.
+
+    Raises
+    ------
+    ArchiveError
+        The database already has users or shares, or the archive is invalid
+        or incomplete.
+    """
+    if (
+        db.session.scalar(db.select(User.username).limit(1)) is not None
+        or db.session.scalar(db.select(Share.share_id).limit(1)) is not None
+    ):
+        raise ArchiveError("Archives can only be imported into an empty database.")
+
+    counts = dict(settings=0, users=0, shares=0, files=0)
+    writer = _FileWriter(workers)
+    try:
+        with writer, tarfile.open(fileobj=fileobj, mode="r|*") as tar:
+            summary = _import_members(tar, counts, writer, batch_size)
+        for key, count in counts.items():
+            if summary.get(key) != count:
+                raise ArchiveError(
+                    f"The archive has {count} {key}, but should have "
+                    f"{summary.get(key)}."
+                )
+        db.session.commit()
+    except (tarfile.TarError, ValueError, KeyError) as e:
+        db.session.rollback()
+        delete_files(writer.files, workers=workers)
+        raise ArchiveError(f"Invalid archive: {e}") from e
+    except BaseException:
+        db.session.rollback()
+        delete_files(writer.files, workers=workers)
+        raise
+
+    return counts
+
+
+def _import_members(tar, counts, writer, batch_size):
+    """Import the members of an archive, and return its summary."""
+    members = iter(tar)
+    member = next(members, None)
+    if member is None or member.name != "manifest.json":
+        raise ArchiveError("The archive has no manifest.")
+    manifest = _read_json(tar, member)
+    if manifest.get("format") != FORMAT or manifest.get("version") != VERSION:
+        raise ArchiveError(
+            f"Unsupported archive format {manifest.get('format')} "
+            f"version {manifest.get('version')}."
+        )
+
+    tables = {"settings.ndjson": ServerSettings, "users.ndjson": User}
+    # initialized shares of the last batch, whose files come next
+    expected_files = set()
+    summary = None
+
+    for member in members:
+        if summary is not None:
+            raise ArchiveError(f"Unexpected {member.name} after the summary.")
+
+        if member.name == "summary.json":
+            summary = _read_json(tar, member)
+        elif member.name in tables:
+            model = tables[member.name]
+            if model is ServerSettings:
+                # replaces the default settings
+                db.session.execute(db.delete(ServerSettings))
+            for batch in batched(_read_rows(tar, member, model.__table__), batch_size):
+                db.session.execute(db.insert(model.__table__), batch)
+                counts[member.name.split(".")[0]] += len(batch)
+        elif member.name.startswith("shares/"):
+            expected_files = set()
+            for batch in batched(_read_rows(tar, member, Share.__table__), batch_size):
+                db.session.execute(db.insert(Share.__table__), batch)
+                counts["shares"] += len(batch)
+                expected_files.update(
+                    str(row["share_id"]) for row in batch if row["initialized"]
+                )
+        elif member.name.startswith("files/"):
+            name = member.name.removeprefix("files/")
+            if name not in expected_files:
+                raise ArchiveError(f"{member.name} does not belong to any share.")
+            expected_files.remove(name)
+            writer.write(name, tar.extractfile(member))
+            counts["files"] += 1
+        else:
+            raise ArchiveError(f"Unknown archive member {member.name}.")
+
+    if summary is None:
+        raise ArchiveError("The archive is truncated (it has no summary).")
+    return summary
@@ -1,12 +1,42 @@
 import click
-from sachet.server import app, db
-from sachet.server.models import User, Share, Permissions, Upload
+import uuid
+from sachet.server import db, storage
+from sachet.server.models import User, Share, Permissions, Upload, Chunk
+from sachet.storage import FileSystem
 from sachet.server.users import manage
-from flask.cli import AppGroup
+from sachet.server import maintenance, archive
+from sachet.server.scheduler import Scheduler
+from flask.cli import AppGroup, ScriptInfo
 from bitmask import Bitmask
 import datetime
+import threading
 
 
+class LazyMigrateGroup(click.Group):
+    """Stand-in for Flask-Migrate's ``db`` command group.
+
+    Flask-Migrate imports Alembic, which is slow, so it is only loaded (and
+    set up on the app) when a ``db`` command is actually used.
+    """
+
+    def _load(self, ctx):
+        from flask_migrate import Migrate
+        from flask_migrate.cli import db as migrate_cli
+
+        app = ctx.ensure_object(ScriptInfo).load_app()
+        if "migrate" not in app.extensions:
+            Migrate(app, db, render_as_batch=True)
+        return migrate_cli
+
+    def list_commands(self, ctx):
+        return self._load(ctx).list_commands(ctx)
+
+    def get_command(self, ctx, name):
+        return self._load(ctx).get_command(ctx, name)
+
+
+db_cli = LazyMigrateGroup("db", help="Perform database migrations.")
+
 user_cli = AppGroup("user")
 
 
@@ -44,29 +74,269 @@ def delete_user(username):
     manage.delete_user_by_username(username)
 
 
-app.cli.add_command(user_cli)
-
-
 @user_cli.command("cleanup")
-def cleanup():
+@click.option(
+    "--hours",
+    default=24,
+    show_default=True,
+    help="Age in hours after which unfinished uploads and shares are stale.",
+)
+@click.option(
+    "--batch-size",
+    default=500,
+    show_default=True,
+    help="Amount of entries deleted per transaction.",
+)
+@click.option(
+    "--workers",
+    default=1,
+    show_default=True,
+    help="Amount of threads deleting files at once.",
+)
+@click.option(
+    "--dry-run",
+    is_flag=True,
+    help="Only report what would be deleted.",
+)
+def cleanup(hours, batch_size, workers, dry_run):
     """Clean up stale database entries.
 
-    Uninitialized shares and unfinished uploads older than a day are deleted.
+    Uninitialized shares and unfinished uploads older than a day, and expired
+    shares, are deleted along with their files.
     """
-    res = Share.query.filter(
-        Share.create_date < (datetime.datetime.now() - datetime.timedelta(hours=24)),
-        # do not use `Share.initialized` or `is False` here
-        # sqlalchemy doesn't like it
-        # noqa: E712
-        Share.initialized == False,
+    cutoff = datetime.datetime.utcnow() - datetime.timedelta(hours=hours)
+    verb = "Would delete" if dry_run else "Deleted"
+
+    count = 0
+    for batch in maintenance.stale_uploads(cutoff, batch_size=batch_size):
+        if not dry_run:
+            maintenance.delete_uploads(batch, workers=workers)
+        count += len(batch)
+        click.echo(f"{verb} {count} stale uploads...")
+    click.echo(f"{verb} {count} stale uploads.")
+
+    count = 0
+    for batch in maintenance.stale_shares(cutoff, batch_size=batch_size):
+        if not dry_run:
+            maintenance.delete_shares(batch, workers=workers)
+        count += len(batch)
+        click.echo(f"{verb} {count} stale shares...")
+    click.echo(f"{verb} {count} stale shares.")
+
+    count = 0
+    for batch in maintenance.expired_shares(
+        datetime.datetime.utcnow(), batch_size=batch_size
+    ):
+        if not dry_run:
+            maintenance.delete_shares(batch, workers=workers)
+        count += len(batch)
+        click.echo(f"{verb} {count} expired shares...")
+    click.echo(f"{verb} {count} expired shares.")
+
+
+storage_cli = AppGroup("storage")
+
+
+@storage_cli.command("migrate-layout")
+@click.option(
+    "--batch-size",
+    default=1000,
+    show_default=True,
+    help="Amount of files to classify per database query.",
+)
+def migrate_layout(batch_size):
+    """Move files from the old flat storage layout to the sharded one.
+
+    Shares are recognized by their name; other files are moved to the uploads
+    namespace if they belong to a chunk, and to the temporary namespace otherwise.
+    """
+    if not isinstance(storage, FileSystem):
+        raise click.ClickException("Only the filesystem storage needs migration.")
+
+    def is_share(name):
+        try:
+            return str(uuid.UUID(name)) == name
+        except ValueError:
+            return False
+
+    names = storage.legacy_files()
+    moved = 0
+
+    for i in range(0, len(names), batch_size):
+        batch = names[i : i + batch_size]
+        others = [name for name in batch if not is_share(name)]
+        chunk_names = set(
+            db.session.scalars(
+                db.select(Chunk.filename).where(Chunk.filename.in_(others))
+            )
+        )
+
+        for name in batch:
+            if is_share(name):
+                namespace = "shares"
+            elif name in chunk_names:
+                namespace = "uploads"
+            else:
+                namespace = "tmp"
+            storage.migrate_legacy_file(name, namespace)
+            moved += 1
+
+    click.echo(f"Moved {moved} files.")
+
+
+@storage_cli.command("reconcile")
+@click.option(
+    "--delete",
+    is_flag=True,
+    help="Delete orphaned files and dangling rows instead of only reporting them.",
+)
+@click.option(
+    "--batch-size",
+    default=1000,
+    show_default=True,
+    help="Amount of entries to check per database query.",
+)
+@click.option(
+    "--min-age",
+    default=60,
+    show_default=True,
+    help="Ignore files modified less than this many minutes ago.",
+)
+def reconcile(delete, batch_size, min_age):
+    """Compare storage against the database.
+
+    Reports files that no share or chunk refers to, initialized shares with no
+    file, and uploads with missing chunks.
+    """
+    orphans = 0
+    for file in maintenance.find_orphaned_files(
+        batch_size=batch_size, min_age=datetime.timedelta(minutes=min_age)
+    ):
+        orphans += 1
+        click.echo(f"orphaned file: {file.namespace}/{file.name}")
+        if delete:
+            file.delete()
+
+    shares = maintenance.find_dangling_shares(batch_size=batch_size)
+    for share_id in shares:
+        click.echo(f"share without file: {share_id}")
+
+    uploads = maintenance.find_dangling_uploads(batch_size=batch_size)
+    for upload_id in uploads:
+        click.echo(f"upload with missing chunks: {upload_id}")
+
+    if delete:
+        maintenance.delete_shares(shares)
+        maintenance.delete_uploads(uploads)
+
+    action = "Deleted" if delete else "Found"
+    click.echo(
+        f"{action} {orphans} orphaned files, {len(shares)} shares without files, "
+        f"{len(uploads)} uploads with missing chunks."
+    )
+
+
+@storage_cli.command("recount-usage")
+@click.option(
+    "--batch-size",
+    default=1000,
+    show_default=True,
+    help="Amount of shares updated per transaction.",
+)
+def recount_usage(batch_size):
+    """Recompute share sizes and storage usage for quotas.
+
+    Run this once after upgrading from a version without quotas.
+    """
+    count = maintenance.recount_usage(batch_size=batch_size)
+    click.echo(f"Updated the size of {count} shares.")
+
+
+archive_cli = AppGroup("archive")
+
+
+@archive_cli.command("export")
+@click.argument("path", type=click.File("wb"))
+@click.option(
+    "--batch-size",
+    default=1000,
+    show_default=True,
+    help="Amount of shares per database query.",
+)
+def export_archive(path, batch_size):
+    """Export settings, users, and shares with their files to a tar archive.
+
+    Use - as PATH to write the archive to the standard output, e.g. to compress
+    it or to send it to another node.
+    """
+    summary = archive.export_archive(path, batch_size=batch_size)
+    for share_id in summary["missing"]:
+        click.echo(f"share without file: {share_id}", err=True)
+    click.echo(
+        f"Exported {summary['users']} users, {summary['shares']} shares and "
+        f"{summary['files']} files.",
+        err=True,
     )
-    res.delete()
 
-    res = Upload.query.filter(
-        Upload.create_date < (datetime.datetime.now() - datetime.timedelta(hours=24))
+
+@archive_cli.command("import")
+@click.argument("path", type=click.File("rb"))
+@click.option(
+    "--batch-size",
+    default=1000,
+    show_default=True,
+    help="Amount of rows inserted per query.",
+)
+@click.option(
+    "--workers",
+    default=4,
+    show_default=True,
+    help="Amount of files written at once.",
+)
+def import_archive(path, batch_size, workers):
+    """Import an archive made by `flask archive export`.
+
+    The database must not have any users or shares yet. Nothing is imported
+    if the archive is invalid or incomplete.
+    """
+    try:
+        counts = archive.import_archive(path, batch_size=batch_size, workers=workers)
+    except archive.ArchiveError as e:
+        raise click.ClickException(str(e))
+    click.echo(
+        f"Imported {counts['users']} users, {counts['shares']} shares and "
+        f"{counts['files']} files."
     )
-    res.delete()
-    db.session.commit()
 
 
-app.cli.add_command(cleanup)
+maintenance_cli = AppGroup("maintenance")
+
+
+@maintenance_cli.command("run")
+@click.option("--once", is_flag=True, help="Run due tasks once, then exit.")
+@click.option(
+    "--poll",
+    default=60,
+    show_default=True,
+    help="Seconds between checks for due tasks.",
+)
+def run_maintenance(once, poll):
+    """Periodically clean up stale entries.
+
+    Any amount of instances may run this; each task is only run by one of them
+    at a time.
+    """
+    scheduler = Scheduler()
+
+    if once:
+        results = scheduler.run_pending()
+        if not results:
+            click.echo("No maintenance tasks are due.")
+        for name, count in results.items():
+            if count is None:
+                click.echo(f"Task '{name}' failed.")
+            else:
+                click.echo(f"Task '{name}' removed {count} entries.")
+        return
+
+    scheduler.run_forever(threading.Event(), poll=poll)
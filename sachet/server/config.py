@@ -8,21 +8,84 @@ sqlalchemy_base = "sqlite:///sachet"
 class BaseConfig:
     SQLALCHEMY_DATABASE_URI = sqlalchemy_base + ".db"
     BCRYPT_LOG_ROUNDS = 13
+    # processes hashing passwords (0 hashes in the request thread), and how many
+    # requests may wait for them before the server responds 503
+    SACHET_HASHING_WORKERS = 2
+    SACHET_HASHING_MAX_PENDING = 16
+    # "bcrypt" or "argon2id" (needs argon2-cffi); existing hashes are converted on login
+    SACHET_PASSWORD_HASH = "bcrypt"
+    # argon2id iterations, memory in KiB, and threads
+    SACHET_ARGON2_TIME_COST = 3
+    SACHET_ARGON2_MEMORY_COST = 65536
+    SACHET_ARGON2_PARALLELISM = 4
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     SACHET_STORAGE = "filesystem"
     SACHET_FILE_DIR = "/srv/sachet/storage"
+    SACHET_DURABILITY = "on-complete"
+    # storage quotas in bytes (None for no limit); users' quotas can be set individually
+    SACHET_USER_QUOTA = None
+    SACHET_ANONYMOUS_QUOTA = None
+    # seconds after a counted download during which range requests resume it (also
+    # after the last allowed download) instead of counting as new downloads
+    SACHET_DOWNLOAD_GRACE_PERIOD = 3600
+    # times a download may be resumed in that period before ranges count as downloads
+    SACHET_DOWNLOAD_MAX_RESUMES = 3
+    # applied to every SQLite connection; set to None to use SQLite's default
+    SACHET_SQLITE_JOURNAL_MODE = "wal"
+    SACHET_SQLITE_BUSY_TIMEOUT = 5000
+    SACHET_SQLITE_SYNCHRONOUS = "normal"
+    SACHET_SQLITE_CACHE_SIZE = -20000
+    SACHET_SQLITE_MMAP_SIZE = None
+    # connection pool settings; set to None to use SQLAlchemy's default
+    SACHET_DB_POOL_SIZE = None
+    SACHET_DB_MAX_OVERFLOW = None
+    SACHET_DB_POOL_RECYCLE = None
+    SACHET_DB_POOL_PRE_PING = None
+    # rate limits by name, e.g. dict(login="10/minute") (see sachet.server.ratelimit)
+    SACHET_RATE_LIMITS = {}
+    # "memory" (per worker process) or "sqlite" (shared by workers on a host)
+    SACHET_RATE_LIMIT_BACKEND = "memory"
+    SACHET_RATE_LIMIT_SQLITE_PATH = "ratelimit.db"
+    # largest page of a paginated list; use ?format=ndjson to stream everything
+    SACHET_MAX_PER_PAGE = 100
+    # export Prometheus metrics at /metrics (see sachet.server.metrics)
+    SACHET_METRICS = False
+    # directory where workers add up their metrics (None: each worker has its own)
+    SACHET_METRICS_DIR = None
+    # static token for scrapers, sent as "Authorization: Bearer <token>"
+    SACHET_METRICS_TOKEN = None
+    # time request phases, in Server-Timing headers and/or logs (see sachet.server.timing)
+    SACHET_SERVER_TIMING = False
+    SACHET_TIMING_LOG = False
+    # allow admins to profile workers at /admin/profile (see sachet.server.profiler)
+    SACHET_PROFILER = False
+    SACHET_PROFILER_MAX_SECONDS = 60
+    # where profiles recorded in the background are kept (relative to the instance path)
+    SACHET_PROFILER_DIR = "profiles"
+    # periodic maintenance (see sachet.server.scheduler)
+    SACHET_MAINTENANCE_THREAD = False
+    SACHET_MAINTENANCE_INTERVALS = dict(
+        uploads=3600, shares=3600, expired=600, tokens=3600
+    )
+    SACHET_MAINTENANCE_TIMEOUT = 600
+    SACHET_MAINTENANCE_STALE_HOURS = 24
 
 
 class TestingConfig(BaseConfig):
     SERVER_NAME = "localhost.test"
-    SQLALCHEMY_DATABASE_URI = sqlalchemy_base + "_test" + ".db"
+    # run the tests against another database (e.g. PostgreSQL) with this variable
+    SQLALCHEMY_DATABASE_URI = getenv(
+        "SACHET_TEST_DATABASE_URI", sqlalchemy_base + "_test" + ".db"
+    )
     BCRYPT_LOG_ROUNDS = 4
+    SACHET_HASHING_WORKERS = 0
     SACHET_FILE_DIR = "storage_test"
 
 
 class DevelopmentConfig(BaseConfig):
     SQLALCHEMY_DATABASE_URI = sqlalchemy_base + "_dev" + ".db"
     BCRYPT_LOG_ROUNDS = 4
+    SACHET_HASHING_WORKERS = 0
     SACHET_FILE_DIR = "storage_dev"
 
 
@@ -57,3 +120,81 @@ def overlay_config(base, config_file=None):
 
     for k, v in config.items():
         current_app.config[k] = v
+
+
+def engine_options(config):
+    """Return SQLAlchemy engine options requested by the configuration.
+
+    Options set directly in ``SQLALCHEMY_ENGINE_OPTIONS`` take precedence.
+
+    Parameters
+    ----------
+    config : dict
+        Flask configuration.
+
+    Returns
+    -------
+    dict
+        Keyword arguments for `sqlalchemy.create_engine()`.
+    """
+    options = {}
+
+    for name in ("pool_size", "max_overflow", "pool_recycle"):
+        value = config.get(f"SACHET_DB_{name.upper()}")
+        if value is not None:
+            options[name] = int(value)
+
+    pre_ping = config.get("SACHET_DB_POOL_PRE_PING")
+    if pre_ping is not None:
+        options["pool_pre_ping"] = bool(pre_ping)
+
+    options.update(config.get("SQLALCHEMY_ENGINE_OPTIONS", {}))
+    return options
+
+
+def sqlite_pragmas(config):
+    """Return the SQLite pragmas requested by the configuration.
+
+    Values are validated, since they are formatted directly into statements.
+
+    Parameters
+    ----------
+    config : dict
+        Flask configuration.
+
+    Returns
+    -------
+    dict
+        Maps pragma names to their values.
+    """
+    choices = dict(
+        journal_mode=("delete", "truncate", "persist", "memory", "wal", "off"),
+        synchronous=("off", "normal", "full", "extra"),
+    )
+    pragmas = {}
+
+    for name in (
+        "journal_mode",
+        "busy_timeout",
+        "synchronous",
+        "cache_size",
+        "mmap_size",
+    ):
+        key = f"SACHET_SQLITE_{name.upper()}"
+        value = config.get(key)
+        if value is None:
+            continue
+
+        if name in choices:
+            value = str(value).lower()
+            if value not in choices[name]:
+                raise ValueError(f"{value} is not a valid value for {key}.")
+        else:
+            try:
+                value = int(value)
+            except ValueError as e:
+                raise ValueError(f"{key} must be an integer.") from e
+
+        pragmas[name] = value
+
+    return pragmas
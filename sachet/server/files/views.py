@@ -1,10 +1,26 @@
 import uuid
 import io
-from flask import Blueprint, request, jsonify, send_file, make_response
+import datetime
+from flask import (
+    Blueprint,
+    request,
+    jsonify,
+    send_file,
+    make_response,
+    current_app,
+)
 from flask.views import MethodView
-from sachet.server.models import Share, Permissions, Upload, Chunk, User
+from sachet.server.models import (
+    Share,
+    Permissions,
+    Upload,
+    Chunk,
+    User,
+    QuotaExceededError,
+    has_quota,
+)
 from sachet.server.views_common import ModelAPI, ModelListAPI, auth_required
-from sachet.server import storage, db
+from sachet.server import storage, db, metrics
 
 files_blueprint = Blueprint("files_blueprint", __name__)
 
@@ -45,7 +61,7 @@ class FilesMetadataAPI(ModelAPI):
             )
         owner_name = request.get_json().get("owner_name")
         if owner_name is not None:
-            if User.query.filter_by(username=owner_name).first() is None:
+            if db.session.get(User, owner_name) is None:
                 return (
                     jsonify(
                         {
@@ -57,7 +73,12 @@ class FilesMetadataAPI(ModelAPI):
                 )
         if share.locked:
             return jsonify({"status": "fail", "message": "This share is locked."}), 423
-        return super().patch(share)
+        try:
+            return super().patch(share)
+        except QuotaExceededError:
+            # the new owner's quota is checked when the transfer is flushed
+            db.session.rollback()
+            return quota_exceeded()
 
     @auth_required(required_permissions=(Permissions.MODIFY,), allow_anonymous=True)
     def put(self, share_id, auth_user=None):
@@ -80,7 +101,7 @@ class FilesMetadataAPI(ModelAPI):
             )
         owner_name = request.get_json().get("owner_name")
         if owner_name is not None:
-            if User.query.filter_by(username=owner_name).first() is None:
+            if db.session.get(User, owner_name) is None:
                 return (
                     jsonify(
                         {
@@ -92,7 +113,12 @@ class FilesMetadataAPI(ModelAPI):
                 )
         if share.locked:
             return jsonify({"status": "fail", "message": "This share is locked."}), 423
-        return super().put(share)
+        try:
+            return super().put(share)
+        except QuotaExceededError:
+            # the new owner's quota is checked when the transfer is flushed
+            db.session.rollback()
+            return quota_exceeded()
 
     @auth_required(required_permissions=(Permissions.DELETE,), allow_anonymous=True)
     def delete(self, share_id, auth_user=None):
@@ -116,7 +142,11 @@ files_blueprint.add_url_rule(
 
 
 class FilesAPI(ModelListAPI):
-    @auth_required(required_permissions=(Permissions.CREATE,), allow_anonymous=True)
+    @auth_required(
+        required_permissions=(Permissions.CREATE,),
+        allow_anonymous=True,
+        rate_limit="share_create",
+    )
     def post(self, auth_user=None):
         data = request.get_json()
         if auth_user:
@@ -135,6 +165,13 @@ files_blueprint.add_url_rule(
 )
 
 
+def quota_exceeded():
+    return (
+        jsonify(dict(status="fail", message="Storage quota exceeded.")),
+        413,
+    )
+
+
 class FileContentAPI(MethodView):
     def recv_upload(self, share):
         """Receive chunked uploads.
@@ -149,6 +186,7 @@ class FileContentAPI(MethodView):
                 400,
             )
         chunk_data = chunk_file.read()
+        metrics.inc("uploaded_bytes", len(chunk_data))
 
         try:
             dz_uuid = request.form["dzuuid"]
@@ -167,24 +205,47 @@ class FileContentAPI(MethodView):
                 400,
             )
 
+        # reject uploads that won't fit before storing any of their chunks;
+        # the final size is checked again once the upload is complete
+        if not has_quota(
+            share.owner_name, dz_total_chunks * len(chunk_data) - share.size
+        ):
+            return quota_exceeded()
+
         chunk = Chunk(dz_chunk_index, dz_uuid, dz_total_chunks, share, chunk_data)
         db.session.add(chunk)
+
+        # count the chunk in the same transaction that records it
+        recv_chunks = Upload.count_chunk(dz_uuid)
         db.session.commit()
-        upload = chunk.upload
 
-        upload.recv_chunks = upload.recv_chunks + 1
-        if upload.recv_chunks >= upload.total_chunks:
-            upload.complete()
+        # only the last chunk needs the upload itself
+        if recv_chunks == dz_total_chunks:
+            upload = db.session.get(Upload, dz_uuid)
+            if recv_chunks == upload.total_chunks:
+                try:
+                    upload.complete()
+                except QuotaExceededError:
+                    db.session.rollback()
+                    db.session.delete(upload)
+                    db.session.commit()
+                    return quota_exceeded()
+
+                share.initialized = True
+                db.session.delete(upload)
+                db.session.commit()
+                return (
+                    jsonify(dict(status="success", message="Upload completed.")),
+                    201,
+                )
 
-        if upload.completed:
-            share.initialized = True
-            db.session.delete(upload)
-            db.session.commit()
-            return jsonify(dict(status="success", message="Upload completed.")), 201
-        else:
-            return jsonify(dict(status="success", message="Chunk uploaded.")), 200
+        return jsonify(dict(status="success", message="Chunk uploaded.")), 200
 
-    @auth_required(required_permissions=(Permissions.CREATE,), allow_anonymous=True)
+    @auth_required(
+        required_permissions=(Permissions.CREATE,),
+        allow_anonymous=True,
+        rate_limit="upload",
+    )
     def post(self, share_id, auth_user=None):
         share = Share.query.filter_by(share_id=filter_id(share_id)).first()
 
@@ -217,7 +278,11 @@ class FileContentAPI(MethodView):
 
         return self.recv_upload(share)
 
-    @auth_required(required_permissions=(Permissions.MODIFY,), allow_anonymous=True)
+    @auth_required(
+        required_permissions=(Permissions.MODIFY,),
+        allow_anonymous=True,
+        rate_limit="upload",
+    )
     def put(self, share_id, auth_user=None):
         share = Share.query.filter_by(share_id=filter_id(share_id)).first()
         if not share:
@@ -273,16 +338,57 @@ class FileContentAPI(MethodView):
                 404,
             )
 
+        if share.expired:
+            return (
+                jsonify({"status": "fail", "message": "This share has expired."}),
+                410,
+            )
+
+        # read before committing, which would expire the share
         file = share.get_handle()
+        file_name = share.file_name
+
+        # HEAD requests (e.g. link previews) only get the headers, and are not
+        # counted as downloads
+        if request.method == "GET":
+            grace = datetime.timedelta(
+                seconds=current_app.config["SACHET_DOWNLOAD_GRACE_PERIOD"]
+            )
+            # resuming a download (a range not starting at the beginning of the
+            # file, soon after a counted download) does not count as another
+            # one, a few times
+            resuming = (
+                request.range is not None
+                and all(start > 0 for start, _ in request.range.ranges)
+                and Share.resume_download(
+                    share.share_id,
+                    grace,
+                    current_app.config["SACHET_DOWNLOAD_MAX_RESUMES"],
+                )
+            )
+            if not resuming and Share.count_download(share.share_id, grace) is None:
+                db.session.rollback()
+                return (
+                    jsonify(
+                        {
+                            "status": "fail",
+                            "message": "This share has reached its download limit.",
+                        }
+                    ),
+                    410,
+                )
+            db.session.commit()
 
         with file.open("rb") as f:
             resp = make_response(
                 send_file(
                     io.BytesIO(f.read()),
-                    download_name=share.file_name,
+                    download_name=file_name,
                     conditional=True,
                 )
             )
+            if request.method == "GET":
+                metrics.inc("downloaded_bytes", resp.content_length or 0)
             return resp
 
 
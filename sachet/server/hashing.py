@@ -0,0 +1,221 @@
+"""Password hashing, off the request thread.
+
+Hashing passwords is deliberately slow. Done inline, every login would block
+its worker for as long as the hash takes, so that a burst of logins stalls
+every other request. Instead, hashes are computed in a small process pool
+(``SACHET_HASHING_WORKERS``), and requests waiting for it are bounded
+(``SACHET_HASHING_MAX_PENDING``): past that, `HashingBusyError` is raised, and
+the client is told to retry later.
+
+Hashes are bcrypt by default, or argon2id when ``SACHET_PASSWORD_HASH`` says so
+(this needs the optional ``argon2-cffi`` package). Both formats record their
+own cost parameters, so existing hashes keep working when the configuration
+changes; `needs_rehash` tells when a hash should be replaced on next login.
+"""
+
+import hmac
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+import bcrypt
+from flask import current_app
+
+try:
+    import argon2
+except ImportError:
+    argon2 = None
+
+
+class HashingBusyError(Exception):
+    """Raised when too many passwords are already waiting to be hashed."""
+
+
+def _hash(password, rounds):
+    return bcrypt.hashpw(password.encode(), bcrypt.gensalt(rounds)).decode()
+
+
+def _hash_argon2(password, time_cost, memory_cost, parallelism):
+    return _argon2_hasher(time_cost, memory_cost, parallelism).hash(password)
+
+
+def _check(pw_hash, password):
+    if pw_hash.startswith("$argon2"):
+        if argon2 is None:
+            raise RuntimeError("Checking argon2 hashes requires argon2-cffi.")
+        try:
+            return argon2.PasswordHasher().verify(pw_hash, password)
+        except (
+            argon2.exceptions.VerificationError,
+            argon2.exceptions.InvalidHashError,
+        ):
+            return False
+
+    pw_hash = pw_hash.encode()
+    return hmac.compare_digest(bcrypt.hashpw(password.encode(), pw_hash), pw_hash)
+
+
+def _argon2_hasher(time_cost, memory_cost, parallelism):
+    if argon2 is None:
+        raise RuntimeError(
+            "SACHET_PASSWORD_HASH is argon2id, but argon2-cffi is not installed."
+        )
+    return argon2.PasswordHasher(
+        time_cost=time_cost,
+        memory_cost=memory_cost,
+        parallelism=parallelism,
+        type=argon2.Type.ID,
+    )
+
+
+def _bcrypt_rounds(pw_hash):
+    # hashes look like $2b$12$<salt and hash>
+    try:
+        return int(pw_hash.split("$")[2])
+    except (IndexError, ValueError):
+        return None
+
+
+class HashingPool:
+    """Runs hashing functions in worker processes, with bounded waiting.
+
+    Parameters
+    ----------
+    workers : int
+        Amount of worker processes. With 0, functions run in the calling thread.
+    max_pending : int
+        Maximum amount of calls running or waiting at once.
+    """
+
+    def __init__(self, workers, max_pending):
+        self.workers = workers
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._executor = None
+        self._executor_lock = threading.Lock()
+
+    def _get_executor(self):
+        with self._executor_lock:
+            if self._executor is None:
+                # forking a threaded server is unsafe, so start fresh processes
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+            return self._executor
+
+    def run(self, fn, *args):
+        """Call a function in the pool, and wait for its result.
+
+        Raises
+        ------
+        HashingBusyError
+            Too many calls are already pending.
+        """
+        if not self._slots.acquire(blocking=False):
+            raise HashingBusyError("Too many passwords are being hashed.")
+        try:
+            if self.workers == 0:
+                return fn(*args)
+            return self._get_executor().submit(fn, *args).result()
+        finally:
+            self._slots.release()
+
+    def shutdown(self):
+        """Stop the worker processes."""
+        with self._executor_lock:
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
+
+
+def get_pool():
+    """Return the current app's hashing pool, creating it on first use."""
+    pool = current_app.extensions.get("sachet_hashing")
+    if pool is None:
+        pool = HashingPool(
+            current_app.config["SACHET_HASHING_WORKERS"],
+            current_app.config["SACHET_HASHING_MAX_PENDING"],
+        )
+        current_app.extensions["sachet_hashing"] = pool
+    return pool
+
+
+def _argon2_params():
+    return (
+        current_app.config["SACHET_ARGON2_TIME_COST"],
+        current_app.config["SACHET_ARGON2_MEMORY_COST"],
+        current_app.config["SACHET_ARGON2_PARALLELISM"],
+    )
+
+
+def hash_password(password):
+    """Hash a password with the configured method and cost.
+
+    This is ``SACHET_PASSWORD_HASH``, with either ``BCRYPT_LOG_ROUNDS`` or the
+    ``SACHET_ARGON2_*`` parameters.
+
+    Parameters
+    ----------
+    password : str
+
+    Returns
+    -------
+    str
+        The password's hash.
+    """
+    method = current_app.config["SACHET_PASSWORD_HASH"]
+    if method == "bcrypt":
+        return get_pool().run(_hash, password, current_app.config["BCRYPT_LOG_ROUNDS"])
+    elif method == "argon2id":
+        # fail here rather than in a worker process
+        _argon2_hasher(*_argon2_params())
+        return get_pool().run(_hash_argon2, password, *_argon2_params())
+    else:
+        raise ValueError(f"{method} is not a valid password hashing method.")
+
+
+def check_password(pw_hash, password):
+    """Check a password against its hash.
+
+    Parameters
+    ----------
+    pw_hash : str
+        Hash of the real password.
+    password : str
+        Password to check.
+
+    Returns
+    -------
+    bool
+    """
+    return get_pool().run(_check, pw_hash, password)
+
+
+def needs_rehash(pw_hash):
+    """Check if a hash differs from the configured method or cost.
+
+    This only reads the parameters stored in the hash, so it runs in the calling
+    thread.
+
+    Parameters
+    ----------
+    pw_hash : str
+
+    Returns
+    -------
+    bool
+        True if the password should be hashed again (e.g. on login.)
+    """
+    method = current_app.config["SACHET_PASSWORD_HASH"]
+    if method == "bcrypt":
+        if pw_hash.startswith("$argon2"):
+            return True
+        return _bcrypt_rounds(pw_hash) != current_app.config["BCRYPT_LOG_ROUNDS"]
+    elif method == "argon2id":
+        if not pw_hash.startswith("$argon2"):
+            return True
+        try:
+            return _argon2_hasher(*_argon2_params()).check_needs_rehash(pw_hash)
+        except argon2.exceptions.InvalidHashError:
+            return True
+    else:
+        raise ValueError(f"{method} is not a valid password hashing method.")
@@ -0,0 +1,396 @@
+"""Maintenance tasks that keep the database and the storage consistent.
+
+These are meant to be run from the CLI (see `sachet.server.commands`), and
+work in batches so that they scale to very large databases and storages.
+"""
+
+import datetime
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from sachet.server import db, storage
+from sachet.server.models import (
+    Share,
+    Upload,
+    Chunk,
+    BlacklistToken,
+    User,
+    ServerSettings,
+    usage_update,
+)
+
+
+def batched(iterable, size):
+    """Split an iterable into lists of at most `size` items."""
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+def _parse_uuid(name):
+    try:
+        return uuid.UUID(name)
+    except ValueError:
+        return None
+
+
+def find_orphaned_files(batch_size=1000, min_age=datetime.timedelta(hours=1)):
+    """Find files in storage that no database row refers to.
+
+    Parameters
+    ----------
+    batch_size : int, optional
+        Amount of files to check per database query.
+    min_age : datetime.timedelta, optional
+        Files modified more recently than this are ignored, since they might
+        belong to a request that is still in progress.
+
+    Yields
+    ------
+    sachet.storage.Storage.File
+        Orphaned files.
+    """
+    cutoff = datetime.datetime.utcnow() - min_age
+
+    def old_enough(file):
+        try:
+            return file.modify_date < cutoff
+        except FileNotFoundError:
+            # deleted while we were looking at it
+            return False
+
+    # shares are named after their share id
+    for batch in batched(storage.iter_files("shares"), batch_size):
+        ids = [_parse_uuid(file.name) for file in batch]
+        known = set(
+            db.session.scalars(
+                db.select(Share.share_id).where(
+                    Share.share_id.in_([i for i in ids if i is not None])
+                )
+            )
+        )
+        for file, share_id in zip(batch, ids):
+            if share_id not in known and old_enough(file):
+                yield file
+
+    # chunks are tracked by filename
+    for batch in batched(storage.iter_files("uploads"), batch_size):
+        known = set(
+            db.session.scalars(
+                db.select(Chunk.filename).where(
+                    Chunk.filename.in_([file.name for file in batch])
+                )
+            )
+        )
+        for file in batch:
+            if file.name not in known and old_enough(file):
+                yield file
+
+    # temporary files are named `<share_id>_<upload_id>`
+    for batch in batched(storage.iter_files("tmp"), batch_size):
+        upload_ids = [file.name.partition("_")[2] for file in batch]
+        known = set(
+            db.session.scalars(
+                db.select(Upload.upload_id).where(Upload.upload_id.in_(upload_ids))
+            )
+        )
+        for file, upload_id in zip(batch, upload_ids):
+            if upload_id not in known and old_enough(file):
+                yield file
+
+
+def find_dangling_shares(batch_size=1000):
+    """Find initialized shares that have no file in storage.
+
+    Parameters
+    ----------
+    batch_size : int, optional
+        Amount of rows to fetch from the database at once.
+
+    Returns
+    -------
+    list of uuid.UUID
+        IDs of the dangling shares.
+    """
+    rows = db.session.execute(
+        db.select(Share.share_id)
+        .where(Share.initialized == True)  # noqa: E712
+        .execution_options(yield_per=batch_size)
+    )
+    return [
+        share_id
+        for (share_id,) in rows
+        if not storage.exists(str(share_id), namespace="shares")
+    ]
+
+
+def find_dangling_uploads(batch_size=1000):
+    """Find uploads that have chunks missing from storage.
+
+    Parameters
+    ----------
+    batch_size : int, optional
+        Amount of rows to fetch from the database at once.
+
+    Returns
+    -------
+    list of str
+        IDs of the uploads that can no longer be completed.
+    """
+    rows = db.session.execute(
+        db.select(Chunk.upload_id, Chunk.filename).execution_options(
+            yield_per=batch_size
+        )
+    )
+    return list(
+        {
+            upload_id
+            for upload_id, filename in rows
+            if not storage.exists(filename, namespace="uploads")
+        }
+    )
+
+
+def stale_uploads(cutoff, batch_size=500):
+    """Find unfinished uploads started before a given time.
+
+    Batches are fetched with keyset pagination, so the caller may delete each
+    batch before asking for the next one.
+
+    Parameters
+    ----------
+    cutoff : datetime.datetime
+        Uploads started before this are stale.
+    batch_size : int, optional
+        Maximum amount of IDs per batch.
+
+    Yields
+    ------
+    list of str
+        Batches of upload IDs.
+    """
+    return _keyset_batches(
+        Upload.upload_id, Upload.create_date < cutoff, batch_size=batch_size
+    )
+
+
+def stale_shares(cutoff, batch_size=500):
+    """Find uninitialized shares created before a given time.
+
+    Batches are fetched like in `stale_uploads()`.
+
+    Parameters
+    ----------
+    cutoff : datetime.datetime
+        Shares created before this, and still without content, are stale.
+    batch_size : int, optional
+        Maximum amount of IDs per batch.
+
+    Yields
+    ------
+    list of uuid.UUID
+        Batches of share IDs.
+    """
+    return _keyset_batches(
+        Share.share_id,
+        Share.create_date < cutoff,
+        Share.initialized == False,  # noqa: E712
+        batch_size=batch_size,
+    )
+
+
+def expired_shares(now, batch_size=500):
+    """Find shares that expired before a given time.
+
+    Batches are fetched like in `stale_uploads()`.
+
+    Parameters
+    ----------
+    now : datetime.datetime
+        Shares that expire before this are expired.
+    batch_size : int, optional
+        Maximum amount of IDs per batch.
+
+    Yields
+    ------
+    list of uuid.UUID
+        Batches of share IDs.
+    """
+    return _keyset_batches(
+        Share.share_id, Share.expires_at < now, batch_size=batch_size
+    )
+
+
+def _keyset_batches(key, *criteria, batch_size):
+    last = None
+    while True:
+        query = db.select(key).where(*criteria).order_by(key).limit(batch_size)
+        if last is not None:
+            query = query.where(key > last)
+        batch = db.session.scalars(query).all()
+        # don't hold the read transaction open while the caller works
+        db.session.commit()
+        if not batch:
+            return
+        last = batch[-1]
+        yield batch
+
+
+def delete_files(files, workers=1):
+    """Delete storage files, optionally with a pool of threads.
+
+    Parameters
+    ----------
+    files : list of sachet.storage.Storage.File
+        Files to delete.
+    workers : int, optional
+        Amount of threads deleting files at once.
+    """
+    if workers <= 1:
+        for file in files:
+            file.delete()
+        return
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        # consume the results, so that errors are raised here
+        list(pool.map(lambda file: file.delete(), files))
+
+
+def delete_uploads(upload_ids, workers=1):
+    """Delete uploads by ID, along with their chunks and files.
+
+    Rows are deleted in bounded transactions, before the files, so that an
+    interruption only leaves orphaned files behind (see `find_orphaned_files()`.)
+
+    Parameters
+    ----------
+    upload_ids : list of str
+        Uploads to delete.
+    workers : int, optional
+        Amount of threads deleting files at once.
+    """
+    for batch in batched(upload_ids, 500):
+        filenames = db.session.scalars(
+            db.select(Chunk.filename).where(Chunk.upload_id.in_(batch))
+        ).all()
+        # chunk rows are removed by the database's cascade
+        db.session.execute(db.delete(Upload).where(Upload.upload_id.in_(batch)))
+        db.session.commit()
+
+        delete_files(
+            [storage.get_file(name, namespace="uploads") for name in filenames],
+            workers=workers,
+        )
+
+
+def delete_shares(share_ids, workers=1):
+    """Delete shares by ID, along with their uploads and files.
+
+    Parameters
+    ----------
+    share_ids : list of uuid.UUID
+        Shares to delete.
+    workers : int, optional
+        Amount of threads deleting files at once.
+    """
+    for batch in batched(share_ids, 500):
+        # uploads reference their share, so they have to go first
+        delete_uploads(
+            db.session.scalars(
+                db.select(Upload.upload_id).where(Upload.share_id.in_(batch))
+            ).all(),
+            workers=workers,
+        )
+        # core deletes skip the ORM events, so release the shares' usage here
+        sizes = db.session.execute(
+            db.select(Share.owner_name, db.func.sum(Share.size))
+            .where(Share.share_id.in_(batch), Share.size > 0)
+            .group_by(Share.owner_name)
+        )
+        for owner_name, size in sizes.all():
+            db.session.execute(usage_update(owner_name, -size))
+        db.session.execute(db.delete(Share).where(Share.share_id.in_(batch)))
+        db.session.commit()
+
+        delete_files(
+            [storage.get_file(str(i), namespace="shares") for i in batch],
+            workers=workers,
+        )
+
+
+def delete_expired_tokens(batch_size=500):
+    """Delete blacklisted tokens that have expired.
+
+    Expired tokens are rejected anyway, so they no longer need to be
+    blacklisted.
+
+    Parameters
+    ----------
+    batch_size : int, optional
+        Amount of tokens deleted per transaction.
+
+    Returns
+    -------
+    int
+        Amount of tokens deleted.
+    """
+    now = datetime.datetime.utcnow()
+    count = 0
+    for batch in _keyset_batches(
+        BlacklistToken.id, BlacklistToken.expires < now, batch_size=batch_size
+    ):
+        db.session.execute(
+            db.delete(BlacklistToken).where(BlacklistToken.id.in_(batch))
+        )
+        db.session.commit()
+        count += len(batch)
+    return count
+
+
+def recount_usage(batch_size=1000):
+    """Recompute share sizes and storage usage counters from scratch.
+
+    Usage is normally kept up to date as shares are uploaded and deleted; this
+    is for databases from before quotas existed, or counters that drifted.
+
+    Parameters
+    ----------
+    batch_size : int, optional
+        Amount of shares updated per transaction.
+
+    Returns
+    -------
+    int
+        Amount of shares whose size was updated.
+    """
+    count = 0
+    for batch in _keyset_batches(
+        Share.share_id,
+        Share.initialized == True,  # noqa: E712
+        batch_size=batch_size,
+    ):
+        sizes = []
+        for share_id in batch:
+            file = storage.get_file(str(share_id), namespace="shares")
+            sizes.append(dict(share_id=share_id, size=file.size if file.exists else 0))
+        db.session.execute(db.update(Share), sizes)
+        db.session.commit()
+        count += len(batch)
+
+    def total(owner):
+        return (
+            db.select(db.func.coalesce(db.func.sum(Share.size), 0))
+            .where(owner)
+            .scalar_subquery()
+        )
+
+    db.session.execute(
+        db.update(User).values(used_bytes=total(Share.owner_name == User.username))
+    )
+    db.session.execute(
+        db.update(ServerSettings).values(
+            anonymous_used_bytes=total(Share.owner_name.is_(None))
+        )
+    )
+    db.session.commit()
+    return count
@@ -0,0 +1,352 @@
+"""Prometheus metrics.
+
+Metrics are off unless ``SACHET_METRICS`` is set. When they are off, no request
+hooks or database listeners are installed, and recording functions (`inc`,
+`observe`) return right away, so instrumented code costs almost nothing.
+
+When on, they are exported at ``GET /metrics`` in the Prometheus text format,
+to admins or to scrapers sending ``SACHET_METRICS_TOKEN``.
+
+Each worker process keeps its own metrics. With ``SACHET_METRICS_DIR`` set,
+workers also write them to a file in that directory after every request, and
+a scrape adds up the files of all workers (including workers that exited, so
+that counters never go down.) The directory should be emptied when the server
+starts.
+"""
+
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from flask import current_app, g, has_request_context, request
+from sqlalchemy import event
+
+# seconds
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [f'{k}="{_escape(v)}"' for k, v in (*zip(names, values), *extra)]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    """Base class for metrics, which are kept per set of label values.
+
+    Parameters
+    ----------
+    name : str
+        Name of the metric.
+    help : str
+        Description of the metric.
+    labels : tuple of str, optional
+        Names of the labels of this metric.
+    """
+
+    type = None
+    # whether the values of several processes are added up
+    aggregated = True
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(labels.get(name, "") for name in self.labels)
+
+    def snapshot(self):
+        """Return the values of this metric as a list of (labels, value) pairs."""
+        with self._lock:
+            return [[list(key), value] for key, value in self._values.items()]
+
+    def merge(self, values):
+        """Add values from `snapshot` (of another process) to this metric."""
+        with self._lock:
+            for key, value in values:
+                self._merge(tuple(key), value)
+
+    def _merge(self, key, value):
+        raise NotImplementedError
+
+    def samples(self):
+        """Yield (suffix, label string, value) for every sample of this metric."""
+        with self._lock:
+            values = list(self._values.items())
+        for key, value in values:
+            yield "", _format_labels(self.labels, key), value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        for suffix, labels, value in self.samples():
+            lines.append(f"{self.name}{suffix}{labels} {_format_value(value)}")
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    """Value that only goes up."""
+
+    type = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _merge(self, key, value):
+        self._values[key] = self._values.get(key, 0) + value
+
+
+class Gauge(Metric):
+    """Value that can go up and down.
+
+    Gauges are not added up between processes; set them when scraping.
+    """
+
+    type = "gauge"
+    aggregated = False
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+
+class Histogram(Metric):
+    """Distribution of values, counted in buckets.
+
+    Parameters
+    ----------
+    buckets : tuple of float, optional
+        Upper bounds of the buckets, in increasing order.
+    """
+
+    type = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = (*buckets, float("inf"))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * len(self.buckets), 0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            self._values[key] = (counts, total + value)
+
+    def snapshot(self):
+        with self._lock:
+            return [
+                [list(key), [list(counts), total]]
+                for key, (counts, total) in self._values.items()
+            ]
+
+    def _merge(self, key, value):
+        counts, total = self._values.get(key, ([0] * len(self.buckets), 0))
+        self._values[key] = (
+            [a + b for a, b in zip(counts, value[0])],
+            total + value[1],
+        )
+
+    def samples(self):
+        with self._lock:
+            values = [
+                (key, list(counts), total)
+                for key, (counts, total) in self._values.items()
+            ]
+        for key, counts, total in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                labels = _format_labels(
+                    self.labels, key, (("le", _format_value(bound)),)
+                )
+                yield "_bucket", labels, cumulative
+            yield "_sum", _format_labels(self.labels, key), total
+            yield "_count", _format_labels(self.labels, key), cumulative
+
+
+class Metrics(dict):
+    """All of the server's metrics, by short name."""
+
+    def __init__(self):
+        super().__init__(
+            requests=Counter(
+                "sachet_requests_total",
+                "Requests handled, by endpoint, method and status.",
+                ("endpoint", "method", "status"),
+            ),
+            request_duration=Histogram(
+                "sachet_request_duration_seconds",
+                "Time taken to handle requests, by endpoint and method.",
+                ("endpoint", "method"),
+            ),
+            uploaded_bytes=Counter(
+                "sachet_uploaded_bytes_total", "Bytes received in upload chunks."
+            ),
+            downloaded_bytes=Counter(
+                "sachet_downloaded_bytes_total", "Bytes sent in file downloads."
+            ),
+            active_uploads=Gauge(
+                "sachet_active_uploads", "Uploads that have not received all chunks."
+            ),
+            merge_duration=Histogram(
+                "sachet_upload_merge_duration_seconds",
+                "Time taken to merge the chunks of completed uploads.",
+            ),
+            db_queries=Counter(
+                "sachet_db_queries_total",
+                "Database queries executed, by endpoint (empty outside requests.)",
+                ("endpoint",),
+            ),
+        )
+        self._dump_lock = threading.Lock()
+
+    def render(self):
+        """Return all metrics in the Prometheus text format."""
+        return "\n".join(metric.render() for metric in self.values()) + "\n"
+
+    def dump(self, directory):
+        """Write the metrics of this process to a file in a directory.
+
+        Parameters
+        ----------
+        directory : str
+            Directory shared by the worker processes.
+        """
+        path = Path(directory) / f"{os.getpid()}.json"
+        tmp = path.with_suffix(f".{threading.get_ident()}.tmp")
+        # snapshots are written in order, so that counters never go back
+        with self._dump_lock:
+            data = {
+                name: metric.snapshot()
+                for name, metric in self.items()
+                if metric.aggregated
+            }
+            tmp.write_text(json.dumps(data))
+            os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, directory):
+        """Add up the metrics written by all processes to a directory.
+
+        Parameters
+        ----------
+        directory : str
+            Directory shared by the worker processes.
+
+        Returns
+        -------
+        Metrics
+        """
+        metrics = cls()
+        for path in Path(directory).glob("*.json"):
+            try:
+                data = json.loads(path.read_text())
+            except (OSError, ValueError):
+                # removed meanwhile
+                continue
+            for name, values in data.items():
+                if name in metrics:
+                    metrics[name].merge(values)
+        return metrics
+
+
+def get_metrics():
+    """Return the current app's metrics, or None if they are disabled.
+
+    With ``SACHET_METRICS_DIR`` set, these are the metrics of all workers.
+    """
+    metrics = current_app.extensions.get("sachet_metrics")
+    directory = current_app.config["SACHET_METRICS_DIR"]
+    if metrics is None or not directory:
+        return metrics
+    metrics.dump(directory)
+    return Metrics.load(directory)
+
+
+def inc(name, amount=1, **labels):
+    """Increment a counter, if metrics are enabled.
+
+    Parameters
+    ----------
+    name : str
+        Short name of the metric in `Metrics`.
+    amount : int or float, optional
+    """
+    metrics = current_app.extensions.get("sachet_metrics")
+    if metrics is not None:
+        metrics[name].inc(amount, **labels)
+
+
+def observe(name, value, **labels):
+    """Record a value in a histogram, if metrics are enabled.
+
+    Parameters
+    ----------
+    name : str
+        Short name of the metric in `Metrics`.
+    value : float
+    """
+    metrics = current_app.extensions.get("sachet_metrics")
+    if metrics is not None:
+        metrics[name].observe(value, **labels)
+
+
+def _start_timer():
+    g.metrics_start = time.perf_counter()
+
+
+def _record_request(response):
+    metrics = current_app.extensions["sachet_metrics"]
+    endpoint = request.endpoint or ""
+    metrics["requests"].inc(
+        endpoint=endpoint, method=request.method, status=response.status_code
+    )
+    start = g.get("metrics_start")
+    if start is not None:
+        metrics["request_duration"].observe(
+            time.perf_counter() - start, endpoint=endpoint, method=request.method
+        )
+    directory = current_app.config["SACHET_METRICS_DIR"]
+    if directory:
+        metrics.dump(directory)
+    return response
+
+
+def init_app(app, engine):
+    """Install the request hooks and query listener, if metrics are enabled.
+
+    Parameters
+    ----------
+    app : flask.Flask
+    engine : sqlalchemy.engine.Engine
+        Engine whose queries are counted.
+    """
+    if not app.config["SACHET_METRICS"]:
+        return
+
+    metrics = Metrics()
+    app.extensions["sachet_metrics"] = metrics
+    app.before_request(_start_timer)
+    app.after_request(_record_request)
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _count_query(conn, cursor, statement, parameters, context, executemany):
+        endpoint = (request.endpoint or "") if has_request_context() else ""
+        metrics["db_queries"].inc(endpoint=endpoint)
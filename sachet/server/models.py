@@ -1,12 +1,14 @@
-from sachet.server import db, ma, bcrypt, storage
+from sachet.server import db, storage, metrics, timing
+from sachet.server.hashing import hash_password
 import datetime
+import time
 import jwt
 from enum import IntFlag
 from bitmask import Bitmask
-from marshmallow import fields, ValidationError
 from flask import request, jsonify, url_for, current_app
 from sqlalchemy_utils import UUIDType
-from sqlalchemy import event
+from sqlalchemy import event, inspect, and_, or_, case
+from sqlalchemy.dialects import postgresql, sqlite
 import uuid
 
 
@@ -20,30 +22,6 @@ class Permissions(IntFlag):
     READ = 1 << 6
 
 
-class PermissionField(fields.Field):
-    """Field that serializes a Permissions bitmask to an array of strings in Marshmallow."""
-
-    def _serialize(self, value, attr, obj, **kwargs):
-        mask = Bitmask()
-        mask.AllFlags = Permissions
-        mask += value
-        return [flag.name for flag in mask]
-
-    def _deserialize(self, value, attr, data, **kwargs):
-        mask = Bitmask()
-        mask.AllFlags = Permissions
-
-        flags = value
-
-        try:
-            for flag in flags:
-                mask.add(Permissions[flag])
-        except KeyError as e:
-            raise ValidationError("Invalid permission.") from e
-
-        return mask
-
-
 class PermissionProperty:
     """
     Property to serialize/deserialize a Permissions Bitmask to an integer.
@@ -93,8 +71,7 @@ class PasswordProperty:
         return getattr(obj, self.name + "_hash")
 
     def __set__(self, obj, value):
-        hash = User.gen_hash(value)
-        setattr(obj, self.name + "_hash", hash.decode())
+        setattr(obj, self.name + "_hash", User.gen_hash(value))
 
 
 class User(db.Model):
@@ -107,22 +84,27 @@ class User(db.Model):
 
     @staticmethod
     def gen_hash(value):
-        return bcrypt.generate_password_hash(
-            value, current_app.config.get("BCRYPT_LOG_ROUNDS")
-        )
+        return hash_password(value)
 
     register_date = db.Column(db.DateTime, nullable=False)
 
     permissions_number = db.Column(db.BigInteger, nullable=False, default=0)
     permissions = PermissionProperty()
 
-    def __init__(self, username, password, permissions):
+    # storage quota in bytes; None means SACHET_USER_QUOTA
+    quota = db.Column(db.BigInteger, nullable=True)
+    # total size of the user's shares, kept up to date by `usage_update()`
+    used_bytes = db.Column(db.BigInteger, nullable=False, default=0)
+
+    def __init__(self, username, password, permissions, quota=None):
         permissions.AllFlags = Permissions
         self.permissions = permissions
 
         self.password = password
         self.username = username
-        self.register_date = datetime.datetime.now()
+        self.register_date = datetime.datetime.utcnow()
+        self.quota = quota
+        self.used_bytes = 0
 
     @property
     def url(self):
@@ -149,32 +131,35 @@ class User(db.Model):
         if available.
         """
 
-        data = jwt.decode(
-            token,
-            current_app.config["SECRET_KEY"],
-            algorithms=["HS256"],
-        )
+        with timing.phase("jwt"):
+            data = jwt.decode(
+                token,
+                current_app.config["SECRET_KEY"],
+                algorithms=["HS256"],
+            )
+
+        # look up the user and the token's blacklist entry in one query
+        with timing.phase("user"):
+            row = db.session.execute(
+                db.select(User, BlacklistToken)
+                .outerjoin(BlacklistToken, BlacklistToken.token == token)
+                .where(User.username == data.get("sub"))
+            ).first()
+        if not row:
+            raise jwt.InvalidTokenError("No user corresponds to this token.")
 
-        if BlacklistToken.check_blacklist(token):
+        user, entry = row
+        if entry is not None:
+            BlacklistToken.remove_expired(entry)
             raise jwt.ExpiredSignatureError("Token revoked.")
 
-        user = User.query.filter_by(username=data.get("sub")).first()
-        if not user:
-            raise jwt.InvalidTokenError("No user corresponds to this token.")
-
         return data, user
 
-    def get_schema(self):
-        class Schema(ma.SQLAlchemySchema):
-            class Meta:
-                model = self
-
-            username = ma.auto_field()
-            register_date = ma.auto_field(dump_only=True)
-            password = fields.Str(load_only=True, required=False)
-            permissions = PermissionField()
+    @classmethod
+    def get_schema(cls):
+        from sachet.server.schemas import UserSchema
 
-        return Schema()
+        return UserSchema()
 
 
 class BlacklistToken(db.Model):
@@ -187,7 +172,7 @@ class BlacklistToken(db.Model):
 
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     token = db.Column(db.String(500), unique=True, nullable=False)
-    expires = db.Column(db.DateTime, nullable=False)
+    expires = db.Column(db.DateTime, nullable=False, index=True)
 
     def __init__(self, token):
         self.token = token
@@ -197,7 +182,7 @@ class BlacklistToken(db.Model):
             current_app.config["SECRET_KEY"],
             algorithms=["HS256"],
         )
-        self.expires = datetime.datetime.fromtimestamp(data["exp"])
+        self.expires = datetime.datetime.utcfromtimestamp(data["exp"])
 
     @staticmethod
     def check_blacklist(token):
@@ -207,10 +192,15 @@ class BlacklistToken(db.Model):
         if not entry:
             return False
         else:
-            if entry.expires < datetime.datetime.utcnow():
-                db.session.delete(entry)
+            BlacklistToken.remove_expired(entry)
             return True
 
+    @staticmethod
+    def remove_expired(entry):
+        """Delete a blacklist entry if its token has expired anyway."""
+        if entry.expires < datetime.datetime.utcnow():
+            db.session.delete(entry)
+
 
 class ServerSettings(db.Model):
     __tablename__ = "server_settings"
@@ -220,28 +210,116 @@ class ServerSettings(db.Model):
     default_permissions_number = db.Column(db.BigInteger, nullable=False, default=0)
     default_permissions = PermissionProperty()
 
+    # total size of the shares owned by anonymous users
+    anonymous_used_bytes = db.Column(db.BigInteger, nullable=False, default=0)
+
     def __init__(self, default_permissions=Bitmask(AllFlags=Permissions)):
+        self.anonymous_used_bytes = 0
         self.default_permissions = default_permissions
 
-    def get_schema(self):
-        class Schema(ma.SQLAlchemySchema):
-            class Meta:
-                model = self
-
-            default_permissions = PermissionField()
+    @classmethod
+    def get_schema(cls):
+        from sachet.server.schemas import ServerSettingsSchema
 
-        return Schema()
+        return ServerSettingsSchema()
 
 
 def get_settings():
-    """Return server settings, and create them if they don't exist."""
-    rows = ServerSettings.query.all()
-    if len(rows) == 0:
+    """Return server settings, and create them if they don't exist.
+
+    The settings are read once per session: later calls return the same
+    object, which is refreshed by the session like any other if it expires.
+    """
+    settings = db.session.info.get("sachet_settings")
+    if settings is not None and inspect(settings).persistent:
+        return settings
+
+    with timing.phase("settings"):
+        settings = db.session.scalar(
+            db.select(ServerSettings).order_by(ServerSettings.id.desc()).limit(1)
+        )
+    if settings is None:
         settings = ServerSettings()
         db.session.add(settings)
         db.session.commit()
-        return settings
-    return rows[-1]
+    db.session.info["sachet_settings"] = settings
+    return settings
+
+
+def _usage_columns(owner_name):
+    """Return the model, usage counter, quota and row filter for an owner."""
+    if owner_name is None:
+        latest = db.select(db.func.max(ServerSettings.id)).scalar_subquery()
+        return (
+            ServerSettings,
+            ServerSettings.anonymous_used_bytes,
+            db.literal(current_app.config["SACHET_ANONYMOUS_QUOTA"], db.BigInteger),
+            ServerSettings.id == latest,
+        )
+
+    default = current_app.config["SACHET_USER_QUOTA"]
+    quota = User.quota if default is None else db.func.coalesce(User.quota, default)
+    return User, User.used_bytes, quota, User.username == owner_name
+
+
+def usage_update(owner_name, delta, enforce_quota=False):
+    """Return a statement that atomically changes the storage used by an owner.
+
+    Parameters
+    ----------
+    owner_name : str or None
+        Owner of the shares, or None for anonymous users.
+    delta : int
+        Bytes to add to the usage (may be negative.)
+    enforce_quota : bool, optional
+        Don't update anything if the usage would go over the quota. Check the
+        statement's result's ``rowcount`` to know if it did.
+
+    Returns
+    -------
+    sqlalchemy.sql.expression.Update
+    """
+    model, used, quota, criteria = _usage_columns(owner_name)
+    statement = (
+        db.update(model)
+        .where(criteria)
+        .values({used: used + delta})
+        .execution_options(synchronize_session=False)
+    )
+    if enforce_quota:
+        statement = statement.where(or_(quota.is_(None), used + delta <= quota))
+    return statement
+
+
+def has_quota(owner_name, delta):
+    """Check if an owner has enough quota left to store more bytes.
+
+    This does not reserve anything, so it is only meant to reject uploads
+    early; see `usage_update()` for the authoritative check.
+
+    Parameters
+    ----------
+    owner_name : str or None
+        Owner of the shares, or None for anonymous users.
+    delta : int
+        Bytes that would be added to the usage.
+
+    Returns
+    -------
+    bool
+    """
+    if delta <= 0:
+        return True
+    model, used, quota, criteria = _usage_columns(owner_name)
+    row = db.session.execute(db.select(used, quota).where(criteria)).first()
+    if row is None:
+        return True
+    used_bytes, limit = row
+    return limit is None or used_bytes + delta <= limit
+
+
+class QuotaExceededError(Exception):
+    """Raised when an upload or a transfer would make an owner go over their quota."""
 
 
 class Share(db.Model):
@@ -267,6 +345,19 @@ class Share(db.Model):
         Time the share was created (not initialized.)
     file_name : str
         File name to download as.
+    expires_at : DateTime
+        Time after which the share can no longer be downloaded, and will be
+        deleted. None if the share does not expire.
+    max_downloads : int
+        Amount of times the share may be downloaded, or None for no limit.
+    download_count : int
+        Amount of times the share was downloaded.
+    last_download : DateTime
+        Time of the last counted download, or None.
+    resume_count : int
+        Amount of times the last counted download was resumed.
+    size : int
+        Size of the file in bytes, counted towards the owner's quota.
     url : str
         URL linking to this object.
 
@@ -287,37 +378,143 @@ class Share(db.Model):
     initialized = db.Column(db.Boolean, nullable=False, default=False)
     locked = db.Column(db.Boolean, nullable=False, default=False)
 
-    create_date = db.Column(db.DateTime, nullable=False)
+    create_date = db.Column(db.DateTime, nullable=False, index=True)
 
     file_name = db.Column(db.String, nullable=False)
 
-    def __init__(self, owner_name=None, file_name=None, locked=False):
-        self.owner = User.query.filter_by(username=owner_name).first()
+    expires_at = db.Column(db.DateTime, nullable=True, index=True)
+    max_downloads = db.Column(db.Integer, nullable=True)
+    download_count = db.Column(db.Integer, nullable=False, default=0)
+    last_download = db.Column(db.DateTime, nullable=True)
+    resume_count = db.Column(db.Integer, nullable=False, default=0)
+
+    size = db.Column(db.BigInteger, nullable=False, default=0)
+
+    def __init__(
+        self,
+        owner_name=None,
+        file_name=None,
+        locked=False,
+        expires_at=None,
+        max_downloads=None,
+    ):
+        # usually the authenticated user, so this is found in the session
+        self.owner = db.session.get(User, owner_name) if owner_name else None
         if self.owner:
             self.owner_name = self.owner.username
         self.share_id = uuid.uuid4()
         self.url = url_for("files_blueprint.files_metadata_api", share_id=self.share_id)
-        self.create_date = datetime.datetime.now()
+        self.create_date = datetime.datetime.utcnow()
         if file_name:
             self.file_name = file_name
         else:
             self.file_name = str(self.share_id)
 
         self.locked = locked
+        self.expires_at = expires_at
+        self.max_downloads = max_downloads
+        self.download_count = 0
+        self.size = 0
 
-    def get_schema(self):
-        class Schema(ma.SQLAlchemySchema):
-            class Meta:
-                model = self
+    @property
+    def expired(self):
+        """Whether the share is past its expiry time (in UTC.)"""
+        return (
+            self.expires_at is not None
+            and self.expires_at <= datetime.datetime.utcnow()
+        )
 
-            share_id = ma.auto_field(dump_only=True)
-            create_date = ma.auto_field(dump_only=True)
-            owner_name = ma.auto_field()
-            file_name = ma.auto_field()
-            initialized = ma.auto_field(dump_only=True)
-            locked = ma.auto_field(dump_only=True)
+    @staticmethod
+    def count_download(share_id, grace):
+        """Atomically count a download of a share, if it may still be downloaded.
+
+        This is done in a single ``UPDATE``, so concurrent downloads can not
+        exceed ``max_downloads``. Once the last download is counted, the share
+        expires after a grace period (so that the download can be resumed), and
+        is then deleted like any other expired share.
+
+        Parameters
+        ----------
+        share_id : uuid.UUID
+            ID of the share.
+        grace : datetime.timedelta
+            Time after the last download before the share expires.
+
+        Returns
+        -------
+        int or None
+            Amount of downloads including this one, or None if the share
+            expired or reached its download limit.
+        """
+        now = datetime.datetime.utcnow()
+        grace_end = now + grace
+        last_download = and_(
+            Share.max_downloads.is_not(None),
+            Share.download_count + 1 >= Share.max_downloads,
+            or_(Share.expires_at.is_(None), Share.expires_at > grace_end),
+        )
+        return db.session.execute(
+            db.update(Share)
+            .where(
+                Share.share_id == share_id,
+                or_(Share.expires_at.is_(None), Share.expires_at > now),
+                or_(
+                    Share.max_downloads.is_(None),
+                    Share.download_count < Share.max_downloads,
+                ),
+            )
+            .values(
+                download_count=Share.download_count + 1,
+                last_download=now,
+                resume_count=0,
+                expires_at=case((last_download, grace_end), else_=Share.expires_at),
+            )
+            .returning(Share.download_count)
+            .execution_options(synchronize_session=False)
+        ).scalar_one_or_none()
 
-        return Schema()
+    @staticmethod
+    def resume_download(share_id, grace, max_resumes):
+        """Atomically count a resume of the last download of a share, if allowed.
+
+        A download may be resumed up to `max_resumes` times, within a grace
+        period after it was counted. This is done in a single ``UPDATE``, so
+        concurrent requests can not go over the limit.
+
+        Parameters
+        ----------
+        share_id : uuid.UUID
+            ID of the share.
+        grace : datetime.timedelta
+            Time after the last counted download during which it may be resumed.
+        max_resumes : int
+            Amount of times a download may be resumed.
+
+        Returns
+        -------
+        bool
+            Whether the resume was allowed. If not, the request should be
+            counted as a new download instead.
+        """
+        now = datetime.datetime.utcnow()
+        result = db.session.execute(
+            db.update(Share)
+            .where(
+                Share.share_id == share_id,
+                Share.last_download > now - grace,
+                Share.resume_count < max_resumes,
+                or_(Share.expires_at.is_(None), Share.expires_at > now),
+            )
+            .values(resume_count=Share.resume_count + 1)
+            .execution_options(synchronize_session=False)
+        )
+        return result.rowcount == 1
+
+    @classmethod
+    def get_schema(cls):
+        from sachet.server.schemas import ShareSchema
+
+        return ShareSchema()
 
     def get_handle(self):
         return storage.get_file(str(self.share_id))
@@ -326,9 +523,26 @@ class Share(db.Model):
     def __declare_last__(cls):
         @event.listens_for(cls, "before_delete")
         def share_before_delete(mapper, connection, share):
+            if share.size:
+                connection.execute(usage_update(share.owner_name, -share.size))
             file = share.get_handle()
             file.delete()
 
+        @event.listens_for(cls, "before_update")
+        def share_before_update(mapper, connection, share):
+            # ownership transfers move the share's size to the new owner, if
+            # it fits in their quota (this fails the flush otherwise)
+            history = inspect(share).attrs.owner_name.history
+            if share.size and history.has_changes():
+                for owner_name in history.added:
+                    result = connection.execute(
+                        usage_update(owner_name, share.size, enforce_quota=True)
+                    )
+                    if result.rowcount != 1:
+                        raise QuotaExceededError("Storage quota exceeded.")
+                for owner_name in history.deleted:
+                    connection.execute(usage_update(owner_name, -share.size))
+
 
 class Upload(db.Model):
     """Upload instance for a given file.
@@ -366,7 +580,7 @@ class Upload(db.Model):
 
     share_id = db.Column(UUIDType(), db.ForeignKey("shares.share_id"))
     share = db.relationship("Share", backref=db.backref("upload"))
-    create_date = db.Column(db.DateTime, nullable=False)
+    create_date = db.Column(db.DateTime, nullable=False, index=True)
     total_chunks = db.Column(db.Integer, nullable=False)
     recv_chunks = db.Column(db.Integer, nullable=False, default=0)
     completed = db.Column(db.Boolean, nullable=False, default=False)
@@ -375,7 +589,8 @@ class Upload(db.Model):
         "Chunk",
         backref="upload",
         passive_deletes=True,
-        order_by="Chunk.chunk_id",
+        # chunks may arrive out of order when they are sent in parallel
+        order_by="Chunk.index",
     )
 
     def __init__(self, upload_id, total_chunks, share_id):
@@ -385,23 +600,94 @@ class Upload(db.Model):
 
         self.upload_id = upload_id
         self.total_chunks = total_chunks
-        self.create_date = datetime.datetime.now()
+        self.create_date = datetime.datetime.utcnow()
+
+    @staticmethod
+    def create_if_missing(upload_id, total_chunks, share):
+        """Create an upload, unless one with the same ID already exists.
+
+        This is done in a single ``INSERT ... ON CONFLICT DO NOTHING``, so that
+        concurrent first chunks of an upload can not both try to create it.
+
+        Parameters
+        ----------
+        upload_id : str
+            ID associated to this upload.
+        total_chunks : int
+            Total amount of chunks in this upload.
+        share : Share
+            Share this upload is for.
+        """
+        _insert_or_ignore(
+            Upload,
+            ["upload_id"],
+            upload_id=upload_id,
+            share_id=share.share_id,
+            total_chunks=total_chunks,
+            recv_chunks=0,
+            completed=False,
+            create_date=datetime.datetime.utcnow(),
+        )
+
+    @staticmethod
+    def count_chunk(upload_id):
+        """Atomically increment the amount of received chunks of an upload.
+
+        Concurrent requests each get a distinct count, so exactly one of them
+        sees the upload as fully received.
+
+        Parameters
+        ----------
+        upload_id : str
+            ID associated to the upload.
+
+        Returns
+        -------
+        int
+            Amount of chunks received, including this one.
+        """
+        return db.session.execute(
+            db.update(Upload)
+            .where(Upload.upload_id == upload_id)
+            .values(recv_chunks=Upload.recv_chunks + 1)
+            .returning(Upload.recv_chunks)
+            .execution_options(synchronize_session=False)
+        ).scalar_one()
 
     def complete(self):
-        """Merge chunks, save the file, then clean up."""
-        tmp_file = storage.get_file(f"{self.share.share_id}_{self.upload_id}")
-        with tmp_file.open(mode="ab") as tmp_f:
+        """Merge chunks, save the file, then clean up.
+
+        Raises
+        ------
+        QuotaExceededError
+            The new file does not fit in the owner's quota. The share is left
+            unchanged.
+        """
+        start = time.perf_counter()
+        tmp_file = storage.get_file(
+            f"{self.share.share_id}_{self.upload_id}", namespace="tmp"
+        )
+        with tmp_file.open(mode="wb") as tmp_f:
             for chunk in self.chunks:
-                chunk_file = storage.get_file(chunk.filename)
+                chunk_file = storage.get_file(chunk.filename, namespace="uploads")
                 with chunk_file.open(mode="rb") as chunk_f:
                     data = chunk_f.read()
                 tmp_f.write(data)
+        metrics.observe("merge_duration", time.perf_counter() - start)
 
-        # replace the old file
-        old_file = self.share.get_handle()
-        old_file.delete()
-        tmp_file.rename(str(self.share.share_id))
+        size = tmp_file.size
+        delta = size - self.share.size
+        result = db.session.execute(
+            usage_update(self.share.owner_name, delta, enforce_quota=delta > 0)
+        )
+        if delta > 0 and result.rowcount != 1:
+            tmp_file.delete()
+            raise QuotaExceededError("Storage quota exceeded.")
+
+        # atomically replace the old file, so downloads never see a missing file
+        tmp_file.rename(str(self.share.share_id), namespace="shares", overwrite=True)
 
+        self.share.size = size
         self.completed = True
 
 
@@ -446,21 +732,125 @@ class Chunk(db.Model):
     filename = db.Column(db.String, nullable=False)
 
     def __init__(self, index, upload_id, total_chunks, share, data):
-        self.upload = Upload.query.filter_by(upload_id=upload_id).first()
-        if self.upload is None:
-            self.upload = Upload(upload_id, total_chunks, share.share_id)
-            self.upload.recv_chunks = 0
-            db.session.add(self.upload)
-
+        Upload.create_if_missing(upload_id, total_chunks, share)
         self.upload_id = upload_id
 
-        self.create_date = datetime.datetime.now()
+        self.create_date = datetime.datetime.utcnow()
         self.index = index
         self.filename = f"{share.share_id}_{self.upload_id}_{self.index}"
 
-        file = storage.get_file(self.filename)
+        file = storage.get_file(self.filename, namespace="uploads")
         with file.open(mode="wb") as f:
             f.write(data)
+        if storage.durability == "every-chunk":
+            file.sync()
+
+
+class MaintenanceTask(db.Model):
+    """Schedule of a periodic maintenance task, shared by all server instances.
+
+    The row doubles as a lock: an instance may only run the task after
+    claiming it with `claim()`, so that only one instance runs it at a time.
+
+    Attributes
+    ----------
+    name : str
+        Name of the task.
+    owner : str
+        Instance that last claimed the task.
+    locked_until : DateTime
+        The task may not be claimed again before this time.
+    last_run : DateTime
+        Time the task last finished.
+    """
+
+    __tablename__ = "maintenance_tasks"
+
+    name = db.Column(db.String, primary_key=True)
+    owner = db.Column(db.String, nullable=True)
+    locked_until = db.Column(db.DateTime, nullable=False)
+    last_run = db.Column(db.DateTime, nullable=True)
+
+    @staticmethod
+    def claim(name, owner, timeout):
+        """Claim a task, if it is due and no other instance is running it.
+
+        The claim is made in a single ``UPDATE``, so concurrent instances can
+        not both succeed.
+
+        Parameters
+        ----------
+        name : str
+            Name of the task.
+        owner : str
+            Identifies the instance claiming the task.
+        timeout : datetime.timedelta
+            Time after which the claim lapses, in case the instance dies while
+            running the task.
+
+        Returns
+        -------
+        bool
+            Whether the task was claimed.
+        """
+        now = datetime.datetime.utcnow()
+        _insert_or_ignore(MaintenanceTask, ["name"], name=name, locked_until=now)
+        result = db.session.execute(
+            db.update(MaintenanceTask)
+            .where(MaintenanceTask.name == name, MaintenanceTask.locked_until <= now)
+            .values(owner=owner, locked_until=now + timeout)
+            .execution_options(synchronize_session=False)
+        )
+        db.session.commit()
+        return result.rowcount == 1
+
+    @staticmethod
+    def finish(name, owner, next_run):
+        """Release a claimed task, and schedule its next run.
+
+        Parameters
+        ----------
+        name : str
+            Name of the task.
+        owner : str
+            Instance that claimed the task.
+        next_run : datetime.datetime
+            The task may not be claimed again before this time.
+        """
+        db.session.execute(
+            db.update(MaintenanceTask)
+            .where(MaintenanceTask.name == name, MaintenanceTask.owner == owner)
+            .values(locked_until=next_run, last_run=datetime.datetime.utcnow())
+            .execution_options(synchronize_session=False)
+        )
+        db.session.commit()
+
+
+# the supported databases (see `sachet.server.SUPPORTED_DATABASES`) all have
+# INSERT ... ON CONFLICT DO NOTHING, and UPDATE ... RETURNING
+_on_conflict_inserts = dict(postgresql=postgresql.insert, sqlite=sqlite.insert)
+
+
+def _insert_or_ignore(model, index_elements, **values):
+    """Insert a row, unless it conflicts with an existing row.
+
+    Parameters
+    ----------
+    model : db.Model
+        Model to insert a row of.
+    index_elements : list of str
+        Columns of the unique index that may conflict.
+    **values
+        Values of the row.
+    """
+    dialect = db.engine.dialect.name
+    if dialect not in _on_conflict_inserts:
+        raise NotImplementedError(f"Database '{dialect}' is not supported.")
+    db.session.execute(
+        _on_conflict_inserts[dialect](model)
+        .values(**values)
+        .on_conflict_do_nothing(index_elements=index_elements)
+    )
 
 
 @event.listens_for(db.session, "persistent_to_deleted")
@@ -468,5 +858,5 @@ def chunk_delete_listener(session, instance):
     # kinda hacky but i have no idea how to trigger event listener on cascaded delete
     if isinstance(instance, Upload):
         for chunk in instance.chunks:
-            file = storage.get_file(chunk.filename)
+            file = storage.get_file(chunk.filename, namespace="uploads")
             file.delete()
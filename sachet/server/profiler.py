@@ -0,0 +1,143 @@
+"""Sampling profiler for the server's own threads.
+
+Every few milliseconds, the stack of every other thread in the process is
+recorded (`sys._current_frames`). Threads run undisturbed in the meantime, so
+this can be used on production workers. The result is in the "collapsed stack"
+format read by flamegraph tools (e.g. ``flamegraph.pl``, speedscope), with one
+line per distinct stack::
+
+    module.function;module.function;... <samples>
+
+A profile is either recorded while a request waits for it (`sample`), which
+only sees the other threads of the worker, or in a background thread (`start`)
+whose result is written to a file and fetched later. The latter also profiles
+sync and single-threaded workers, since the worker is free to handle other
+requests in the meantime.
+"""
+
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+
+class ProfilerBusyError(Exception):
+    """Raised when a profile is already being recorded."""
+
+
+_lock = threading.Lock()
+
+
+def _frame_name(frame):
+    code = frame.f_code
+    module = frame.f_globals.get("__name__", "?")
+    return f"{module}.{getattr(code, 'co_qualname', code.co_name)}"
+
+
+def _stack(frame):
+    names = []
+    while frame is not None:
+        names.append(_frame_name(frame))
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+def sample(seconds, interval=0.005, exclude=()):
+    """Sample the stacks of the process's threads.
+
+    Only one profile may be recorded at a time per process.
+
+    Parameters
+    ----------
+    seconds : float
+        How long to sample for.
+    interval : float, optional
+        Seconds between samples.
+    exclude : iterable of int, optional
+        Identifiers of threads not to sample. The calling thread is never
+        sampled.
+
+    Returns
+    -------
+    collections.Counter
+        Amount of samples for each collapsed stack.
+
+    Raises
+    ------
+    ProfilerBusyError
+        Another profile is being recorded.
+    """
+    if not _lock.acquire(blocking=False):
+        raise ProfilerBusyError("A profile is already being recorded.")
+
+    try:
+        return _record(seconds, interval, exclude)
+    finally:
+        _lock.release()
+
+
+def _record(seconds, interval, exclude=()):
+    exclude = {threading.get_ident(), *exclude}
+    stacks = Counter()
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id not in exclude:
+                stacks[_stack(frame)] += 1
+        time.sleep(interval)
+    return stacks
+
+
+def start(path, seconds, interval=0.005):
+    """Sample the stacks of the process's threads in the background.
+
+    Only one profile may be recorded at a time per process.
+
+    Parameters
+    ----------
+    path : pathlib.Path
+        File to write the collapsed stacks to (see `collapse`) once done. It
+        only appears when the profile is complete.
+    seconds : float
+        How long to sample for.
+    interval : float, optional
+        Seconds between samples.
+
+    Raises
+    ------
+    ProfilerBusyError
+        Another profile is being recorded.
+    """
+    if not _lock.acquire(blocking=False):
+        raise ProfilerBusyError("A profile is already being recorded.")
+
+    def run():
+        try:
+            stacks = _record(seconds, interval)
+            tmp = path.with_suffix(".tmp")
+            tmp.write_text(collapse(stacks))
+            os.replace(tmp, path)
+        finally:
+            _lock.release()
+
+    try:
+        threading.Thread(target=run, name="sachet-profiler", daemon=True).start()
+    except BaseException:
+        _lock.release()
+        raise
+
+
+def collapse(stacks):
+    """Format samples as collapsed stacks, most frequent first.
+
+    Parameters
+    ----------
+    stacks : collections.Counter
+        Result of `sample`.
+
+    Returns
+    -------
+    str
+    """
+    return "".join(f"{stack} {count}\n" for stack, count in stacks.most_common())
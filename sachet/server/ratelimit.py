@@ -0,0 +1,258 @@
+"""Rate limiting with token buckets.
+
+Limits are configured by name in ``SACHET_RATE_LIMITS``, for example::
+
+    SACHET_RATE_LIMITS:
+      login: 10/minute
+      CREATE: 120/minute
+
+Endpoints protected by `sachet.server.views_common.auth_required` use the limit
+named after the endpoint (if any), or else after their required permissions.
+Clients are identified by username, or by IP address when anonymous.
+
+A bucket holds up to N tokens, and refills at N per period. Every request takes
+one token, and requests are refused with ``429 Too Many Requests`` when the
+bucket is empty, so short bursts are allowed while the average rate is bounded.
+"""
+
+import math
+import os
+import sqlite3
+import threading
+import time
+from functools import wraps
+from pathlib import Path
+from flask import current_app, jsonify, request
+
+periods = dict(second=1, minute=60, hour=3600, day=86400)
+
+
+def parse_limit(limit):
+    """Parse a limit like ``10/minute``.
+
+    Parameters
+    ----------
+    limit : str
+        Amount of requests, and the period they are allowed in.
+
+    Returns
+    -------
+    rate : float
+        Tokens added to the bucket per second.
+    burst : int
+        Capacity of the bucket.
+    """
+    amount, _, period = str(limit).partition("/")
+    try:
+        burst = int(amount)
+        seconds = periods[period.strip()]
+    except (ValueError, KeyError) as e:
+        raise ValueError(f"Invalid rate limit '{limit}'; use e.g. '10/minute'.") from e
+    if burst < 1:
+        raise ValueError(f"Invalid rate limit '{limit}'; must allow a request.")
+    return burst / seconds, burst
+
+
+def _take(tokens, updated, now, rate, burst):
+    """Take a token from a bucket.
+
+    Returns the tokens left, and the seconds to wait before a token is
+    available (0 if one was taken.)
+    """
+    if tokens is None:
+        tokens = burst
+    else:
+        tokens = min(burst, tokens + (now - updated) * rate)
+
+    if tokens >= 1:
+        return tokens - 1, 0
+    return tokens, (1 - tokens) / rate
+
+
+class MemoryBackend:
+    """Keeps buckets in memory; each worker process has its own limits.
+
+    Parameters
+    ----------
+    max_keys : int, optional
+        Buckets are pruned when there are more than this many.
+    """
+
+    def __init__(self, max_keys=100000):
+        self.max_keys = max_keys
+        # key -> (tokens, updated, time at which the bucket is full again)
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def take(self, key, rate, burst, now=None):
+        """Take a token for a key.
+
+        Returns
+        -------
+        float
+            Seconds to wait before retrying, or 0 if the request is allowed.
+        """
+        now = time.time() if now is None else now
+        with self._lock:
+            tokens, updated, _ = self._buckets.get(key, (None, None, None))
+            tokens, wait = _take(tokens, updated, now, rate, burst)
+            self._buckets[key] = (tokens, now, now + (burst - tokens) / rate)
+
+            if len(self._buckets) > self.max_keys:
+                self._prune(now)
+        return wait
+
+    def _prune(self, now):
+        # full buckets behave exactly like missing ones
+        self._buckets = {
+            key: bucket for key, bucket in self._buckets.items() if bucket[2] > now
+        }
+
+
+class SQLiteBackend:
+    """Keeps buckets in an SQLite database, shared by all workers on a host.
+
+    Parameters
+    ----------
+    path : str
+        Path of the database file.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+
+    def _connect(self):
+        # connections can't be shared across threads, or forked processes
+        connection = getattr(self._local, "connection", None)
+        if connection is None or self._local.pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            # losing rate limiting state in a crash does not matter
+            connection.execute("PRAGMA synchronous=OFF")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS buckets ("
+                "key TEXT PRIMARY KEY, tokens REAL NOT NULL, "
+                "updated REAL NOT NULL, full_at REAL NOT NULL)"
+            )
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+            self._local.calls = 0
+        return connection
+
+    def take(self, key, rate, burst, now=None):
+        """Take a token for a key.
+
+        Returns
+        -------
+        float
+            Seconds to wait before retrying, or 0 if the request is allowed.
+        """
+        now = time.time() if now is None else now
+        connection = self._connect()
+
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            row = connection.execute(
+                "SELECT tokens, updated FROM buckets WHERE key = ?", (key,)
+            ).fetchone()
+            tokens, wait = _take(*(row or (None, None)), now, rate, burst)
+            connection.execute(
+                "INSERT INTO buckets VALUES (?, ?, ?, ?) ON CONFLICT (key) DO UPDATE "
+                "SET tokens = excluded.tokens, updated = excluded.updated, "
+                "full_at = excluded.full_at",
+                (key, tokens, now, now + (burst - tokens) / rate),
+            )
+
+            self._local.calls += 1
+            if self._local.calls % 1000 == 0:
+                connection.execute("DELETE FROM buckets WHERE full_at < ?", (now,))
+
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        return wait
+
+
+def get_backend():
+    """Return the current app's rate limiting backend, creating it on first use."""
+    backend = current_app.extensions.get("sachet_ratelimit")
+    if backend is None:
+        method = current_app.config["SACHET_RATE_LIMIT_BACKEND"]
+        if method == "memory":
+            backend = MemoryBackend()
+        elif method == "sqlite":
+            path = Path(current_app.config["SACHET_RATE_LIMIT_SQLITE_PATH"])
+            if not path.is_absolute():
+                path = Path(current_app.instance_path) / path
+            path.parent.mkdir(parents=True, exist_ok=True)
+            backend = SQLiteBackend(str(path))
+        else:
+            raise ValueError(f"{method} is not a valid rate limiting backend.")
+        current_app.extensions["sachet_ratelimit"] = backend
+    return backend
+
+
+def check(names, identity=None):
+    """Apply the first configured limit among some names.
+
+    Parameters
+    ----------
+    names : iterable of str
+        Names of limits, in order of preference.
+    identity : str, optional
+        Identifies the client. Defaults to its IP address.
+
+    Returns
+    -------
+    flask.Response or None
+        ``429 Too Many Requests`` if the client is over the limit, else None.
+    """
+    limits = current_app.config["SACHET_RATE_LIMITS"]
+    if not limits:
+        return None
+
+    for name in names:
+        if name in limits:
+            break
+    else:
+        return None
+
+    if identity is None:
+        identity = f"ip:{request.remote_addr}"
+
+    rate, burst = parse_limit(limits[name])
+    wait = get_backend().take(f"{name}:{identity}", rate, burst)
+    if not wait:
+        return None
+
+    resp = jsonify({"status": "fail", "message": "Too many requests."})
+    resp.status_code = 429
+    resp.headers["Retry-After"] = str(math.ceil(wait))
+    return resp
+
+
+def rate_limited(name):
+    """Limit an endpoint's requests per client IP address.
+
+    For authenticated endpoints, use the `rate_limit` argument of
+    `sachet.server.views_common.auth_required` instead.
+
+    Parameters
+    ----------
+    name : str
+        Name of the limit in ``SACHET_RATE_LIMITS``.
+    """
+
+    def _decorate(f):
+        @wraps(f)
+        def decorator(*args, **kwargs):
+            resp = check((name,))
+            if resp is not None:
+                return resp
+            return f(*args, **kwargs)
+
+        return decorator
+
+    return _decorate
@@ -0,0 +1,192 @@
+"""Periodic maintenance, so that stale entries don't need to be removed by hand.
+
+The scheduler either runs in a thread of the server (``SACHET_MAINTENANCE_THREAD``)
+or in a separate process (``flask maintenance run``.) Any amount of instances may
+run it: each task is claimed through its row in the database (see
+`sachet.server.models.MaintenanceTask`), so only one instance runs a task at a
+time, and only once per interval.
+"""
+
+import datetime
+import os
+import socket
+import threading
+from flask import current_app
+from sachet.server import db, maintenance
+from sachet.server.models import MaintenanceTask
+
+
+def _stale_cutoff():
+    hours = current_app.config["SACHET_MAINTENANCE_STALE_HOURS"]
+    return datetime.datetime.utcnow() - datetime.timedelta(hours=hours)
+
+
+def delete_stale_uploads():
+    """Delete unfinished uploads, and return how many were deleted."""
+    count = 0
+    for batch in maintenance.stale_uploads(_stale_cutoff()):
+        maintenance.delete_uploads(batch)
+        count += len(batch)
+    return count
+
+
+def delete_stale_shares():
+    """Delete uninitialized shares, and return how many were deleted."""
+    count = 0
+    for batch in maintenance.stale_shares(_stale_cutoff()):
+        maintenance.delete_shares(batch)
+        count += len(batch)
+    return count
+
+
+def delete_expired_shares():
+    """Delete expired shares, and return how many were deleted."""
+    count = 0
+    for batch in maintenance.expired_shares(datetime.datetime.utcnow()):
+        maintenance.delete_shares(batch)
+        count += len(batch)
+    return count
+
+
+tasks = dict(
+    uploads=delete_stale_uploads,
+    shares=delete_stale_shares,
+    expired=delete_expired_shares,
+    tokens=maintenance.delete_expired_tokens,
+)
+"""Maintenance tasks by name; each returns the amount of entries it removed."""
+
+
+class Scheduler:
+    """Runs maintenance tasks when they are due.
+
+    This must be used within an application context.
+
+    Parameters
+    ----------
+    intervals : dict, optional
+        Maps task names to the amount of seconds between runs. Tasks with an
+        interval of None are disabled. Defaults to ``SACHET_MAINTENANCE_INTERVALS``.
+    timeout : int, optional
+        Seconds after which a claim on a task lapses, in case the instance
+        running it died. Defaults to ``SACHET_MAINTENANCE_TIMEOUT``.
+    owner : str, optional
+        Identifies this instance. Defaults to the hostname and process ID.
+    """
+
+    def __init__(self, intervals=None, timeout=None, owner=None):
+        config = current_app.config
+        if intervals is None:
+            intervals = config["SACHET_MAINTENANCE_INTERVALS"]
+        if timeout is None:
+            timeout = config["SACHET_MAINTENANCE_TIMEOUT"]
+
+        for name in intervals:
+            if name not in tasks:
+                raise ValueError(f"'{name}' is not a valid maintenance task.")
+
+        self.intervals = intervals
+        self.timeout = datetime.timedelta(seconds=timeout)
+        self.owner = owner or f"{socket.gethostname()}:{os.getpid()}"
+
+    def run_pending(self):
+        """Run every task that is due and not claimed by another instance.
+
+        Returns
+        -------
+        dict
+            Maps the names of the tasks that were run to the amount of entries
+            they removed, or None if they failed.
+        """
+        results = {}
+
+        for name, interval in self.intervals.items():
+            if interval is None:
+                continue
+            if not MaintenanceTask.claim(name, self.owner, self.timeout):
+                continue
+
+            start = datetime.datetime.utcnow()
+            try:
+                results[name] = tasks[name]()
+            except Exception:
+                db.session.rollback()
+                current_app.logger.exception(f"Maintenance task '{name}' failed.")
+                results[name] = None
+            finally:
+                MaintenanceTask.finish(
+                    name, self.owner, start + datetime.timedelta(seconds=interval)
+                )
+
+        return results
+
+    def run_forever(self, stop, poll=60):
+        """Run tasks as they become due, until stopped.
+
+        Parameters
+        ----------
+        stop : threading.Event
+            Set this to stop the scheduler.
+        poll : int, optional
+            Seconds between checks for due tasks.
+        """
+        while not stop.is_set():
+            try:
+                for name, count in self.run_pending().items():
+                    if count is not None:
+                        current_app.logger.info(
+                            f"Maintenance task '{name}' removed {count} entries."
+                        )
+            except Exception:
+                # e.g. the database is unreachable; try again later
+                db.session.rollback()
+                current_app.logger.exception("Could not run maintenance.")
+            stop.wait(poll)
+
+
+def start_thread(app, poll=60):
+    """Run the scheduler in a background thread.
+
+    Parameters
+    ----------
+    app : flask.Flask
+        Application to run maintenance for.
+    poll : int, optional
+        Seconds between checks for due tasks.
+
+    Returns
+    -------
+    threading.Event
+        Set this to stop the thread.
+    """
+    stop = threading.Event()
+
+    def run():
+        with app.app_context():
+            Scheduler().run_forever(stop, poll=poll)
+
+    threading.Thread(target=run, name="sachet-maintenance", daemon=True).start()
+    return stop
+
+
+def init_app(app):
+    """Run maintenance in a thread of the server (``SACHET_MAINTENANCE_THREAD``).
+
+    The thread is started by the first request a process serves, and not when
+    the app is created: ``flask`` CLI commands also create the app, and should
+    not run maintenance in the background. This also keeps the thread out of
+    servers that create the app before forking workers.
+
+    Parameters
+    ----------
+    app : flask.Flask
+    """
+    lock = threading.Lock()
+
+    @app.before_request
+    def _start_thread():
+        if "sachet_maintenance" in app.extensions:
+            return
+        with lock:
+            if "sachet_maintenance" not in app.extensions:
+                app.extensions["sachet_maintenance"] = start_thread(app)
@@ -0,0 +1,87 @@
+"""Marshmallow schemas for the models.
+
+Marshmallow's SQLAlchemy integration is slow to import, so this module is only
+imported when a schema is first needed (see the models' ``get_schema()``), and
+not when a CLI command or a worker starts.
+"""
+
+import datetime
+from bitmask import Bitmask
+from flask_marshmallow import Marshmallow
+from marshmallow import fields, validate, ValidationError
+from sachet.server.models import Permissions, User, ServerSettings, Share
+
+ma = Marshmallow()
+
+
+class PermissionField(fields.Field):
+    """Field that serializes a Permissions bitmask to an array of strings in Marshmallow."""
+
+    def _serialize(self, value, attr, obj, **kwargs):
+        mask = Bitmask()
+        mask.AllFlags = Permissions
+        mask += value
+        return [flag.name for flag in mask]
+
+    def _deserialize(self, value, attr, data, **kwargs):
+        mask = Bitmask()
+        mask.AllFlags = Permissions
+
+        flags = value
+
+        try:
+            for flag in flags:
+                mask.add(Permissions[flag])
+        except KeyError as e:
+            raise ValidationError("Invalid permission.") from e
+
+        return mask
+
+
+class UTCDateTimeField(fields.DateTime):
+    """DateTime field for times stored in UTC, without a timezone.
+
+    Times with a timezone are converted to UTC. Times without one are assumed
+    to be in UTC already.
+    """
+
+    def _deserialize(self, value, attr, data, **kwargs):
+        value = super()._deserialize(value, attr, data, **kwargs)
+        if value.tzinfo is not None:
+            value = value.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+        return value
+
+
+class UserSchema(ma.SQLAlchemySchema):
+    class Meta:
+        model = User
+
+    username = ma.auto_field()
+    register_date = ma.auto_field(dump_only=True)
+    password = fields.Str(load_only=True, required=False)
+    permissions = PermissionField()
+    quota = ma.auto_field(validate=validate.Range(min=0))
+    used_bytes = ma.auto_field(dump_only=True)
+
+
+class ServerSettingsSchema(ma.SQLAlchemySchema):
+    class Meta:
+        model = ServerSettings
+
+    default_permissions = PermissionField()
+
+
+class ShareSchema(ma.SQLAlchemySchema):
+    class Meta:
+        model = Share
+
+    share_id = ma.auto_field(dump_only=True)
+    create_date = ma.auto_field(dump_only=True)
+    owner_name = ma.auto_field()
+    file_name = ma.auto_field()
+    initialized = ma.auto_field(dump_only=True)
+    locked = ma.auto_field(dump_only=True)
+    expires_at = UTCDateTimeField(allow_none=True)
+    max_downloads = ma.auto_field(validate=validate.Range(min=1))
+    download_count = ma.auto_field(dump_only=True)
+    size = ma.auto_field(dump_only=True)
@@ -0,0 +1,205 @@
+"""Timing of request phases.
+
+To find out where a slow request spends its time, time spent in each phase of
+a request (authentication steps, database queries, storage I/O) can be sent to
+clients in ``Server-Timing`` headers (``SACHET_SERVER_TIMING``), and logged as
+one JSON line per request (``SACHET_TIMING_LOG``).
+
+Code marks a phase with ``with phase("name"):``. Phases may overlap: for
+instance, the user lookup is also counted as database time. Unless one
+of the settings above is enabled, `phase` returns a shared no-op context
+manager, and no listeners are installed.
+"""
+
+import contextlib
+import json
+import logging
+import time
+from flask import current_app, g, has_app_context, request
+from sqlalchemy import event
+
+_disabled = contextlib.nullcontext()
+
+
+class _Phase:
+    __slots__ = ("timings", "name", "start")
+
+    def __init__(self, timings, name):
+        self.timings = timings
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc):
+        _add(self.timings, self.name, time.perf_counter() - self.start)
+
+
+def _add(timings, name, duration):
+    total, count = timings.get(name, (0, 0))
+    timings[name] = (total + duration, count + 1)
+
+
+def phase(name):
+    """Time a block of code as part of the current request.
+
+    Parameters
+    ----------
+    name : str
+        Name of the phase. Time spent in phases with the same name adds up.
+    """
+    timings = g.get("timings") if has_app_context() else None
+    if timings is None:
+        return _disabled
+    return _Phase(timings, name)
+
+
+class _TimedIO:
+    """File object whose reads and writes count as storage time."""
+
+    def __init__(self, f):
+        self._f = f
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def read(self, *args):
+        with phase("storage"):
+            return self._f.read(*args)
+
+    def write(self, data):
+        with phase("storage"):
+            return self._f.write(data)
+
+    def close(self):
+        with phase("storage"):
+            self._f.close()
+
+    def __getattr__(self, name):
+        return getattr(self._f, name)
+
+
+class _TimedFile:
+    """Storage file handle whose I/O counts as storage time."""
+
+    def __init__(self, file):
+        self._file = file
+
+    def open(self, mode="r"):
+        with phase("storage"):
+            return _TimedIO(self._file.open(mode))
+
+    def rename(self, *args, **kwargs):
+        with phase("storage"):
+            self._file.rename(*args, **kwargs)
+
+    def delete(self):
+        with phase("storage"):
+            self._file.delete()
+
+    def sync(self):
+        with phase("storage"):
+            self._file.sync()
+
+    def __getattr__(self, name):
+        return getattr(self._file, name)
+
+
+class TimedStorage:
+    """Wraps a storage backend, so that its file I/O counts as storage time.
+
+    Parameters
+    ----------
+    storage : sachet.storage.Storage
+    """
+
+    def __init__(self, storage):
+        self._storage = storage
+
+    def get_file(self, name, namespace="shares"):
+        return _TimedFile(self._storage.get_file(name, namespace))
+
+    def create_file(self, name, namespace="shares"):
+        with phase("storage"):
+            return _TimedFile(self._storage.create_file(name, namespace))
+
+    @property
+    def __class__(self):
+        # so that isinstance() checks see the real backend, like LocalProxy
+        return self._storage.__class__
+
+    def __getattr__(self, name):
+        return getattr(self._storage, name)
+
+
+def enabled(config):
+    """Check if request timing is enabled in a configuration."""
+    return bool(config["SACHET_SERVER_TIMING"] or config["SACHET_TIMING_LOG"])
+
+
+def _start_request():
+    g.timings = {}
+    g.timings_start = time.perf_counter()
+
+
+def _finish_request(response):
+    timings = g.pop("timings", None)
+    if timings is None:
+        return response
+    total = time.perf_counter() - g.pop("timings_start")
+
+    if current_app.config["SACHET_SERVER_TIMING"]:
+        metrics = [
+            f"{name};dur={duration * 1000:.3f}"
+            for name, (duration, count) in timings.items()
+        ]
+        metrics.append(f"total;dur={total * 1000:.3f}")
+        response.headers["Server-Timing"] = ", ".join(metrics)
+
+    if current_app.config["SACHET_TIMING_LOG"]:
+        record = dict(
+            method=request.method,
+            path=request.path,
+            endpoint=request.endpoint,
+            status=response.status_code,
+            total_ms=round(total * 1000, 3),
+            phases={
+                name: dict(ms=round(duration * 1000, 3), count=count)
+                for name, (duration, count) in timings.items()
+            },
+        )
+        current_app.logger.getChild("timing").info(json.dumps(record))
+
+    return response
+
+
+def init_app(app, engine):
+    """Install the request hooks and query listeners, if timing is enabled.
+
+    Parameters
+    ----------
+    app : flask.Flask
+    engine : sqlalchemy.engine.Engine
+        Engine whose queries are timed.
+    """
+    if not enabled(app.config):
+        return
+
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
+    # propagates to the app's log handler, even if the app logs less
+    app.logger.getChild("timing").setLevel(logging.INFO)
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before_query(conn, cursor, statement, parameters, context, executemany):
+        context._timing_start = time.perf_counter()
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after_query(conn, cursor, statement, parameters, context, executemany):
+        duration = time.perf_counter() - context._timing_start
+        timings = g.get("timings") if has_app_context() else None
+        if timings is not None:
+            _add(timings, "db", duration)
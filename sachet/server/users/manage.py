@@ -1,4 +1,4 @@
-from sachet.server import app, db
+from sachet.server import db
 from sachet.server.models import User
 
 
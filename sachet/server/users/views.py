@@ -7,13 +7,16 @@ from sachet.server.models import (
     BlacklistToken,
 )
 from sachet.server.views_common import ModelAPI, ModelListAPI, auth_required
-from sachet.server import bcrypt, db
+from sachet.server import db
+from sachet.server.hashing import check_password, needs_rehash, HashingBusyError
+from sachet.server.ratelimit import rate_limited
 import uuid
 
 users_blueprint = Blueprint("users_blueprint", __name__)
 
 
 class LoginAPI(MethodView):
+    @rate_limited("login")
     def post(self):
         post_data = request.get_json()
         user = User.query.filter_by(username=post_data.get("username")).first()
@@ -21,7 +24,16 @@ class LoginAPI(MethodView):
             resp = {"status": "fail", "message": "Invalid credentials."}
             return jsonify(resp), 401
 
-        if bcrypt.check_password_hash(user.password, post_data.get("password", "")):
+        password = post_data.get("password", "")
+        if check_password(user.password, password):
+            if needs_rehash(user.password):
+                # the configured cost changed since this hash was made
+                try:
+                    user.password = password
+                    db.session.commit()
+                except HashingBusyError:
+                    # logging in matters more; try again next time
+                    pass
             token = user.encode_token(jti=f"login_{uuid.uuid4()}")
             resp = {
                 "status": "success",
@@ -109,7 +121,7 @@ class PasswordAPI(MethodView):
                 400,
             )
 
-        if not bcrypt.check_password_hash(auth_user.password, old_psswd):
+        if not check_password(auth_user.password, old_psswd):
             return (
                 jsonify(
                     {
@@ -160,7 +172,7 @@ class UserAPI(ModelAPI):
 
     @auth_required
     def get(self, username, auth_user=None):
-        info_user = User.query.filter_by(username=username).first()
+        info_user = db.session.get(User, username)
         # only allow user to query themselves, but admin can query anyone
         if (not info_user) or (
             info_user != auth_user and Permissions.ADMIN not in auth_user.permissions
@@ -175,17 +187,17 @@ class UserAPI(ModelAPI):
 
     @auth_required(required_permissions=(Permissions.ADMIN,))
     def patch(self, username, auth_user=None):
-        patch_user = User.query.filter_by(username=username).first()
+        patch_user = db.session.get(User, username)
         return super().patch(patch_user)
 
     @auth_required(required_permissions=(Permissions.ADMIN,))
     def put(self, username, auth_user=None):
-        put_user = User.query.filter_by(username=username).first()
+        put_user = db.session.get(User, username)
         return super().put(put_user)
 
     @auth_required(required_permissions=(Permissions.ADMIN,))
     def delete(self, username, auth_user=None):
-        delete_user = User.query.filter_by(username=username).first()
+        delete_user = db.session.get(User, username)
         return super().delete(delete_user)
 
 
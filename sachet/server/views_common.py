@@ -1,15 +1,18 @@
-from flask import request, jsonify
+from flask import current_app, request, jsonify, Response, stream_with_context
 from flask.views import MethodView
 from sachet.server.models import Permissions, User, BlacklistToken, get_settings
-from sachet.server import db
+from sachet.server import db, ratelimit
 from functools import wraps
 from marshmallow import ValidationError
+from sqlalchemy import inspect
 from bitmask import Bitmask
 import jwt
 
 
 # https://stackoverflow.com/questions/3888158/making-decorators-with-optional-arguments
-def auth_required(func=None, *, required_permissions=(), allow_anonymous=False):
+def auth_required(
+    func=None, *, required_permissions=(), allow_anonymous=False, rate_limit=None
+):
     """Require specific authentication.
 
     Passes an argument `user` to the function, with a User object corresponding
@@ -21,7 +24,14 @@ def auth_required(func=None, *, required_permissions=(), allow_anonymous=False):
         Permissions required to access this endpoint.
     allow_anonymous : bool, optional
         Allow anonymous authentication. This means the `user` parameter might be None.
+    rate_limit : str, optional
+        Name of the rate limit for this endpoint (see `sachet.server.ratelimit`.)
+        If it is not configured, the limits named after the required
+        permissions apply.
     """
+    limit_names = [perm.name for perm in required_permissions]
+    if rate_limit:
+        limit_names.insert(0, rate_limit)
 
     def _decorate(f):
         @wraps(f)
@@ -54,6 +64,9 @@ def auth_required(func=None, *, required_permissions=(), allow_anonymous=False):
                             ),
                             401,
                         )
+                    resp = ratelimit.check(limit_names)
+                    if resp is not None:
+                        return resp
                     kwargs["auth_user"] = None
                     return f(*args, **kwargs)
                 else:
@@ -88,6 +101,10 @@ def auth_required(func=None, *, required_permissions=(), allow_anonymous=False):
                     403,
                 )
 
+            resp = ratelimit.check(limit_names, f"user:{user.username}")
+            if resp is not None:
+                return resp
+
             kwargs["auth_user"] = user
             return f(*args, **kwargs)
 
@@ -212,9 +229,35 @@ class ModelAPI(MethodView):
         return jsonify({"status": "success"})
 
 
+def _dumped_columns(ModelClass, schema):
+    """Find the columns a schema dumps, to load only those.
+
+    Parameters
+    ----------
+    ModelClass
+        Model class the schema is for.
+    schema : marshmallow.Schema
+
+    Returns
+    -------
+    list or None
+        Column attributes of the model, or None if the schema dumps anything
+        that is not a plain column (e.g. a property), in which case every
+        column should be loaded.
+    """
+    columns = inspect(ModelClass).column_attrs
+    names = [field.attribute or name for name, field in schema.dump_fields.items()]
+    if not all(name in columns for name in names):
+        return None
+    return [getattr(ModelClass, name) for name in names]
+
+
 class ModelListAPI(MethodView):
     """Generic API for representing all instances of a given model."""
 
+    #: rows fetched from the database and serialized at once when streaming
+    stream_batch_size = 500
+
     def post(self, ModelClass, data={}):
         """Create new instance of a class.
 
@@ -225,7 +268,7 @@ class ModelListAPI(MethodView):
         data : dict
             Object that can be loaded with Marshmallow to create the class.
         """
-        model_schema = ModelClass.get_schema(ModelClass)
+        model_schema = ModelClass.get_schema()
 
         try:
             deserialized = model_schema.load(data)
@@ -252,9 +295,13 @@ class ModelListAPI(MethodView):
         URL Parameters
         ---------------
         per_page : int
-            Amount of entries to return in one query.
+            Amount of entries to return in one query, at most
+            ``SACHET_MAX_PER_PAGE``.
         page : int
             Incrementing this reads the next `per_page` entries.
+        format : str, optional
+            With ``ndjson``, all instances are streamed instead (see `stream`),
+            and the other parameters are ignored.
 
         Returns
         -------
@@ -267,6 +314,12 @@ class ModelListAPI(MethodView):
         pages : int
             Total number of pages.
         """
+        model_schema = ModelClass.get_schema()
+        columns = _dumped_columns(ModelClass, model_schema)
+
+        if request.args.get("format") == "ndjson":
+            return self.stream(ModelClass, model_schema, columns)
+
         try:
             per_page = int(request.args.get("per_page", 15))
             page = int(request.args.get("page", 1))
@@ -281,8 +334,25 @@ class ModelListAPI(MethodView):
                 400,
             )
 
-        page_data = ModelClass.query.paginate(page=page, per_page=per_page)
-        data = [model.get_schema().dump(model) for model in page_data]
+        max_per_page = current_app.config["SACHET_MAX_PER_PAGE"]
+        if not 1 <= per_page <= max_per_page:
+            return (
+                jsonify(
+                    dict(
+                        status="fail",
+                        message=f"per_page must be between 1 and {max_per_page}; "
+                        "use format=ndjson to list everything.",
+                    )
+                ),
+                400,
+            )
+
+        query = ModelClass.query
+        if columns is not None:
+            query = query.options(db.load_only(*columns))
+
+        page_data = query.paginate(page=page, per_page=per_page)
+        data = model_schema.dump(page_data.items, many=True)
 
         return jsonify(
             dict(
@@ -292,3 +362,39 @@ class ModelListAPI(MethodView):
                 pages=page_data.pages,
             )
         )
+
+    def stream(self, ModelClass, model_schema, columns=None):
+        """Stream all instances as newline-delimited JSON.
+
+        Rows are fetched and serialized in batches of `stream_batch_size` as
+        the response is sent, so memory use does not grow with the table.
+
+        Parameters
+        ----------
+        ModelClass
+            Model class to query.
+        model_schema : marshmallow.Schema
+            Schema to dump instances with.
+        columns : list, optional
+            Only load these columns (see `_dumped_columns`).
+
+        Returns
+        -------
+        flask.Response
+            One JSON object per line, in ``application/x-ndjson``.
+        """
+        query = db.select(ModelClass).order_by(*inspect(ModelClass).primary_key)
+        if columns is not None:
+            query = query.options(db.load_only(*columns))
+        query = query.execution_options(yield_per=self.stream_batch_size)
+
+        def generate():
+            for batch in db.session.scalars(query).partitions():
+                yield "".join(
+                    current_app.json.dumps(row) + "\n"
+                    for row in model_schema.dump(batch, many=True)
+                )
+
+        return Response(
+            stream_with_context(generate()), mimetype="application/x-ndjson"
+        )
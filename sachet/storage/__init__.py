@@ -1,31 +1,112 @@
 class Storage:
     """Generic storage interface.
 
+    Files are grouped in namespaces, so that different kinds of files can be
+    stored separately. Every method taking a filename also takes a
+    `namespace`, which defaults to finished shares.
+
+    Attributes
+    ----------
+    namespaces : tuple of str
+        Valid namespaces: "shares" for finished shares, "uploads" for chunks of
+        uploads in progress, and "tmp" for temporary files.
+    durability_levels : tuple of str
+        Valid values for the ``SACHET_DURABILITY`` setting. With "none", data
+        is never explicitly flushed to stable storage. With "on-complete",
+        files are flushed before they are renamed, so a finished share
+        survives a crash. With "every-chunk", every chunk is also flushed as
+        soon as it is received, so an interrupted upload can be resumed after
+        a crash.
+    durability : str
+        Durability level in use.
+
     Raises
     ------
     OSError
         If the storage could not be initialized.
     """
 
-    def list_files(self):
-        """List all files.
+    namespaces = ("shares", "uploads", "tmp")
+    durability_levels = ("none", "on-complete", "every-chunk")
+
+    def list_files(self, namespace="shares"):
+        """List all files in a namespace.
+
+        Parameters
+        ----------
+        namespace : str, optional
+            Namespace to list.
 
         Returns
         -------
         list of File
 
+        """
+        return list(self.iter_files(namespace))
+
+    def iter_files(self, namespace="shares"):
+        """Iterate over all files in a namespace.
+
+        Unlike `list_files()`, this does not hold every file in memory at once,
+        so it should be preferred for large storages.
+
+        Parameters
+        ----------
+        namespace : str, optional
+            Namespace to list.
+
+        Yields
+        ------
+        File
+
         """
         pass
 
-    def get_file(self, name):
+    def get_file(self, name, namespace="shares"):
         """Return a File handle for a given file.
 
-        The file will be created if it does not exist yet.
+        This has no side effects: the file is not created if it does not exist
+        yet, and no metadata is written. Opening the handle for writing will
+        create the file.
 
         Parameters
         ----------
         name : str
             Filename to access.
+        namespace : str, optional
+            Namespace the file is in.
+
+        """
+        pass
+
+    def create_file(self, name, namespace="shares"):
+        """Create an empty file, and return a File handle for it.
+
+        If the file already exists, it is left as-is.
+
+        Parameters
+        ----------
+        name : str
+            Filename to create.
+        namespace : str, optional
+            Namespace the file is in.
+
+        """
+        pass
+
+    def exists(self, name, namespace="shares"):
+        """Check if a file exists.
+
+        Parameters
+        ----------
+        name : str
+            Filename to check.
+        namespace : str, optional
+            Namespace the file is in.
+
+        Returns
+        -------
+        bool
 
         """
         pass
@@ -33,14 +114,20 @@ class Storage:
     class File:
         """Handle for a file.
 
-        Do not instantiate this; use `Storage.get_file()`.
+        Do not instantiate this; use `Storage.get_file()` or `Storage.create_file()`.
 
         Attributes
         ----------
         name : str
             Filename
+        namespace : str
+            Namespace the file is in.
         size : int
             Size in bytes of the file.
+        exists : bool
+            Whether the file exists in storage.
+        modify_date : DateTime
+            Time the file was last modified (UTC.)
         """
 
         def open(self, mode="r"):
@@ -59,17 +146,40 @@ class Storage:
             """
             pass
 
+        def sync(self):
+            """Flush the file's contents and its name to stable storage.
+
+            Callers should only do this when the storage's `durability` level
+            requires it, since this is slow.
+            """
+            pass
+
         def delete(self):
-            """Delete file."""
+            """Delete file.
+
+            Deleting a file that does not exist does nothing.
+            """
             pass
 
-        def rename(self, new_name):
+        def rename(self, new_name, namespace=None, overwrite=False):
             """Rename a file.
 
             Parameters
             ----------
             new_name : str
                 New name for the file.
+            namespace : str, optional
+                Namespace to move the file to. By default, the file stays in
+                its current namespace.
+            overwrite : bool, optional
+                Replace the destination if it exists. The replacement is
+                atomic: anyone reading the destination sees either the old or
+                the new contents, never a missing file.
+
+            Raises
+            ------
+            OSError
+                If the destination exists and `overwrite` is not set.
             """
             pass
 
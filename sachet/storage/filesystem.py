@@ -2,10 +2,32 @@ from sachet.storage import Storage
 from flask import current_app
 from pathlib import Path
 from werkzeug.utils import secure_filename
-import json
+import datetime
+import hashlib
+import os
+
+
+def _fsync(path, flags):
+    """Flush a file or directory to stable storage."""
+    fd = os.open(path, flags)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
 
 
 class FileSystem(Storage):
+    """Storage backend using the local filesystem.
+
+    Files are stored as ``files/<namespace>/ab/cd/<name>``, where ``abcd`` is
+    the start of a hash of the filename. This fan-out keeps the number of
+    entries in any single directory small, even with millions of files.
+
+    Older versions stored every file directly in ``files/``; use
+    `legacy_files()` and `migrate_legacy_file()` to move them to the new
+    layout.
+    """
+
     def __init__(self):
         config_path = Path(current_app.config["SACHET_FILE_DIR"])
         if config_path.is_absolute():
@@ -22,39 +44,136 @@ class FileSystem(Storage):
                 f"'{current_app.config['SACHET_FILE_DIR']}' is not a directory."
             )
 
-    def _get_path(self, name):
+        self.durability = current_app.config["SACHET_DURABILITY"]
+        if self.durability not in self.durability_levels:
+            raise ValueError(f"{self.durability} is not a valid durability level.")
+
+    def _get_namespace_directory(self, namespace):
+        if namespace not in self.namespaces:
+            raise ValueError(f"'{namespace}' is not a valid namespace.")
+        return self._files_directory / namespace
+
+    def _get_path(self, name, namespace):
         name = secure_filename(name)
-        return self._files_directory / Path(name)
+        digest = hashlib.sha1(name.encode()).hexdigest()
+        return (
+            self._get_namespace_directory(namespace)
+            / digest[0:2]
+            / digest[2:4]
+            / Path(name)
+        )
+
+    def iter_files(self, namespace="shares"):
+        # scandir gets the file type from the directory entry itself,
+        # so this does not need to stat every file
+        namespace_directory = self._get_namespace_directory(namespace)
+        if not namespace_directory.is_dir():
+            return
+
+        for outer in self._scan_dirs(namespace_directory):
+            for inner in self._scan_dirs(outer):
+                with os.scandir(inner) as entries:
+                    for entry in entries:
+                        if entry.is_file(follow_symlinks=False):
+                            yield self.get_file(entry.name, namespace)
+
+    @staticmethod
+    def _scan_dirs(directory):
+        with os.scandir(directory) as entries:
+            return [
+                entry.path for entry in entries if entry.is_dir(follow_symlinks=False)
+            ]
+
+    def get_file(self, name, namespace="shares"):
+        return self.File(self, name, namespace)
 
-    def list_files(self):
-        return [
-            self.get_file(x.name)
-            for x in self._files_directory.iterdir()
-            if x.is_file()
-        ]
+    def create_file(self, name, namespace="shares"):
+        file = self.File(self, name, namespace)
+        file._path.parent.mkdir(mode=0o700, exist_ok=True, parents=True)
+        file._path.touch()
+        return file
 
-    def get_file(self, name):
-        return self.File(self, name)
+    def exists(self, name, namespace="shares"):
+        return self._get_path(name, namespace).is_file()
+
+    def legacy_files(self):
+        """List names of files stored in the old flat layout.
+
+        Returns
+        -------
+        list of str
+        """
+        with os.scandir(self._files_directory) as entries:
+            return [
+                entry.name for entry in entries if entry.is_file(follow_symlinks=False)
+            ]
+
+    def migrate_legacy_file(self, name, namespace):
+        """Move a file from the old flat layout into a namespace.
+
+        Parameters
+        ----------
+        name : str
+            Name of the file in the flat layout.
+        namespace : str
+            Namespace to move the file to.
+        """
+        new_path = self._get_path(name, namespace)
+        new_path.parent.mkdir(mode=0o700, exist_ok=True, parents=True)
+        (self._files_directory / Path(secure_filename(name))).rename(new_path)
 
     class File:
-        def __init__(self, storage, name):
+        def __init__(self, storage, name, namespace):
             self.name = name
+            self.namespace = namespace
             self._storage = storage
-            self._path = self._storage._get_path(name)
-            self._path.touch()
+            self._path = self._storage._get_path(name, namespace)
+
+        def sync(self):
+            _fsync(self._path, os.O_RDONLY)
+            _fsync(self._path.parent, os.O_RDONLY | os.O_DIRECTORY)
 
         def delete(self):
-            self._path.unlink()
+            self._path.unlink(missing_ok=True)
 
         def open(self, mode="r"):
-            return self._path.open(mode=mode)
+            try:
+                return self._path.open(mode=mode)
+            except FileNotFoundError:
+                if "r" in mode:
+                    raise
+                # fan-out directories are only created once something is written
+                self._path.parent.mkdir(mode=0o700, exist_ok=True, parents=True)
+                return self._path.open(mode=mode)
 
-        def rename(self, new_name):
-            new_path = self._storage._get_path(new_name)
-            if new_path.exists():
-                raise OSError(f"Path {path} already exists.")
+        def rename(self, new_name, namespace=None, overwrite=False):
+            if namespace is None:
+                namespace = self.namespace
+            new_path = self._storage._get_path(new_name, namespace)
+            if not overwrite and new_path.exists():
+                raise OSError(f"Path {new_path} already exists.")
 
-            self._path.rename(new_path)
+            new_path.parent.mkdir(mode=0o700, exist_ok=True, parents=True)
+
+            sync = self._storage.durability != "none"
+            if sync:
+                # the data must be on disk before the new name is,
+                # otherwise a crash could leave an empty file behind
+                _fsync(self._path, os.O_RDONLY)
+            os.replace(self._path, new_path)
+            if sync:
+                _fsync(new_path.parent, os.O_RDONLY | os.O_DIRECTORY)
+            self.name = new_name
+            self.namespace = namespace
+            self._path = new_path
+
+        @property
+        def exists(self):
+            return self._path.is_file()
+
+        @property
+        def modify_date(self):
+            return datetime.datetime.utcfromtimestamp(self._path.stat().st_mtime)
 
         @property
         def size(self):
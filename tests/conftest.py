@@ -3,12 +3,14 @@ import uuid
 from math import ceil
 from sachet.server.users import manage
 from click.testing import CliRunner
-from sachet.server import app, db, storage
+from sachet.server import create_app, db, storage
 from sachet.server.models import Permissions, User
 from werkzeug.datastructures import FileStorage
 from io import BytesIO
 from bitmask import Bitmask
 from pathlib import Path
+from contextlib import contextmanager
+from sqlalchemy import event
 import random
 
 
@@ -23,17 +25,34 @@ def rand():
     return r
 
 
-def clear_filesystem():
+@pytest.fixture(scope="session")
+def app():
+    """Flask application, configured for testing."""
+    return create_app()
+
+
+def clear_filesystem(app):
     if app.config["SACHET_STORAGE"] == "filesystem":
-        for file in storage._files_directory.iterdir():
+        for file in storage._files_directory.rglob("*"):
+            if file.is_dir():
+                continue
             if file.is_relative_to(Path(app.instance_path)) and file.is_file():
                 file.unlink()
             else:
                 raise OSError(f"Attempted to delete {file}: please delete it yourself.")
 
 
+@pytest.fixture(autouse=True)
+def database_marks(request, app):
+    """Skip tests marked for another database than the one tested."""
+    marker = request.node.get_closest_marker("postgresql")
+    uri = app.config["SQLALCHEMY_DATABASE_URI"]
+    if marker and not uri.startswith("postgresql"):
+        pytest.skip("needs a PostgreSQL database (see SACHET_TEST_DATABASE_URI)")
+
+
 @pytest.fixture
-def client(config={}):
+def client(app, config={}):
     """Flask application with DB already set up and ready."""
     with app.test_client() as client:
         with app.app_context():
@@ -43,15 +62,15 @@ def client(config={}):
             db.drop_all()
             db.create_all()
             db.session.commit()
-            clear_filesystem()
+            clear_filesystem(app)
             yield client
-            clear_filesystem()
+            clear_filesystem(app)
             db.session.remove()
             db.drop_all()
 
 
 @pytest.fixture
-def flask_app_bare():
+def flask_app_bare(app):
     """Flask application with empty DB."""
     with app.test_client() as client:
         with app.app_context():
@@ -155,7 +174,7 @@ def validate_info(users):
     ]
 
     def _validate(user, info):
-        schema = User.get_schema(User)
+        schema = User.get_schema()
 
         dumped = schema.dump(users[user])
 
@@ -271,3 +290,34 @@ def upload(client):
         return resp
 
     return upload
+
+
+@pytest.fixture
+def queries(client):
+    """Record the SQL statements executed in a block.
+
+    The session is reset at the start of the block, so that requests in it
+    query the database like they would in production, instead of reusing
+    objects loaded by the test.
+
+    Yields
+    ------
+    list of str
+        Statements executed so far, filled in as the block runs.
+    """
+
+    @contextmanager
+    def record():
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        db.session.remove()
+        event.listen(db.engine, "before_cursor_execute", before_cursor_execute)
+        try:
+            yield statements
+        finally:
+            event.remove(db.engine, "before_cursor_execute", before_cursor_execute)
+
+    return record
@@ -1,8 +1,18 @@
 import pytest
-from sachet.server.commands import create_user, delete_user, cleanup
+from sachet.server.commands import (
+    create_user,
+    delete_user,
+    cleanup,
+    migrate_layout,
+    reconcile,
+    export_archive,
+    import_archive,
+)
 from sqlalchemy import inspect
-from sachet.server import db
+from sachet.server import db, storage
 import datetime
+import uuid
+from io import BytesIO
 from sachet.server.models import User, Share, Chunk, Upload
 
 
@@ -33,7 +43,7 @@ def test_cleanup(client, cli):
     # this one will be destroyed
     share = Share()
     db.session.add(share)
-    share.create_date = datetime.datetime.now() - datetime.timedelta(hours=30)
+    share.create_date = datetime.datetime.utcnow() - datetime.timedelta(hours=30)
     destroyed = share.share_id
     # this one won't
     share = Share()
@@ -42,7 +52,7 @@ def test_cleanup(client, cli):
     # this one neither
     share = Share()
     share.initialized = True
-    share.create_date = datetime.datetime.now() - datetime.timedelta(hours=30)
+    share.create_date = datetime.datetime.utcnow() - datetime.timedelta(hours=30)
     db.session.add(share)
     safe2 = share.share_id
 
@@ -60,22 +70,178 @@ def test_cleanup(client, cli):
     db.session.add(test_share)
 
     chk = Chunk(0, "upload1", 1, test_share, b"test_data")
-    chk.upload.create_date = datetime.datetime.now() - datetime.timedelta(hours=30)
+    chk_upload = db.session.get(Upload, chk.upload_id)
+    chk_upload.create_date = datetime.datetime.utcnow() - datetime.timedelta(hours=30)
     db.session.add(chk)
-    chk_upload_id = chk.upload.upload_id
+    chk_upload_id = chk.upload_id
 
     chk_safe = Chunk(0, "upload2", 1, test_share, b"test_data")
     db.session.add(chk_safe)
-    chk_safe_upload_id = chk_safe.upload.upload_id
+    chk_safe_upload_id = chk_safe.upload_id
 
     db.session.commit()
 
     chk_id = chk.chunk_id
     chk_safe_id = chk_safe.chunk_id
 
-    result = cli.invoke(cleanup)
+    chk_file = storage.get_file(chk.filename, namespace="uploads")
+    chk_safe_file = storage.get_file(chk_safe.filename, namespace="uploads")
+
+    # dry run doesn't change anything
+    result = cli.invoke(cleanup, ["--dry-run"])
     assert result.exit_code == 0
+    assert "Would delete 1 stale uploads." in result.output
+    assert Chunk.query.filter_by(chunk_id=chk_id).first() is not None
+    assert chk_file.exists
+
+    result = cli.invoke(cleanup, ["--batch-size", "1", "--workers", "2"])
+    assert result.exit_code == 0
+    assert not chk_file.exists
+    assert chk_safe_file.exists
     assert Chunk.query.filter_by(chunk_id=chk_id).first() is None
     assert Chunk.query.filter_by(chunk_id=chk_safe_id).first() is not None
     assert Upload.query.filter_by(upload_id=chk_upload_id).first() is None
     assert Upload.query.filter_by(upload_id=chk_safe_upload_id).first() is not None
+
+
+def test_migrate_layout(client, cli):
+    """Test moving files from the flat storage layout to the sharded one."""
+    share = Share()
+    db.session.add(share)
+    chk = Chunk(0, "upload1", 2, share, b"test_data")
+    db.session.add(chk)
+    db.session.commit()
+
+    share_name = str(share.share_id)
+    tmp_name = f"{share.share_id}_upload1"
+
+    # simulate the old layout
+    flat_files = {share_name: b"share", chk.filename: b"chunk", tmp_name: b"tmp"}
+    storage.get_file(chk.filename, namespace="uploads").delete()
+    for name, data in flat_files.items():
+        (storage._files_directory / name).write_bytes(data)
+
+    result = cli.invoke(migrate_layout)
+    assert result.exit_code == 0
+    assert storage.legacy_files() == []
+
+    for name, namespace in [
+        (share_name, "shares"),
+        (chk.filename, "uploads"),
+        (tmp_name, "tmp"),
+    ]:
+        with storage.get_file(name, namespace=namespace).open(mode="rb") as f:
+            assert f.read() == flat_files[name]
+
+
+def test_reconcile(client, cli):
+    """Test finding orphaned files and dangling rows."""
+    # share with its file
+    share = Share()
+    share.initialized = True
+    db.session.add(share)
+    safe = share.share_id
+    with share.get_handle().open(mode="wb") as f:
+        f.write(b"test_data")
+
+    # initialized share with no file
+    share = Share()
+    share.initialized = True
+    db.session.add(share)
+    dangling = share.share_id
+
+    # upload with a missing chunk
+    chk = Chunk(0, "upload1", 2, share, b"test_data")
+    db.session.add(chk)
+    storage.get_file(chk.filename, namespace="uploads").delete()
+    db.session.commit()
+
+    # files with no rows
+    orphans = [
+        storage.create_file(str(uuid.uuid4()), namespace="shares"),
+        storage.create_file(f"{uuid.uuid4()}_upload2_0", namespace="uploads"),
+        storage.create_file(f"{uuid.uuid4()}_upload2", namespace="tmp"),
+    ]
+
+    result = cli.invoke(reconcile, ["--min-age", "0"])
+    assert result.exit_code == 0
+    for file in orphans:
+        assert f"{file.namespace}/{file.name}" in result.output
+        assert file.exists
+    assert str(dangling) in result.output
+    assert str(safe) not in result.output
+    assert "upload1" in result.output
+
+    result = cli.invoke(reconcile, ["--min-age", "0", "--delete"])
+    assert result.exit_code == 0
+    for file in orphans:
+        assert not file.exists
+    assert Share.query.filter_by(share_id=dangling).first() is None
+    assert Upload.query.filter_by(upload_id="upload1").first() is None
+    assert Share.query.filter_by(share_id=safe).first() is not None
+
+    result = cli.invoke(reconcile, ["--min-age", "0"])
+    assert result.exit_code == 0
+    assert "Found 0 orphaned files, 0 shares without files" in result.output
+
+
+def test_archive(client, users, auth, upload, cli, rand, tmp_path):
+    """Test exporting an instance to an archive, then importing it."""
+    contents = {}
+    for i in range(5):
+        resp = client.post("/files", headers=auth("jeff"), json={"file_name": "a"})
+        assert resp.status_code == 201
+        url = resp.get_json().get("url")
+        # one share is left uninitialized
+        if i > 0:
+            contents[url] = rand.randbytes(1000 * i)
+            resp = upload(
+                url + "/content",
+                BytesIO(contents[url]),
+                headers=auth("jeff"),
+                chunk_size=700,
+            )
+            assert resp.status_code == 201
+
+    path = tmp_path / "sachet.tar"
+    result = cli.invoke(export_archive, [str(path), "--batch-size", "2"])
+    assert result.exit_code == 0
+    assert "4 files" in result.output
+
+    # only into an empty database
+    result = cli.invoke(import_archive, [str(path)])
+    assert result.exit_code != 0
+    share_ids = [share.share_id for share in Share.query.all()]
+    user_count = User.query.count()
+
+    db.session.remove()
+    db.drop_all()
+    db.create_all()
+    for share_id in share_ids:
+        storage.get_file(str(share_id)).delete()
+
+    # truncated archives are not imported
+    truncated = tmp_path / "truncated.tar"
+    truncated.write_bytes(path.read_bytes()[:5000])
+    result = cli.invoke(import_archive, [str(truncated)])
+    assert result.exit_code != 0
+    assert User.query.count() == 0
+    assert not any(storage.get_file(str(i)).exists for i in share_ids)
+
+    result = cli.invoke(
+        import_archive, [str(path), "--batch-size", "2", "--workers", "2"]
+    )
+    assert result.exit_code == 0
+    assert Share.query.count() == len(share_ids)
+    assert User.query.count() == user_count
+
+    # tokens stay valid, since the users and their passwords are the same
+    for url, data in contents.items():
+        resp = client.get(url + "/content", headers=auth("jeff"))
+        assert resp.status_code == 200
+        assert resp.data == data
+
+    resp = client.post("/users/login", json={"username": "jeff", "password": "1234"})
+    assert resp.status_code == 200
+    resp = client.get("/whoami", headers=auth("jeff"))
+    assert resp.get_json()["username"] == "jeff"
@@ -0,0 +1,57 @@
+import pytest
+from sqlalchemy import text
+from flask import current_app
+from sachet.server import db
+from sachet.server.config import sqlite_pragmas, engine_options
+
+"""Test configuration handling."""
+
+
+def test_sqlite_pragmas():
+    """Test building SQLite pragmas from the configuration."""
+    assert sqlite_pragmas({}) == {}
+
+    assert sqlite_pragmas(
+        dict(
+            SACHET_SQLITE_JOURNAL_MODE="WAL",
+            SACHET_SQLITE_BUSY_TIMEOUT="1000",
+            SACHET_SQLITE_SYNCHRONOUS=None,
+        )
+    ) == dict(journal_mode="wal", busy_timeout=1000)
+
+    with pytest.raises(ValueError):
+        sqlite_pragmas(dict(SACHET_SQLITE_JOURNAL_MODE="wal; DROP TABLE users"))
+    with pytest.raises(ValueError):
+        sqlite_pragmas(dict(SACHET_SQLITE_CACHE_SIZE="big"))
+
+
+def test_sqlite_connection(client):
+    """Test that pragmas are applied to database connections."""
+    if db.engine.dialect.name != "sqlite":
+        pytest.skip("not using SQLite")
+
+    def pragma(name):
+        return db.session.execute(text(f"PRAGMA {name}")).scalar()
+
+    assert pragma("foreign_keys") == 1
+    assert pragma("busy_timeout") == current_app.config["SACHET_SQLITE_BUSY_TIMEOUT"]
+    assert pragma("journal_mode") == current_app.config["SACHET_SQLITE_JOURNAL_MODE"]
+
+
+def test_engine_options():
+    """Test building connection pool options from the configuration."""
+    assert engine_options({}) == {}
+
+    assert engine_options(
+        dict(
+            SACHET_DB_POOL_SIZE=10,
+            SACHET_DB_MAX_OVERFLOW="5",
+            SACHET_DB_POOL_RECYCLE=None,
+            SACHET_DB_POOL_PRE_PING=True,
+        )
+    ) == dict(pool_size=10, max_overflow=5, pool_pre_ping=True)
+
+    # explicit engine options win
+    assert engine_options(
+        dict(SACHET_DB_POOL_SIZE=10, SQLALCHEMY_ENGINE_OPTIONS=dict(pool_size=20))
+    ) == dict(pool_size=20)
@@ -2,8 +2,9 @@ import pytest
 from os.path import basename
 from io import BytesIO
 from werkzeug.datastructures import FileStorage
-from sachet.server.models import Upload, Chunk
-from sachet.server import storage
+from sachet.server.models import Upload, Chunk, Share, User, usage_update
+from sachet.server import storage, db, maintenance
+import datetime
 import uuid
 
 """Test file share endpoints."""
@@ -58,8 +59,9 @@ class TestSuite:
         )
         assert resp.status_code == 404
 
-        for f in storage.list_files():
-            assert basename(url) not in f.name
+        for namespace in storage.namespaces:
+            for f in storage.list_files(namespace):
+                assert basename(url) not in f.name
 
     def test_modification(self, client, users, auth, rand, upload):
         # create share
@@ -105,6 +107,32 @@ class TestSuite:
         assert resp.data == new_data
         assert "filename=new_bin.bin" in resp.headers["Content-Disposition"].split("; ")
 
+    def test_durability(self, client, users, auth, rand, upload):
+        """Test uploads under every durability level."""
+        default = storage.durability
+        try:
+            for level in storage.durability_levels:
+                storage.durability = level
+
+                resp = client.post(
+                    "/files", headers=auth("jeff"), json={"file_name": "content.bin"}
+                )
+                url = resp.get_json().get("url")
+
+                upload_data = rand.randbytes(4000)
+                resp = upload(
+                    url + "/content",
+                    BytesIO(upload_data),
+                    headers=auth("jeff"),
+                    chunk_size=1230,
+                )
+                assert resp.status_code == 201
+
+                resp = client.get(url + "/content", headers=auth("jeff"))
+                assert resp.data == upload_data
+        finally:
+            storage.durability = default
+
     def test_transfer(self, client, users, auth):
         # create share
         resp = client.post(
@@ -414,3 +442,260 @@ class TestSuite:
             else:
                 assert resp.status_code == 206
                 assert resp.data == upload_data[r[0] : r[1] + 1]
+
+    def test_expiry(self, client, users, auth, upload):
+        """Test share expiry and download limits."""
+        upload_data = b"1234567890" * 40
+
+        def create(**metadata):
+            resp = client.post(
+                "/files",
+                headers=auth("jeff"),
+                json=dict(file_name="content.bin", **metadata),
+            )
+            assert resp.status_code == 201
+            url = resp.get_json().get("url")
+            resp = upload(url + "/content", BytesIO(upload_data), headers=auth("jeff"))
+            assert resp.status_code == 201
+            return url
+
+        # invalid limit
+        resp = client.post(
+            "/files",
+            headers=auth("jeff"),
+            json=dict(file_name="content.bin", max_downloads=0),
+        )
+        assert resp.status_code == 400
+
+        # download limit
+        url = create(max_downloads=2)
+        for i in range(2):
+            resp = client.get(url + "/content", headers=auth("jeff"))
+            assert resp.status_code == 200
+            assert resp.data == upload_data
+
+        # resuming the last download is still possible
+        resp = client.get(
+            url + "/content", headers=auth("jeff", data={"Range": "bytes=100-"})
+        )
+        assert resp.status_code == 206
+        assert resp.data == upload_data[100:]
+
+        # but starting another one is not
+        for r in ("bytes=0-", "bytes=-400"):
+            resp = client.get(url + "/content", headers=auth("jeff", data={"Range": r}))
+            assert resp.status_code == 410
+        resp = client.get(url + "/content", headers=auth("jeff"))
+        assert resp.status_code == 410
+
+        resp = client.get(url, headers=auth("jeff"))
+        assert resp.get_json().get("download_count") == 2
+        assert resp.get_json().get("expires_at") is not None
+
+        # ranges not starting at 0 only resume a recently counted download
+        url = create(max_downloads=1)
+        for i in range(2):
+            resp = client.get(
+                url + "/content", headers=auth("jeff", data={"Range": "bytes=1-"})
+            )
+            assert resp.status_code == 206
+        resp = client.get(url, headers=auth("jeff"))
+        assert resp.get_json().get("download_count") == 1
+
+        share = Share.query.filter_by(share_id=uuid.UUID(url.split("/")[-1])).first()
+        share.last_download -= datetime.timedelta(days=1)
+        share.expires_at = None
+        db.session.commit()
+        resp = client.get(
+            url + "/content", headers=auth("jeff", data={"Range": "bytes=1-"})
+        )
+        assert resp.status_code == 410
+
+        # a download can only be resumed a few times
+        url = create(max_downloads=2)
+        resp = client.get(url + "/content", headers=auth("jeff"))
+        assert resp.status_code == 200
+        for i in range(client.application.config["SACHET_DOWNLOAD_MAX_RESUMES"] + 1):
+            resp = client.get(
+                url + "/content", headers=auth("jeff", data={"Range": "bytes=1-"})
+            )
+            assert resp.status_code == 206
+        resp = client.get(url, headers=auth("jeff"))
+        assert resp.get_json().get("download_count") == 2
+
+        # HEAD requests are not downloads
+        url = create(max_downloads=1)
+        resp = client.head(url + "/content", headers=auth("jeff"))
+        assert resp.status_code == 200
+        assert resp.data == b""
+        assert resp.content_length == len(upload_data)
+        resp = client.get(url + "/content", headers=auth("jeff"))
+        assert resp.status_code == 200
+        assert resp.data == upload_data
+        resp = client.get(url, headers=auth("jeff"))
+        assert resp.get_json().get("download_count") == 1
+
+        # times with a timezone are stored in UTC
+        resp = client.post(
+            "/files",
+            headers=auth("jeff"),
+            json=dict(file_name="content.bin", expires_at="2100-01-01T02:00:00+02:00"),
+        )
+        assert resp.status_code == 201
+        resp = client.get(resp.get_json().get("url"), headers=auth("jeff"))
+        assert resp.get_json().get("expires_at") == "2100-01-01T00:00:00"
+
+        # expiry
+        expired_url = create(
+            expires_at=(
+                datetime.datetime.utcnow() - datetime.timedelta(minutes=1)
+            ).isoformat()
+        )
+        resp = client.get(expired_url + "/content", headers=auth("jeff"))
+        assert resp.status_code == 410
+
+        future_url = create(
+            expires_at=(
+                datetime.datetime.utcnow() + datetime.timedelta(days=1)
+            ).isoformat()
+        )
+        resp = client.get(future_url + "/content", headers=auth("jeff"))
+        assert resp.status_code == 200
+
+        # the sweep only deletes expired shares
+        for batch in maintenance.expired_shares(datetime.datetime.utcnow()):
+            maintenance.delete_shares(batch)
+        assert client.get(expired_url, headers=auth("jeff")).status_code == 404
+        assert client.get(future_url, headers=auth("jeff")).status_code == 200
+
+    def test_quota(self, client, users, auth, upload):
+        """Test storage quotas and usage counters."""
+        jeff = User.query.filter_by(username="jeff").first()
+        jeff.quota = 1000
+        db.session.commit()
+
+        def create():
+            resp = client.post(
+                "/files", headers=auth("jeff"), json={"file_name": "content.bin"}
+            )
+            assert resp.status_code == 201
+            return resp.get_json().get("url")
+
+        def used_bytes():
+            return db.session.get(User, "jeff").used_bytes
+
+        url = create()
+        resp = upload(url + "/content", BytesIO(b"a" * 400), headers=auth("jeff"))
+        assert resp.status_code == 201
+        assert client.get(url, headers=auth("jeff")).get_json().get("size") == 400
+        assert used_bytes() == 400
+
+        # rejected at the first chunk, from the declared size
+        url2 = create()
+        resp = upload(
+            url2 + "/content",
+            BytesIO(b"b" * 800),
+            headers=auth("jeff"),
+            chunk_size=200,
+        )
+        assert resp.status_code == 413
+        assert not list(storage.iter_files("uploads"))
+        assert used_bytes() == 400
+
+        # modifying a share only counts the difference in size
+        resp = upload(
+            url + "/content",
+            BytesIO(b"c" * 900),
+            headers=auth("jeff"),
+            method=client.put,
+        )
+        assert resp.status_code == 201
+        assert used_bytes() == 900
+
+        # the quota is enforced atomically when the upload completes
+        assert (
+            db.session.execute(usage_update("jeff", 101, enforce_quota=True)).rowcount
+            == 0
+        )
+        assert (
+            db.session.execute(usage_update("jeff", 100, enforce_quota=True)).rowcount
+            == 1
+        )
+        db.session.rollback()
+
+        # the new owner's quota is enforced on transfers
+        dave = db.session.get(User, "dave")
+        dave.quota = 500
+        db.session.commit()
+        resp = client.patch(url, headers=auth("jeff"), json={"owner_name": "dave"})
+        assert resp.status_code == 413
+        resp = client.put(
+            url,
+            headers=auth("jeff"),
+            json={"file_name": "content.bin", "owner_name": "dave"},
+        )
+        assert resp.status_code == 413
+        assert client.get(url, headers=auth("jeff")).get_json().get("owner_name") == (
+            "jeff"
+        )
+        assert used_bytes() == 900
+        assert db.session.get(User, "dave").used_bytes == 0
+        dave = db.session.get(User, "dave")
+        dave.quota = None
+        db.session.commit()
+
+        # transferring a share moves its usage
+        resp = client.patch(url, headers=auth("jeff"), json={"owner_name": "dave"})
+        assert resp.status_code == 200
+        assert used_bytes() == 0
+        assert db.session.get(User, "dave").used_bytes == 900
+
+        resp = client.delete(url, headers=auth("dave"))
+        assert resp.status_code == 200
+        assert db.session.get(User, "dave").used_bytes == 0
+
+    def test_upload_counting(self, client, users, auth):
+        """Test creating uploads and counting chunks without read-modify-write races."""
+        resp = client.post(
+            "/files", headers=auth("jeff"), json={"file_name": "content.bin"}
+        )
+        share_id = resp.get_json().get("url").split("/")[-1]
+        share = Share.query.filter_by(share_id=uuid.UUID(share_id)).first()
+
+        # a second creation of the same upload is ignored
+        Upload.create_if_missing("upload1", 3, share)
+        Upload.create_if_missing("upload1", 5, share)
+        db.session.commit()
+        assert Upload.query.filter_by(upload_id="upload1").one().total_chunks == 3
+
+        assert [Upload.count_chunk("upload1") for i in range(3)] == [1, 2, 3]
+        db.session.commit()
+        assert Upload.query.filter_by(upload_id="upload1").one().recv_chunks == 3
+
+    def test_chunk_order(self, client, users, auth, rand):
+        """Test that chunks sent out of order (e.g. in parallel) are merged in order."""
+        resp = client.post(
+            "/files", headers=auth("jeff"), json={"file_name": "content.bin"}
+        )
+        url = resp.get_json().get("url")
+        data = rand.randbytes(3000)
+
+        for chunk_idx in (2, 0, 1):
+            resp = client.post(
+                url + "/content",
+                headers=auth("jeff"),
+                data={
+                    "upload": FileStorage(
+                        stream=BytesIO(data[chunk_idx * 1000 : (chunk_idx + 1) * 1000]),
+                        filename="upload",
+                    ),
+                    "dzuuid": "out_of_order",
+                    "dzchunkindex": chunk_idx,
+                    "dztotalchunks": 3,
+                },
+                content_type="multipart/form-data",
+            )
+        assert resp.status_code == 201
+
+        resp = client.get(url + "/content", headers=auth("jeff"))
+        assert resp.data == data
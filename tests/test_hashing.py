@@ -0,0 +1,88 @@
+import pytest
+from sachet.server.models import User
+from sachet.server.hashing import (
+    HashingPool,
+    HashingBusyError,
+    _hash,
+    _check,
+    needs_rehash,
+)
+
+"""Test password hashing off the request thread."""
+
+
+@pytest.mark.parametrize("workers", [0, 2])
+def test_pool(workers):
+    pool = HashingPool(workers, 4)
+    try:
+        pw_hash = pool.run(_hash, "password", 4)
+        assert pool.run(_check, pw_hash, "password")
+        assert not pool.run(_check, pw_hash, "wrong")
+    finally:
+        pool.shutdown()
+
+
+def test_busy(client, users, app):
+    """Test that logins are refused once too many are pending."""
+    pool = HashingPool(0, 1)
+    # hold the only slot, like a login that is still being hashed
+    pool._slots.acquire()
+    with pytest.raises(HashingBusyError):
+        pool.run(_check, "", "")
+
+    app.extensions["sachet_hashing"] = pool
+    try:
+        resp = client.post(
+            "/users/login", json={"username": "jeff", "password": "1234"}
+        )
+        assert resp.status_code == 503
+        assert resp.headers["Retry-After"] == "1"
+    finally:
+        del app.extensions["sachet_hashing"]
+
+    resp = client.post("/users/login", json={"username": "jeff", "password": "1234"})
+    assert resp.status_code == 200
+
+
+def test_rehash(client, users, app):
+    """Test that hashes are upgraded on login when the configured cost changes."""
+
+    def login():
+        resp = client.post(
+            "/users/login", json={"username": "jeff", "password": "1234"}
+        )
+        assert resp.status_code == 200
+        return User.query.filter_by(username="jeff").first().password
+
+    pw_hash = login()
+    assert pw_hash.startswith("$2b$04$")
+    assert not needs_rehash(pw_hash)
+
+    app.config["BCRYPT_LOG_ROUNDS"] = 5
+    try:
+        assert needs_rehash(pw_hash)
+        pw_hash = login()
+        assert pw_hash.startswith("$2b$05$")
+        assert login() == pw_hash
+
+        pytest.importorskip("argon2")
+        app.config.update(
+            SACHET_PASSWORD_HASH="argon2id",
+            SACHET_ARGON2_TIME_COST=1,
+            SACHET_ARGON2_MEMORY_COST=1024,
+            SACHET_ARGON2_PARALLELISM=1,
+        )
+        assert needs_rehash(pw_hash)
+        pw_hash = login()
+        assert pw_hash.startswith("$argon2id$v=19$m=1024,t=1,p=1$")
+        assert login() == pw_hash
+        assert not _check(pw_hash, "wrong")
+
+        app.config["SACHET_ARGON2_TIME_COST"] = 2
+        assert login().startswith("$argon2id$v=19$m=1024,t=2,p=1$")
+
+        # switching back
+        app.config["SACHET_PASSWORD_HASH"] = "bcrypt"
+        assert login().startswith("$2b$05$")
+    finally:
+        app.config.update(BCRYPT_LOG_ROUNDS=4, SACHET_PASSWORD_HASH="bcrypt")
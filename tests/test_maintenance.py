@@ -0,0 +1,92 @@
+import datetime
+import pytest
+from sachet.server import create_app, db, models, scheduler
+from sachet.server.commands import run_maintenance
+from sachet.server.models import MaintenanceTask, BlacklistToken, Share, User
+from sachet.server.scheduler import Scheduler
+
+
+def test_claim(client):
+    """Test that only one instance may run a task at a time."""
+    timeout = datetime.timedelta(minutes=10)
+
+    assert MaintenanceTask.claim("tokens", "node1", timeout)
+    assert not MaintenanceTask.claim("tokens", "node2", timeout)
+
+    # only the owner can release the task
+    MaintenanceTask.finish("tokens", "node2", datetime.datetime.utcnow())
+    assert not MaintenanceTask.claim("tokens", "node2", timeout)
+
+    MaintenanceTask.finish("tokens", "node1", datetime.datetime.utcnow())
+    assert MaintenanceTask.claim("tokens", "node2", timeout)
+
+    # claims lapse, in case the owner died
+    task = db.session.get(MaintenanceTask, "tokens")
+    task.locked_until = datetime.datetime.utcnow() - datetime.timedelta(seconds=1)
+    db.session.commit()
+    assert MaintenanceTask.claim("tokens", "node1", timeout)
+
+
+@pytest.mark.postgresql
+def test_claim_postgresql(client):
+    """Test that claims use ON CONFLICT on PostgreSQL."""
+    assert "postgresql" in models._on_conflict_inserts
+    timeout = datetime.timedelta(minutes=10)
+    assert MaintenanceTask.claim("tokens", "node1", timeout)
+    assert not MaintenanceTask.claim("tokens", "node2", timeout)
+    assert MaintenanceTask.query.count() == 1
+
+
+def test_scheduler(client, users):
+    """Test that tasks run, and only once per interval."""
+    token = BlacklistToken(User.query.filter_by(username="jeff").first().encode_token())
+    token.expires = datetime.datetime.utcnow() - datetime.timedelta(hours=1)
+    db.session.add(token)
+    valid_token = BlacklistToken(
+        User.query.filter_by(username="dave").first().encode_token()
+    )
+    db.session.add(valid_token)
+
+    share = Share()
+    share.create_date = datetime.datetime.utcnow() - datetime.timedelta(hours=30)
+    db.session.add(share)
+    share_id = share.share_id
+    db.session.commit()
+
+    scheduler = Scheduler(
+        intervals=dict(tokens=3600, shares=3600, uploads=None, expired=None)
+    )
+    assert scheduler.run_pending() == dict(tokens=1, shares=1)
+    assert BlacklistToken.query.count() == 1
+    assert Share.query.filter_by(share_id=share_id).first() is None
+
+    # nothing is due until the interval has passed, even for another instance
+    assert scheduler.run_pending() == {}
+    assert Scheduler(owner="other").run_pending() == dict(uploads=0, expired=0)
+
+
+def test_run_cli(client, cli):
+    """Test running maintenance once from the CLI."""
+    result = cli.invoke(run_maintenance, ["--once"])
+    assert result.exit_code == 0
+    assert "Task 'tokens' removed 0 entries." in result.output
+
+    result = cli.invoke(run_maintenance, ["--once"])
+    assert result.exit_code == 0
+    assert "No maintenance tasks are due." in result.output
+
+
+def test_thread_start(monkeypatch):
+    """Test that the maintenance thread only starts when serving requests."""
+    started = []
+    monkeypatch.setattr(scheduler, "start_thread", lambda app: started.append(app))
+
+    app = create_app(dict(SACHET_MAINTENANCE_THREAD=True))
+    result = app.test_cli_runner().invoke(args=["maintenance", "--help"])
+    assert result.exit_code == 0
+    assert started == []
+
+    with app.test_client() as client:
+        client.get("/nonexistent")
+        client.get("/nonexistent")
+    assert started == [app]
@@ -0,0 +1,119 @@
+import json
+import pytest
+from io import BytesIO
+from sachet.server import create_app, metrics
+from sachet.server.metrics import Counter, Histogram, Metrics
+
+"""Test Prometheus metrics."""
+
+
+@pytest.fixture(scope="module")
+def app():
+    """Flask application, with metrics enabled."""
+    return create_app(dict(SACHET_METRICS=True))
+
+
+def parse(text):
+    """Parse the Prometheus text format into a dictionary of samples."""
+    samples = {}
+    for line in text.splitlines():
+        if line and not line.startswith("#"):
+            name, value = line.rsplit(" ", 1)
+            samples[name] = float(value)
+    return samples
+
+
+def test_render():
+    counter = Counter("requests_total", "Requests.", ("path",))
+    counter.inc(path='/a"b')
+    counter.inc(2, path='/a"b')
+    assert counter.render() == (
+        "# HELP requests_total Requests.\n"
+        "# TYPE requests_total counter\n"
+        'requests_total{path="/a\\"b"} 3'
+    )
+
+    histogram = Histogram("duration_seconds", "Durations.", buckets=(0.1, 1))
+    for value in (0.05, 0.5, 0.5, 5):
+        histogram.observe(value)
+    assert parse(histogram.render()) == {
+        'duration_seconds_bucket{le="0.1"}': 1,
+        'duration_seconds_bucket{le="1"}': 3,
+        'duration_seconds_bucket{le="+Inf"}': 4,
+        "duration_seconds_sum": 6.05,
+        "duration_seconds_count": 4,
+    }
+
+
+def test_metrics(client, users, auth, upload):
+    resp = client.post("/files", headers=auth("jeff"), json={"file_name": "a.bin"})
+    assert resp.status_code == 201
+    url = resp.get_json().get("url")
+
+    resp = upload(url + "/content", BytesIO(b"a" * 400), headers=auth("jeff"))
+    assert resp.status_code == 201
+    resp = client.get(url + "/content", headers=auth("jeff"))
+    assert resp.status_code == 200
+    resp = client.get(
+        url + "/content", headers=auth("jeff", {"Range": "bytes=100-199"})
+    )
+    assert resp.status_code == 206
+
+    resp = client.get("/metrics", headers=auth("no_admin_user"))
+    assert resp.status_code == 403
+
+    resp = client.get("/metrics", headers=auth("administrator"))
+    assert resp.status_code == 200
+    assert resp.mimetype == "text/plain"
+    samples = parse(resp.get_data(as_text=True))
+
+    content = 'endpoint="files_blueprint.files_content_api"'
+    assert samples[f'sachet_requests_total{{{content},method="GET",status="200"}}'] == 1
+    assert samples[f'sachet_requests_total{{{content},method="GET",status="206"}}'] == 1
+    assert (
+        samples[f'sachet_request_duration_seconds_count{{{content},method="GET"}}'] == 2
+    )
+    assert samples["sachet_uploaded_bytes_total"] == 400
+    assert samples["sachet_downloaded_bytes_total"] == 500
+    assert samples["sachet_active_uploads"] == 0
+    assert samples["sachet_upload_merge_duration_seconds_count"] == 1
+    assert samples[f"sachet_db_queries_total{{{content}}}"] > 0
+
+
+def test_aggregate(tmp_path, monkeypatch):
+    """Test adding up the metrics of several workers."""
+    worker1, worker2 = Metrics(), Metrics()
+    worker1["requests"].inc(endpoint="a", method="GET", status=200)
+    worker2["requests"].inc(2, endpoint="a", method="GET", status=200)
+    worker2["merge_duration"].observe(0.5)
+    worker1["active_uploads"].set(3)
+
+    worker1.dump(tmp_path)
+    monkeypatch.setattr(metrics.os, "getpid", lambda: 0)
+    worker2.dump(tmp_path)
+
+    samples = parse(Metrics.load(tmp_path).render())
+    assert samples['sachet_requests_total{endpoint="a",method="GET",status="200"}'] == 3
+    assert samples["sachet_upload_merge_duration_seconds_count"] == 1
+    # gauges are set when scraping
+    assert "sachet_active_uploads" not in samples
+
+
+def test_scrape_token(client, users, app, tmp_path):
+    """Test scraping all workers with a static token."""
+    app.config.update(SACHET_METRICS_TOKEN="secret", SACHET_METRICS_DIR=tmp_path)
+    try:
+        (tmp_path / "0.json").write_text(json.dumps({"uploaded_bytes": [[[], 1000]]}))
+        own = app.extensions["sachet_metrics"]["uploaded_bytes"].snapshot()
+
+        resp = client.get("/metrics", headers={"Authorization": "Bearer wrong"})
+        assert resp.status_code == 401
+        resp = client.get("/metrics", headers={"Authorization": "Bearer secret"})
+        assert resp.status_code == 200
+        samples = parse(resp.get_data(as_text=True))
+        assert samples["sachet_uploaded_bytes_total"] == 1000 + sum(
+            value for _, value in own
+        )
+        assert "sachet_active_uploads" in samples
+    finally:
+        app.config.update(SACHET_METRICS_TOKEN=None, SACHET_METRICS_DIR=None)
@@ -1,6 +1,7 @@
 import pytest
 from math import ceil
 import json
+from sachet.server.views_common import ModelListAPI
 
 """Test ability to paginate endpoint responses."""
 
@@ -173,3 +174,51 @@ def test_invalid(client, auth):
         "/files", headers=auth("jeff"), query_string=dict(page="one", per_page="two")
     )
     assert resp.status_code == 400
+
+    # too many entries per page
+    for per_page in (0, -1, 101):
+        resp = client.get(
+            "/files", headers=auth("jeff"), query_string=dict(per_page=per_page)
+        )
+        assert resp.status_code == 400
+
+
+def test_stream(client, users, auth, monkeypatch):
+    """Test streaming whole lists as newline-delimited JSON."""
+    # stream in several batches
+    monkeypatch.setattr(ModelListAPI, "stream_batch_size", 3)
+
+    shares = set()
+    for i in range(10):
+        resp = client.post(
+            "/files", headers=auth("jeff"), json={"file_name": f"content{i}.bin"}
+        )
+        assert resp.status_code == 201
+        shares.add(resp.get_json().get("url").split("/")[-1])
+
+    resp = client.get(
+        "/files", headers=auth("jeff"), query_string=dict(format="ndjson")
+    )
+    assert resp.status_code == 200
+    assert resp.mimetype == "application/x-ndjson"
+    rows = [json.loads(line) for line in resp.get_data(as_text=True).splitlines()]
+    assert {row["share_id"] for row in rows} == shares
+    assert len(rows) == len(shares)
+
+    # the same fields as in pages
+    resp = client.get("/files", headers=auth("jeff"), query_string=dict(per_page=1))
+    assert set(rows[0]) == set(resp.get_json()["data"][0])
+
+    resp = client.get(
+        "/users", headers=auth("administrator"), query_string=dict(format="ndjson")
+    )
+    assert resp.status_code == 200
+    rows = [json.loads(line) for line in resp.get_data(as_text=True).splitlines()]
+    assert {row["username"] for row in rows} == set(users)
+    assert "password" not in rows[0]
+
+    # listing permissions still apply
+    resp = client.get(
+        "/users", headers=auth("jeff"), query_string=dict(format="ndjson")
+    )
+    assert resp.status_code == 403
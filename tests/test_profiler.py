@@ -0,0 +1,94 @@
+import threading
+import time
+from io import BytesIO
+from sachet.server import profiler
+
+"""Test the sampling profiler."""
+
+
+def spin(stop):
+    while not stop.is_set():
+        sum(range(100))
+
+
+def test_profile(client, users, auth, app):
+    resp = client.get("/admin/profile?seconds=0.1", headers=auth("administrator"))
+    assert resp.status_code == 404
+
+    app.config["SACHET_PROFILER"] = True
+    stop = threading.Event()
+    thread = threading.Thread(target=spin, args=(stop,))
+    thread.start()
+    try:
+        resp = client.get("/admin/profile?seconds=0.1", headers=auth("jeff"))
+        assert resp.status_code == 403
+
+        for query in ("seconds=0", "seconds=1000", "seconds=a", "interval=0"):
+            resp = client.get(f"/admin/profile?{query}", headers=auth("administrator"))
+            assert resp.status_code == 400
+
+        resp = client.get(
+            "/admin/profile?seconds=0.2&interval=0.01",
+            headers=auth("administrator"),
+        )
+        assert resp.status_code == 200
+        lines = resp.get_data(as_text=True).splitlines()
+        spinning = [line for line in lines if "tests.test_profiler.spin" in line]
+        assert spinning
+        stack, count = spinning[0].rsplit(" ", 1)
+        assert stack.startswith("threading.")
+        assert int(count) > 0
+
+        # the profiling thread itself is not sampled
+        assert not any("profiler.sample" in line for line in lines)
+
+        # only one profile at a time
+        with profiler._lock:
+            resp = client.get(
+                "/admin/profile?seconds=0.1", headers=auth("administrator")
+            )
+            assert resp.status_code == 409
+    finally:
+        stop.set()
+        thread.join()
+        app.config["SACHET_PROFILER"] = False
+
+
+def test_background_profile(client, users, auth, app, upload, tmp_path):
+    """Test profiling requests handled while the profile is recorded."""
+    app.config.update(SACHET_PROFILER=True, SACHET_PROFILER_DIR=tmp_path)
+    try:
+        resp = client.post("/files", headers=auth("jeff"), json={"file_name": "a"})
+        url = resp.get_json().get("url") + "/content"
+
+        resp = client.post(
+            "/admin/profile?seconds=0.3&interval=0.001",
+            headers=auth("administrator"),
+        )
+        assert resp.status_code == 202
+        result_url = resp.get_json().get("url")
+
+        resp = client.get(result_url, headers=auth("administrator"))
+        assert resp.status_code == 404
+        resp = client.post("/admin/profile", headers=auth("administrator"))
+        assert resp.status_code == 409
+
+        # this thread handles uploads meanwhile, like a sync worker would
+        method = client.post
+        deadline = time.monotonic() + 10
+        while not list(tmp_path.glob("*.txt")):
+            assert time.monotonic() < deadline
+            resp = upload(
+                url, BytesIO(b"a" * 1000), headers=auth("jeff"), method=method
+            )
+            assert resp.status_code == 201
+            method = client.put
+
+        resp = client.get(result_url, headers=auth("administrator"))
+        assert resp.status_code == 200
+        assert "FileContentAPI.recv_upload" in resp.get_data(as_text=True)
+
+        resp = client.get("/admin/profile/invalid", headers=auth("administrator"))
+        assert resp.status_code == 404
+    finally:
+        app.config.update(SACHET_PROFILER=False, SACHET_PROFILER_DIR="profiles")
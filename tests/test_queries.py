@@ -0,0 +1,175 @@
+import pytest
+import uuid
+from io import BytesIO
+from werkzeug.datastructures import FileStorage
+from sachet.server.models import get_settings
+
+"""Guard the amount of SQL queries each endpoint makes.
+
+Budgets are the amount of statements a request needs today. If a change makes
+an endpoint go over its budget, the failure lists the statements it ran; if a
+change makes it cheaper, lower the budget.
+"""
+
+
+def check_budget(statements, budget):
+    assert len(statements) <= budget, "\n".join(
+        [f"{len(statements)} queries (budget {budget}):", *statements]
+    )
+
+
+def send_chunk(client, url, upload_id, index, total, data, headers):
+    return client.post(
+        url + "/content",
+        headers=headers,
+        data={
+            "upload": FileStorage(stream=BytesIO(data), filename="upload"),
+            "dzuuid": upload_id,
+            "dzchunkindex": index,
+            "dztotalchunks": total,
+        },
+        content_type="multipart/form-data",
+    )
+
+
+def create_share(client, headers={}):
+    resp = client.post("/files", headers=headers, json={"file_name": "a.bin"})
+    assert resp.status_code == 201
+    return resp.get_json()["url"]
+
+
+def test_auth_queries(client, users, auth, queries):
+    with queries() as statements:
+        resp = client.get("/whoami", headers=auth("jeff"))
+    assert resp.status_code == 200
+    check_budget(statements, 1)
+
+    with queries() as statements:
+        resp = client.get("/users/jeff", headers=auth("jeff"))
+    assert resp.status_code == 200
+    check_budget(statements, 1)
+
+    with queries() as statements:
+        resp = client.get("/users/jeff", headers=auth("administrator"))
+    assert resp.status_code == 200
+    check_budget(statements, 2)
+
+    with queries() as statements:
+        resp = client.post(
+            "/users/login", json={"username": "jeff", "password": "1234"}
+        )
+    assert resp.status_code == 200
+    check_budget(statements, 1)
+
+    # the settings row is created by the first request that needs it
+    get_settings()
+    with queries() as statements:
+        resp = client.get("/whoami")
+    assert resp.status_code == 200
+    check_budget(statements, 1)
+
+
+def test_share_queries(client, users, auth, queries):
+    with queries() as statements:
+        url = create_share(client, auth("jeff"))
+    check_budget(statements, 2)
+
+    with queries() as statements:
+        resp = client.get(url, headers=auth("jeff"))
+    assert resp.status_code == 200
+    check_budget(statements, 2)
+
+    with queries() as statements:
+        resp = client.patch(url, headers=auth("jeff"), json={"file_name": "b.bin"})
+    assert resp.status_code == 200
+    check_budget(statements, 3)
+
+    with queries() as statements:
+        resp = client.patch(url, headers=auth("jeff"), json={"owner_name": "dave"})
+    assert resp.status_code == 200
+    check_budget(statements, 4)
+
+    url = create_share(client, auth("jeff"))
+    with queries() as statements:
+        resp = client.delete(url, headers=auth("jeff"))
+    assert resp.status_code == 200
+    check_budget(statements, 4)
+
+
+@pytest.mark.parametrize("shares", [20, 40])
+def test_listing_queries(client, users, auth, queries, shares):
+    """Listing a page costs the same, however many shares there are."""
+    for _ in range(shares):
+        create_share(client, auth("jeff"))
+
+    with queries() as statements:
+        resp = client.get("/files?per_page=15", headers=auth("jeff"))
+    assert resp.status_code == 200
+    assert len(resp.get_json()["data"]) == 15
+    check_budget(statements, 3)
+    # owners are not loaded one by one (the first statement authenticates)
+    assert not any("FROM users" in statement for statement in statements[1:])
+
+
+def test_content_queries(client, users, auth, queries, rand):
+    url = create_share(client, auth("jeff"))
+    upload_id = str(uuid.uuid4())
+    data = rand.randbytes(3000)
+
+    for index in range(2):
+        with queries() as statements:
+            resp = send_chunk(
+                client,
+                url,
+                upload_id,
+                index,
+                3,
+                data[index * 1000 : (index + 1) * 1000],
+                auth("jeff"),
+            )
+        assert resp.status_code == 200
+        check_budget(statements, 6)
+
+    with queries() as statements:
+        resp = send_chunk(client, url, upload_id, 2, 3, data[2000:], auth("jeff"))
+    assert resp.status_code == 201
+    check_budget(statements, 13)
+
+    with queries() as statements:
+        resp = client.get(url + "/content", headers=auth("jeff"))
+    assert resp.status_code == 200
+    assert resp.data == data
+    check_budget(statements, 3)
+
+    with queries() as statements:
+        resp = client.get(
+            url + "/content", headers=auth("jeff", {"Range": "bytes=1000-1999"})
+        )
+    assert resp.status_code == 206
+    check_budget(statements, 3)
+
+
+def test_anonymous_queries(client, users, auth, queries, upload):
+    resp = client.patch(
+        "/admin/settings",
+        headers=auth("administrator"),
+        json={"default_permissions": ["CREATE", "READ"]},
+    )
+    assert resp.status_code == 200
+
+    with queries() as statements:
+        url = create_share(client)
+    check_budget(statements, 2)
+
+    resp = upload(url + "/content", BytesIO(b"a" * 1000))
+    assert resp.status_code == 201
+
+    with queries() as statements:
+        resp = client.get(url)
+    assert resp.status_code == 200
+    check_budget(statements, 2)
+
+    with queries() as statements:
+        resp = client.get(url + "/content")
+    assert resp.status_code == 200
+    check_budget(statements, 3)
@@ -0,0 +1,103 @@
+import pytest
+from io import BytesIO
+from sachet.server.ratelimit import MemoryBackend, SQLiteBackend, parse_limit
+
+"""Test rate limiting."""
+
+
+def test_parse_limit():
+    assert parse_limit("10/minute") == (10 / 60, 10)
+    assert parse_limit("1/second") == (1, 1)
+    for limit in ("10", "ten/minute", "10/fortnight", "0/minute"):
+        with pytest.raises(ValueError):
+            parse_limit(limit)
+
+
+@pytest.mark.parametrize("backend", ["memory", "sqlite"])
+def test_token_bucket(backend, tmp_path):
+    """Test that bursts are allowed, and that buckets refill over time."""
+    if backend == "memory":
+        buckets = MemoryBackend()
+    else:
+        buckets = SQLiteBackend(str(tmp_path / "ratelimit.db"))
+
+    # 3 requests per minute
+    rate, burst = parse_limit("3/minute")
+
+    assert [buckets.take("a", rate, burst, now=0) for i in range(3)] == [0, 0, 0]
+    assert buckets.take("a", rate, burst, now=0) == pytest.approx(20)
+    # other keys have their own bucket
+    assert buckets.take("b", rate, burst, now=0) == 0
+
+    assert buckets.take("a", rate, burst, now=15) == pytest.approx(5)
+    assert buckets.take("a", rate, burst, now=20) == 0
+    assert buckets.take("a", rate, burst, now=20) == pytest.approx(20)
+
+    # buckets don't fill past their capacity
+    assert [buckets.take("a", rate, burst, now=1000) for i in range(4)][-1] > 0
+
+
+def test_prune():
+    buckets = MemoryBackend(max_keys=2)
+    rate, burst = parse_limit("1/second")
+    for key in ("a", "b", "c"):
+        buckets.take(key, rate, burst, now=0)
+    assert len(buckets._buckets) == 3
+    buckets.take("d", rate, burst, now=10)
+    assert list(buckets._buckets) == ["d"]
+
+
+def test_endpoints(client, users, auth, app):
+    """Test that limits apply to endpoints, per user or per IP."""
+    app.config["SACHET_RATE_LIMITS"] = dict(login="2/minute", LIST="1/hour")
+    app.extensions.pop("sachet_ratelimit", None)
+    try:
+        for i in range(2):
+            resp = client.post(
+                "/users/login", json={"username": "jeff", "password": "1234"}
+            )
+            assert resp.status_code == 200
+        resp = client.post(
+            "/users/login", json={"username": "jeff", "password": "1234"}
+        )
+        assert resp.status_code == 429
+        assert 0 < int(resp.headers["Retry-After"]) <= 30
+
+        # limits named after permissions, keyed by user
+        resp = client.get("/files", headers=auth("jeff"))
+        assert resp.status_code == 200
+        resp = client.get("/files", headers=auth("jeff"))
+        assert resp.status_code == 429
+        assert int(resp.headers["Retry-After"]) == 3600
+
+        # unlimited endpoints
+        resp = client.get("/files/" + "0" * 32, headers=auth("jeff"))
+        assert resp.status_code == 404
+    finally:
+        app.config["SACHET_RATE_LIMITS"] = {}
+        app.extensions.pop("sachet_ratelimit", None)
+
+
+def test_endpoint_limits(client, users, auth, app, upload):
+    """Test that endpoint limits have their own buckets."""
+    app.config["SACHET_RATE_LIMITS"] = dict(share_create="1/hour", upload="2/hour")
+    app.extensions.pop("sachet_ratelimit", None)
+    try:
+        resp = client.post("/files", headers=auth("jeff"), json={"file_name": "a"})
+        assert resp.status_code == 201
+        url = resp.get_json().get("url") + "/content"
+        resp = client.post("/files", headers=auth("jeff"), json={"file_name": "b"})
+        assert resp.status_code == 429
+
+        # creating shares did not drain the upload limit, and the other way around
+        resp = upload(url, BytesIO(b"a" * 100), headers=auth("jeff"))
+        assert resp.status_code == 201
+        resp = upload(url, BytesIO(b"b" * 100), headers=auth("jeff"), method=client.put)
+        assert resp.status_code == 201
+        resp = upload(url, BytesIO(b"c" * 100), headers=auth("jeff"), method=client.put)
+        assert resp.status_code == 429
+        resp = client.post("/files", headers=auth("dave"), json={"file_name": "c"})
+        assert resp.status_code == 201
+    finally:
+        app.config["SACHET_RATE_LIMITS"] = {}
+        app.extensions.pop("sachet_ratelimit", None)
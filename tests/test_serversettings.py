@@ -1,7 +1,7 @@
 from bitmask import Bitmask
 from sachet.server.models import Permissions, ServerSettings
 
-server_settings_schema = ServerSettings.get_schema(ServerSettings)
+server_settings_schema = ServerSettings.get_schema()
 
 
 def test_default_perms(client, auth):
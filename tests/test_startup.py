@@ -0,0 +1,62 @@
+import subprocess
+import sys
+from pathlib import Path
+
+"""Test startup costs, to catch import-time regressions.
+
+Every worker and every CLI invocation pays these costs, so modules that are
+only needed by some commands or requests should be imported lazily.
+"""
+
+# modules that are slow to import, and that starting up should not need
+LAZY_MODULES = (
+    "flask_marshmallow",
+    "marshmallow_sqlalchemy",
+    "flask_migrate",
+    "alembic",
+)
+
+# very generous, so that this only catches large regressions
+STARTUP_BUDGET_US = 3_000_000
+
+
+def import_times(code):
+    """Run code in a fresh interpreter with ``-X importtime``.
+
+    Returns a dictionary of module names to a tuple of (cumulative import time
+    in microseconds, whether it was imported at the top level.)
+    """
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=Path(__file__).parent.parent,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+
+    times = {}
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        _, cumulative, name = line.removeprefix("import time:").split("|")
+        top_level = not name[1:].startswith(" ")
+        times[name.strip()] = (int(cumulative), top_level)
+    return times
+
+
+def test_startup():
+    """Creating the app should not import modules it does not need yet."""
+    times = import_times("from sachet.server import create_app; create_app()")
+
+    for module in LAZY_MODULES:
+        assert module not in times, f"{module} is imported at startup"
+
+    total = sum(cumulative for cumulative, top_level in times.values() if top_level)
+    assert total < STARTUP_BUDGET_US
+
+
+def test_lazy_migrate(app):
+    """Migration commands still work once they are needed."""
+    result = app.test_cli_runner().invoke(args=["db", "--help"])
+    assert result.exit_code == 0
+    assert "upgrade" in result.output
@@ -40,6 +40,9 @@ class TestSuite:
         assert sorted([f.name for f in storage.list_files()]) == sorted(
             [f["name"] for f in files]
         )
+        assert sorted([f.name for f in storage.iter_files()]) == sorted(
+            [f["name"] for f in files]
+        )
 
     def test_rename(self, client, rand):
         files = [
@@ -62,3 +65,79 @@ class TestSuite:
             with handle.open(mode="rb") as f:
                 saved_data = f.read()
                 assert saved_data == file["data"]
+
+    def test_handles(self, client, rand):
+        """Getting a handle must not create the file; creating it explicitly does."""
+
+        name = str(UUID(bytes=rand.randbytes(16)))
+
+        handle = storage.get_file(name)
+        assert not handle.exists
+        assert not storage.exists(name)
+        assert name not in [f.name for f in storage.list_files()]
+
+        # deleting a file that doesn't exist is harmless
+        handle.delete()
+
+        handle = storage.create_file(name)
+        assert handle.exists
+        assert storage.exists(name)
+        assert handle.size == 0
+
+        data = rand.randbytes(4000)
+        with storage.get_file(name).open(mode="wb") as f:
+            f.write(data)
+        assert storage.get_file(name).size == len(data)
+
+        storage.get_file(name).delete()
+        assert not storage.exists(name)
+
+    def test_namespaces(self, client, rand):
+        """Files with the same name in different namespaces are separate."""
+
+        name = str(UUID(bytes=rand.randbytes(16)))
+
+        for namespace in storage.namespaces:
+            with storage.get_file(name, namespace=namespace).open(mode="wb") as f:
+                f.write(namespace.encode())
+
+        for namespace in storage.namespaces:
+            assert [f.name for f in storage.list_files(namespace)] == [name]
+            with storage.get_file(name, namespace=namespace).open(mode="rb") as f:
+                assert f.read() == namespace.encode()
+
+        handle = storage.get_file(name, namespace="tmp")
+        handle.delete()
+        handle = storage.get_file(name, namespace="uploads")
+        handle.rename(name + "_new", namespace="tmp")
+        assert not storage.exists(name, namespace="uploads")
+        assert [f.name for f in storage.list_files("tmp")] == [name + "_new"]
+
+        with pytest.raises(ValueError):
+            storage.get_file(name, namespace="invalid")
+
+    def test_replace(self, client, rand):
+        """Renaming over an existing file only works with `overwrite`, and is atomic."""
+
+        name = str(UUID(bytes=rand.randbytes(16)))
+        tmp_name = str(UUID(bytes=rand.randbytes(16)))
+        old_data = rand.randbytes(4000)
+        new_data = rand.randbytes(4000)
+
+        with storage.get_file(name).open(mode="wb") as f:
+            f.write(old_data)
+        with storage.get_file(tmp_name, namespace="tmp").open(mode="wb") as f:
+            f.write(new_data)
+
+        tmp = storage.get_file(tmp_name, namespace="tmp")
+        with pytest.raises(OSError):
+            tmp.rename(name, namespace="shares")
+
+        # a reader that opened the file before the replacement sees the old data
+        with storage.get_file(name).open(mode="rb") as reader:
+            tmp.rename(name, namespace="shares", overwrite=True)
+            assert reader.read() == old_data
+
+        assert not storage.exists(tmp_name, namespace="tmp")
+        with storage.get_file(name).open(mode="rb") as f:
+            assert f.read() == new_data
@@ -0,0 +1,44 @@
+import json
+import pytest
+from io import BytesIO
+from sachet.server import create_app
+
+"""Test timing of request phases."""
+
+
+@pytest.fixture(scope="module")
+def app():
+    """Flask application, with request timing enabled."""
+    return create_app(dict(SACHET_SERVER_TIMING=True, SACHET_TIMING_LOG=True))
+
+
+def test_timing(client, users, auth, upload, caplog):
+    resp = client.post("/files", headers=auth("jeff"), json={"file_name": "a.bin"})
+    assert resp.status_code == 201
+    url = resp.get_json().get("url")
+    resp = upload(url + "/content", BytesIO(b"a" * 400), headers=auth("jeff"))
+    assert resp.status_code == 201
+
+    caplog.clear()
+    with caplog.at_level("INFO", logger="sachet.server.timing"):
+        resp = client.get(url + "/content", headers=auth("jeff"))
+    assert resp.status_code == 200
+
+    phases = {
+        metric.split(";")[0]: float(metric.split("dur=")[1])
+        for metric in resp.headers["Server-Timing"].split(", ")
+    }
+    for name in ("jwt", "user", "db", "storage", "total"):
+        assert phases[name] >= 0
+    assert phases["total"] >= phases["storage"]
+
+    [record] = [r for r in caplog.records if r.name == "sachet.server.timing"]
+    logged = json.loads(record.getMessage())
+    assert logged["endpoint"] == "files_blueprint.files_content_api"
+    assert logged["status"] == 200
+    assert logged["phases"]["db"]["count"] >= 3
+    assert set(logged["phases"]) == set(phases) - {"total"}
+
+    # anonymous requests look up the server settings instead
+    resp = client.get(url + "/content")
+    assert "settings;dur=" in resp.headers["Server-Timing"]
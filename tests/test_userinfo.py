@@ -3,7 +3,7 @@ from bitmask import Bitmask
 from sachet.server.models import Permissions, User
 from datetime import datetime
 
-user_schema = User.get_schema(User)
+user_schema = User.get_schema()
 
 
 def test_get(client, auth, validate_info):